@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+
+from Metrics import Histogram
+from RateLimiter import RateLimiter
+from Repetitions import repeat, repetition_counts
+
+
+# RateLimiter Throughput Benchmark
+# Pushes `total` sync tasks through a limiter whose rate is high enough that the
+# admission path, not the window, is the bottleneck, and reports tasks per second
+# of wall time.
+async def run_throughput(engine: str, rate: int, total: int, concurrency: int) -> dict:
+    per: int = 1_000_000_000
+    rateLimiter: RateLimiter = RateLimiter(
+        rate, per, engine=engine, max_concurrency=concurrency
+    )
+    executed: int = 0
+
+    def task() -> None:
+        nonlocal executed
+        executed += 1
+
+    start: int = time.perf_counter_ns()
+    for _ in range(total):
+        await rateLimiter.push(task)
+    while executed < total:
+        await asyncio.sleep(0.001)
+    elapsed: int = time.perf_counter_ns() - start
+
+    return {
+        "engine": engine,
+        "rate": rate,
+        "max_concurrency": concurrency,
+        "tasks": total,
+        "tasks_per_second": total * 1_000_000_000 / elapsed,
+    }
+
+
+# Per-push Latency Benchmark
+# `producers` tasks push into one limiter concurrently, while the window is
+# saturated, and the time spent inside each push call is recorded.
+async def run_push_latency(producers: int, pushes: int, rate: int) -> dict:
+    rateLimiter: RateLimiter = RateLimiter(rate, 1_000_000_000)
+    latency: Histogram = Histogram()
+
+    async def producer() -> None:
+        for _ in range(pushes):
+            start: int = time.perf_counter_ns()
+            await rateLimiter.push(lambda: None)
+            latency.record(time.perf_counter_ns() - start)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(producer() for _ in range(producers)))
+    queued: int = len(rateLimiter.pendingTasks)
+    # Lifts the rate so the backlog drains through the limiter's own dispatch,
+    # leaving no wakeup pending once the benchmark is over
+    rateLimiter.set_rate(10**9)
+    while rateLimiter.draining:
+        await asyncio.sleep(0.001)
+
+    return {
+        "producers": producers,
+        "pushes": producers * pushes,
+        "queued": queued,
+        "push_p50_ns": latency.quantile(0.5),
+        "push_p99_ns": latency.quantile(0.99),
+        "push_max_ns": latency.max,
+    }
+
+
+# Memory per Instance Benchmark
+# Measures the bytes allocated per idle limiter with tracemalloc, after each
+# limiter has admitted `rate` tasks, so the window holds its full history.
+async def run_memory(engine: str, rate: int, instances: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    limiters: list[RateLimiter] = []
+    for _ in range(instances):
+        rateLimiter: RateLimiter = RateLimiter(rate, 1_000_000_000, engine=engine)
+        for _ in range(rate):
+            rateLimiter.try_acquire()
+        limiters.append(rateLimiter)
+    after: int = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        "engine": engine,
+        "rate": rate,
+        "bytes_per_instance": (after - before) / instances,
+    }
+
+
+async def rate_limiter_benchmark(quick: bool = False) -> list[dict]:
+    total: int = 20_000 if quick else 200_000
+    warmups, repetitions = repetition_counts(quick)
+    results: list[dict] = []
+
+    for engine in ("SLIDING_WINDOW", "GCRA"):
+        for concurrency in (1, 16):
+            result: dict = await repeat(
+                functools.partial(run_throughput, engine, 10**9, total, concurrency),
+                ("tasks_per_second",),
+                warmups,
+                repetitions,
+            )
+            print(
+                "throughput {engine:>14}, concurrency={max_concurrency}: "
+                "{tasks_per_second:,.0f} ± {tasks_per_second_stdev:,.0f} tasks/s".format(
+                    **result
+                )
+            )
+            results.append({"benchmark": "throughput", **result})
+
+    for producers in (1, 10, 100):
+        result = await repeat(
+            functools.partial(
+                run_push_latency, producers, 1_000 if quick else 5_000, 1_000
+            ),
+            ("queued", "push_p50_ns", "push_p99_ns", "push_max_ns"),
+            warmups,
+            repetitions,
+        )
+        print(
+            "push latency, producers={producers}: p50={push_p50_ns:,.0f} ns "
+            "p99={push_p99_ns:,.0f} ± {push_p99_ns_stdev:,.0f} ns".format(**result)
+        )
+        results.append({"benchmark": "push_latency", **result})
+
+    for engine in ("SLIDING_WINDOW", "GCRA"):
+        for rate in (10, 1_000):
+            result = await repeat(
+                functools.partial(run_memory, engine, rate, 100 if quick else 1_000),
+                ("bytes_per_instance",),
+                warmups,
+                repetitions,
+            )
+            print(
+                "memory {engine:>14}, rate={rate}: "
+                "{bytes_per_instance:,.0f} bytes/instance".format(**result)
+            )
+            results.append({"benchmark": "memory", **result})
+
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(rate_limiter_benchmark())
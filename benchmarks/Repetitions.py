@@ -0,0 +1,32 @@
+import statistics
+from collections.abc import Awaitable, Callable
+
+
+# Benchmark Repetitions
+# Runs a benchmark `warmups` times and discards those results, then runs it
+# `repetitions` times. Each measured field is reported as the median of the
+# repetitions, with its mean and standard deviation next to it, as pyperf does.
+# The other fields are the benchmark's parameters, taken from the first repetition.
+def repetition_counts(quick: bool) -> tuple[int, int]:
+    return (1, 3) if quick else (1, 5)
+
+
+async def repeat(
+    run: Callable[[], Awaitable[dict]],
+    measured: tuple[str, ...],
+    warmups: int,
+    repetitions: int,
+) -> dict:
+    for _ in range(warmups):
+        await run()
+    samples: list[dict] = [await run() for _ in range(repetitions)]
+
+    result: dict = dict(samples[0])
+    for key in measured:
+        values: list[float] = [sample[key] for sample in samples]
+        result[key] = statistics.median(values)
+        result[f"{key}_mean"] = statistics.mean(values)
+        result[f"{key}_stdev"] = statistics.stdev(values) if len(values) > 1 else 0.0
+    result["warmups"] = warmups
+    result["repetitions"] = repetitions
+    return result
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from RateLimiterBenchmark import rate_limiter_benchmark
+from Repetitions import repetition_counts
+from TimerJitterBenchmark import timer_jitter_benchmark
+from TimerTickBenchmark import timer_tick_benchmark
+
+
+# Benchmark Suite
+# Runs every benchmark on the default asyncio loop and, when installed, on uvloop,
+# and writes the results to a JSON file so they can be compared across releases:
+#   python benchmarks/RunBenchmarks.py --output results.json
+#   python benchmarks/RunBenchmarks.py --quick --loop default
+def loop_factories(choice: str) -> dict:
+    factories: dict = {}
+    if choice in ("default", "all"):
+        factories["default"] = asyncio.new_event_loop
+    if choice in ("uvloop", "all"):
+        try:
+            import uvloop
+        except ImportError:
+            if choice == "uvloop":
+                raise SystemExit("uvloop is not installed")
+            print("uvloop is not installed, skipping it")
+        else:
+            factories["uvloop"] = uvloop.new_event_loop
+    return factories
+
+
+BENCHMARKS: dict = {
+    "timer_tick": timer_tick_benchmark,
+    "timer_jitter": timer_jitter_benchmark,
+    "rate_limiter": rate_limiter_benchmark,
+}
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--loop", choices=("default", "uvloop", "all"), default="all")
+    parser.add_argument("--quick", action="store_true", help="smaller populations")
+    parser.add_argument("--only", choices=tuple(BENCHMARKS), action="append")
+    args: argparse.Namespace = parser.parse_args()
+
+    report: dict = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "quick": args.quick,
+        "warmups": repetition_counts(args.quick)[0],
+        "repetitions": repetition_counts(args.quick)[1],
+        "results": {},
+    }
+    for loop_name, factory in loop_factories(args.loop).items():
+        report["results"][loop_name] = {}
+        for name in args.only or BENCHMARKS:
+            print(f"== {name} on {loop_name} loop")
+            with asyncio.Runner(loop_factory=factory) as runner:
+                report["results"][loop_name][name] = runner.run(
+                    BENCHMARKS[name](args.quick)
+                )
+
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
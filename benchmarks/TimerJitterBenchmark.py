@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+
+from Metrics import Histogram
+from Repetitions import repeat, repetition_counts
+from Timer import Timer
+from TimerWheel import TimerWheel
+
+
+# Timer Jitter Benchmark
+# Runs `count` timers with a sync callback at the given interval through each tick path
+# and reports how late ticks fire (tick lateness, from the timers' own metrics) and the
+# CPU time spent per tick.
+async def run_jitter(
+    count: int, timeout_ns: int, duration_s: float, tick_mode: str, use_wheel: bool
+) -> dict:
+    wheel: TimerWheel | None = TimerWheel() if use_wheel else None
+    timers: list[Timer] = [
+        Timer(timeout_ns, lambda: None, tick_mode=tick_mode, wheel=wheel, metrics=True)
+        for _ in range(count)
+    ]
+
+    cpu_start: float = time.process_time()
+    for timer in timers:
+        timer.start()
+    await asyncio.sleep(duration_s)
+    for timer in timers:
+        timer.stop()
+    cpu_elapsed: float = time.process_time() - cpu_start
+
+    lateness: Histogram = Histogram()
+    for timer in timers:
+        lateness.merge(timer.metrics.tick_lateness)
+    ticks: int = lateness.count
+
+    return {
+        "mode": "WHEEL" if use_wheel else tick_mode,
+        "timers": count,
+        "timeout_ns": timeout_ns,
+        "ticks": ticks,
+        "cpu_ns_per_tick": cpu_elapsed * 1_000_000_000 / ticks if ticks > 0 else 0.0,
+        "lateness_p50_ns": lateness.quantile(0.5),
+        "lateness_p99_ns": lateness.quantile(0.99),
+        "lateness_max_ns": lateness.max,
+    }
+
+
+async def timer_jitter_benchmark(quick: bool = False) -> list[dict]:
+    counts: tuple[int, ...] = (100,) if quick else (100, 1_000, 10_000)
+    timeouts_ns: tuple[int, ...] = (
+        (10_000_000,) if quick else (1_000_000, 10_000_000, 100_000_000)
+    )
+    duration_s: float = 0.5 if quick else 2.0
+    warmups, repetitions = repetition_counts(quick)
+    results: list[dict] = []
+    for count in counts:
+        for timeout_ns in timeouts_ns:
+            for tick_mode, use_wheel in (
+                ("TASK", False),
+                ("CALL_AT", False),
+                ("TASK", True),
+            ):
+                result: dict = await repeat(
+                    functools.partial(
+                        run_jitter, count, timeout_ns, duration_s, tick_mode, use_wheel
+                    ),
+                    (
+                        "ticks",
+                        "cpu_ns_per_tick",
+                        "lateness_p50_ns",
+                        "lateness_p99_ns",
+                        "lateness_max_ns",
+                    ),
+                    warmups,
+                    repetitions,
+                )
+                print(
+                    "{mode:>8}: timers={timers}, timeout={timeout_ns} ns, "
+                    "cpu/tick={cpu_ns_per_tick:,.0f} ± {cpu_ns_per_tick_stdev:,.0f} ns, "
+                    "lateness p50={lateness_p50_ns:,.0f} ns "
+                    "p99={lateness_p99_ns:,.0f} ns".format(**result)
+                )
+                results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(timer_jitter_benchmark())
@@ -0,0 +1,150 @@
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+
+from Repetitions import repeat, repetition_counts
+from Timer import Timer
+from TimerWheel import TimerWheel
+
+
+# Timer Tick Benchmark
+# Runs the same population of timers with a sync callback through each tick path
+# and reports ticks/sec of CPU time and the number of asyncio Tasks created per tick.
+# Every Task carries its own coroutine frame, so tasks per tick is the dominant
+# per-tick allocation of the TASK path. A second pass runs under tracemalloc and
+# reports the blocks and bytes still allocated per tick, from a diff of the
+# snapshots taken before and after the ticks.
+async def run_timers(
+    count: int, timeout_ns: int, duration_s: float, tick_mode: str, use_wheel: bool
+) -> dict:
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    tasks_created: int = 0
+    ticks: int = 0
+
+    def counting_task_factory(loop, coro, **kwargs):
+        nonlocal tasks_created
+        tasks_created += 1
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    def callback() -> None:
+        nonlocal ticks
+        ticks += 1
+
+    wheel: TimerWheel | None = TimerWheel() if use_wheel else None
+    timers: list[Timer] = [
+        Timer(timeout_ns, callback, tick_mode=tick_mode, wheel=wheel)
+        for _ in range(count)
+    ]
+
+    loop.set_task_factory(counting_task_factory)
+    cpu_start: float = time.process_time()
+    for timer in timers:
+        timer.start()
+    await asyncio.sleep(duration_s)
+    for timer in timers:
+        timer.stop()
+    cpu_elapsed: float = time.process_time() - cpu_start
+    loop.set_task_factory(None)
+
+    return {
+        "mode": "WHEEL" if use_wheel else tick_mode,
+        "ticks": ticks,
+        "ticks_per_cpu_second": ticks / cpu_elapsed if cpu_elapsed > 0 else 0.0,
+        "tasks_per_tick": tasks_created / ticks if ticks > 0 else 0.0,
+    }
+
+
+# Allocation Benchmark
+# Starts the timers, lets every one of them tick once, then diffs the tracemalloc
+# snapshots taken around `duration_s` of further ticks. Tracing slows the ticks
+# down, so this pass is kept apart from the CPU time measurement.
+async def trace_timers(
+    count: int, timeout_ns: int, duration_s: float, tick_mode: str, use_wheel: bool
+) -> dict:
+    ticks: int = 0
+
+    def callback() -> None:
+        nonlocal ticks
+        ticks += 1
+
+    wheel: TimerWheel | None = TimerWheel() if use_wheel else None
+    timers: list[Timer] = [
+        Timer(timeout_ns, callback, tick_mode=tick_mode, wheel=wheel)
+        for _ in range(count)
+    ]
+
+    tracemalloc.start()
+    for timer in timers:
+        timer.start()
+    await asyncio.sleep(2 * timeout_ns / 1_000_000_000)
+    gc.collect()
+    before: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+    ticks_before: int = ticks
+    await asyncio.sleep(duration_s)
+    gc.collect()
+    after: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+    traced: int = ticks - ticks_before
+    for timer in timers:
+        timer.stop()
+    tracemalloc.stop()
+
+    stats: list[tracemalloc.StatisticDiff] = after.compare_to(before, "filename")
+    return {
+        "blocks_per_tick": (
+            sum(stat.count_diff for stat in stats) / traced if traced > 0 else 0.0
+        ),
+        "bytes_per_tick": (
+            sum(stat.size_diff for stat in stats) / traced if traced > 0 else 0.0
+        ),
+    }
+
+
+async def timer_tick_benchmark(quick: bool = False) -> list[dict]:
+    count: int = 2_000
+    timeout_ns: int = 10_000_000
+    duration_s: float = 1.0 if quick else 3.0
+    print(f"{count} timers, timeout={timeout_ns} ns, duration={duration_s} s")
+    warmups, repetitions = repetition_counts(quick)
+    results: list[dict] = []
+    for tick_mode, use_wheel in (("TASK", False), ("CALL_AT", False), ("TASK", True)):
+
+        async def run() -> dict:
+            result: dict = await run_timers(
+                count, timeout_ns, duration_s, tick_mode, use_wheel
+            )
+            result.update(
+                await trace_timers(count, timeout_ns, 1.0, tick_mode, use_wheel)
+            )
+            return result
+
+        result: dict = await repeat(
+            run,
+            (
+                "ticks",
+                "ticks_per_cpu_second",
+                "tasks_per_tick",
+                "blocks_per_tick",
+                "bytes_per_tick",
+            ),
+            warmups,
+            repetitions,
+        )
+        print(
+            "{mode:>8}: ticks={ticks:.0f}, ticks/cpu-sec={ticks_per_cpu_second:,.0f} "
+            "± {ticks_per_cpu_second_stdev:,.0f}, "
+            "tasks/tick={tasks_per_tick:.2f}, blocks/tick={blocks_per_tick:+.3f}, "
+            "bytes/tick={bytes_per_tick:+.1f}".format(**result)
+        )
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(timer_tick_benchmark())
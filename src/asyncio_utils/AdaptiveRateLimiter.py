@@ -0,0 +1,268 @@
+import asyncio
+import concurrent.futures
+from collections.abc import Awaitable, Callable, Iterable
+
+try:
+    from .Metrics import Histogram
+    from .RateLimiter import Callback, RateLimiter, TaskHandle, WaitedTask
+except ImportError:
+    from Metrics import Histogram
+    from RateLimiter import Callback, RateLimiter, TaskHandle, WaitedTask
+
+
+# Decides whether an exception raised by a task means the downstream is overloaded
+CongestionPredicate = Callable[[Exception], bool]
+
+
+def always_congested(error: Exception) -> bool:
+    return True
+
+
+"""
+    A task whose outcome and latency are reported to its AdaptiveRateLimiter.
+    Exceptions are reported, then raised as if the task were not wrapped.
+"""
+
+
+class ObservedTask:
+    __slots__ = ("task", "limiter")
+
+    def __init__(self, task: Callable, limiter: "AdaptiveRateLimiter") -> None:
+        self.task: Callable = task
+        self.limiter: AdaptiveRateLimiter = limiter
+
+    def __call__(self):
+        started: int = self.limiter.clock.monotonic_ns()
+        try:
+            result = self.task()
+        except Exception as e:
+            self.limiter.onOutcome(started, e)
+            raise
+        if asyncio.iscoroutine(result):
+            return self.settle(started, result)
+        self.limiter.onOutcome(started, None)
+        return result
+
+    async def settle(self, started: int, result: Awaitable):
+        try:
+            value = await result
+        except Exception as e:
+            self.limiter.onOutcome(started, e)
+            raise
+        self.limiter.onOutcome(started, None)
+        return value
+
+
+"""
+    Implements a rate limiter whose rate follows the capacity the downstream system
+    actually has, by additive increase / multiplicative decrease (AIMD):
+    - a congestion signal, i.e. a task raising an exception accepted by
+      is_congestion or an explicit feedback(congested=True), multiplies the rate
+      by `decrease` right away, at most once per `per`, so a burst of errors
+      caused by one overloaded window only counts once.
+    - at the end of every `per` interval without congestion, the rate is
+      decreased too if the latency quantile of the interval's tasks exceeds
+      latency_target_ns, and otherwise increased by `increase` if tasks had to
+      wait for the limiter, so an idle limiter does not inflate its rate.
+    The rate is changed with set_rate, queued tasks are kept.
+"""
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    param rate: the initial maximum number of tasks allowed in the time window.
+    param per: the time window in nanoseconds, also the AIMD control interval.
+    param min_rate: the rate is never decreased below it.
+    param max_rate: the rate is never increased above it, unbounded by default.
+    param increase: added to the rate after an uncongested, saturated interval.
+    param decrease: factor, between 0 and 1, applied to the rate on congestion.
+    param latency_target_ns: optional bound on the latency quantile of tasks,
+                             measured from a task starting to it completing.
+    param latency_quantile: the quantile compared with latency_target_ns.
+    param is_congestion: which task exceptions signal congestion, e.g.
+                         lambda e: getattr(e, "status", None) == 429,
+                         defaults to every exception.
+    Other keyword arguments are passed to RateLimiter.
+    """
+
+    def __init__(
+        self,
+        rate: int,
+        per: int,
+        min_rate: int = 1,
+        max_rate: int | None = None,
+        increase: int = 1,
+        decrease: float = 0.5,
+        latency_target_ns: int | None = None,
+        latency_quantile: float = 0.9,
+        is_congestion: CongestionPredicate = always_congested,
+        **options,
+    ) -> None:
+        if min_rate <= 0:
+            raise ValueError("min_rate must be a positive integer")
+        if max_rate is not None and max_rate < min_rate:
+            raise ValueError("max_rate must not be lower than min_rate")
+        if not min_rate <= rate <= (rate if max_rate is None else max_rate):
+            raise ValueError("rate must lie between min_rate and max_rate")
+        if increase <= 0:
+            raise ValueError("increase must be a positive integer")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must lie between 0 and 1")
+        if not 0 < latency_quantile <= 1:
+            raise ValueError("latency_quantile must lie between 0 and 1")
+        super().__init__(rate, per, **options)
+
+        self.minRate: int = min_rate
+        self.maxRate: int | None = max_rate
+        self.increase: int = increase
+        self.decrease: float = decrease
+        self.latencyTarget: int | None = latency_target_ns
+        self.latencyQuantile: float = latency_quantile
+        self.isCongestion: CongestionPredicate = is_congestion
+        # State of the current control interval
+        self.intervalStart: int = self.clock.monotonic_ns()
+        self.latencies: Histogram = Histogram()
+        # Set once a task had to wait for the limiter during the interval
+        self.saturated: bool = False
+        self.lastDecrease: int | None = None
+
+    """
+        Reports the outcome of work admitted by the limiter, for work whose outcome
+        the limiter cannot see, such as the work done after acquire(), or a
+        throttling response that did not raise.
+        param congested: True if the downstream signalled overload, e.g. a 429.
+        param latency_ns: optional latency of the work, for latency_target_ns.
+    """
+
+    def feedback(self, congested: bool = False, latency_ns: int | None = None) -> None:
+        now: int = self.clock.monotonic_ns()
+        if congested:
+            self.onCongestion(now)
+            return
+        if latency_ns is not None:
+            self.latencies.record(latency_ns)
+        self.evaluate(now)
+
+    def onOutcome(self, started: int, error: Exception | None) -> None:
+        now: int = self.clock.monotonic_ns()
+        if error is not None and self.isCongestion(error):
+            self.onCongestion(now)
+            return
+        self.latencies.record(now - started)
+        self.evaluate(now)
+
+    def onCongestion(self, now: int) -> None:
+        # Signals within `per` of a decrease come from tasks admitted at the old rate
+        if self.lastDecrease is not None and now - self.lastDecrease < self.per:
+            return
+        self.decreaseRate(now)
+
+    # Closes the control interval once `per` has elapsed
+    def evaluate(self, now: int) -> None:
+        if now - self.intervalStart < self.per:
+            return
+        if (
+            self.latencyTarget is not None
+            and self.latencies.count > 0
+            and self.latencies.quantile(self.latencyQuantile) > self.latencyTarget
+        ):
+            self.decreaseRate(now)
+            return
+        if self.saturated:
+            self.startInterval(
+                (
+                    self.rate + self.increase
+                    if self.maxRate is None
+                    else min(self.maxRate, self.rate + self.increase)
+                ),
+                now,
+            )
+        else:
+            self.startInterval(self.rate, now)
+
+    def decreaseRate(self, now: int) -> None:
+        self.lastDecrease = now
+        self.startInterval(max(self.minRate, int(self.rate * self.decrease)), now)
+
+    # Applies a rate and opens a new control interval
+    def startInterval(self, rate: int, now: int) -> None:
+        self.intervalStart = now
+        self.latencies.reset()
+        self.saturated = len(self.pendingTasks) > 0
+        if rate != self.rate:
+            self.set_rate(rate)
+
+    def observe(self, task: Callable) -> Callable:
+        # Handles and waited tasks wrap a task that is observed already, or,
+        # for acquire, no work at all
+        if type(task) is TaskHandle or type(task) is WaitedTask:
+            return task
+        return ObservedTask(self.offload(task), self)
+
+    # Observed tasks wrap a task that is offloaded already
+    def offload(self, task: Callback) -> Callback:
+        if type(task) is ObservedTask:
+            return task
+        return super().offload(task)
+
+    def enqueue(
+        self,
+        task: Callback,
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> None:
+        self.saturated = True
+        super().enqueue(task, flow, deadline_ns, cost)
+
+    def enqueueMany(
+        self,
+        tasks: Iterable[Callback],
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> None:
+        self.saturated = True
+        super().enqueueMany(tasks, flow, deadline_ns, cost)
+
+    def onDropped(self, task: Callback, error: Exception) -> None:
+        super().onDropped(task.task if type(task) is ObservedTask else task, error)
+
+    async def push(
+        self,
+        task: Callback,
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> None:
+        await super().push(self.observe(task), flow, deadline_ns, cost)
+
+    async def push_many(
+        self,
+        tasks: Iterable[Callback],
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> None:
+        await super().push_many(
+            (self.observe(task) for task in tasks), flow, deadline_ns, cost
+        )
+
+    async def submit(
+        self,
+        task: Callable,
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> TaskHandle:
+        return await super().submit(self.observe(task), flow, deadline_ns, cost)
+
+    def push_threadsafe(
+        self, task: Callback, flow: str | None = None, cost: int = 1
+    ) -> None:
+        super().push_threadsafe(self.observe(task), flow, cost)
+
+    def submit_threadsafe(
+        self, task: Callback, flow: str | None = None, cost: int = 1
+    ) -> concurrent.futures.Future:
+        return super().submit_threadsafe(self.observe(task), flow, cost)
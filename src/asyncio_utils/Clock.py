@@ -0,0 +1,136 @@
+import asyncio
+import math
+import selectors
+import time
+from abc import ABC, abstractmethod
+
+"""
+  Source of time for timers and rate limiters. Monotonic time must advance
+  like the loop's own clock, so delays computed from it can be handed to
+  call_later / call_at / asyncio.sleep.
+"""
+
+
+class Clock(ABC):
+    # Monotonic time in nanoseconds, used for every deadline and window
+    @abstractmethod
+    def monotonic_ns(self) -> int:
+        pass
+
+    # Wall-clock time in nanoseconds since the epoch
+    @abstractmethod
+    def time_ns(self) -> int:
+        pass
+
+    # Wall-clock time of a monotonic time, valid across restarts of the process
+    def to_wall_ns(self, monotonic_ns: int) -> int:
+        return monotonic_ns + self.time_ns() - self.monotonic_ns()
+
+    # Monotonic time of a wall-clock time, e.g. one saved by another process
+    def to_monotonic_ns(self, wall_ns: int) -> int:
+        return wall_ns - self.time_ns() + self.monotonic_ns()
+
+
+class SystemClock(Clock):
+    def monotonic_ns(self) -> int:
+        return time.monotonic_ns()
+
+    def time_ns(self) -> int:
+        return time.time_ns()
+
+
+SYSTEM_CLOCK: SystemClock = SystemClock()
+
+
+"""
+  Virtual time that only moves when advanced, used by SimulatedEventLoop.
+  Wall-clock time is the virtual time itself, counted from the epoch.
+"""
+
+
+class SimulatedClock(Clock):
+    """
+    param start_ns: the virtual time the clock starts at.
+    """
+
+    def __init__(self, start_ns: int = 0) -> None:
+        self.now_ns: int = start_ns
+
+    def monotonic_ns(self) -> int:
+        return self.now_ns
+
+    def time_ns(self) -> int:
+        return self.now_ns
+
+    def advance(self, ns: int) -> None:
+        if ns < 0:
+            raise ValueError("A clock cannot go backwards")
+        self.now_ns += ns
+
+
+"""
+  Returns the clock that matches the loop's time, the loop's own clock for a
+  SimulatedEventLoop and the system clock for any other loop.
+  param loop: defaults to the running loop, if any.
+"""
+
+
+def loop_clock(loop: asyncio.AbstractEventLoop | None = None) -> Clock:
+    if loop is None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return SYSTEM_CLOCK
+    clock = getattr(loop, "clock", None)
+    return clock if isinstance(clock, Clock) else SYSTEM_CLOCK
+
+
+"""
+  Selector that, instead of blocking until the next timer is due, moves the
+  virtual clock forward to it. Real IO and wakeups from other threads are
+  still polled, and the loop blocks for real only when no timer is scheduled.
+"""
+
+
+class VirtualTimeSelector(selectors.DefaultSelector):
+    def __init__(self, clock: SimulatedClock) -> None:
+        super().__init__()
+        self.clock: SimulatedClock = clock
+
+    def select(self, timeout: float | None = None) -> list:
+        if timeout is None:
+            return super().select(None)
+        events: list = super().select(0)
+        if not events and timeout > 0:
+            # Rounded up, so the timer that set the timeout is always due
+            self.clock.advance(math.ceil(timeout * 1_000_000_000))
+        return events
+
+
+"""
+  Event loop running on virtual time: whenever every task is waiting on a timer,
+  time jumps straight to the next deadline. Hours of timer and rate limiter
+  behavior run in milliseconds, deterministically.
+
+  Timers and rate limiters constructed inside the loop pick up its clock.
+  Run a coroutine on it with asyncio.run(main(), loop_factory=SimulatedEventLoop)
+  or asyncio.Runner(loop_factory=SimulatedEventLoop).
+  Work done in other threads or real IO still takes real time, during which
+  virtual time may move on.
+"""
+
+
+class SimulatedEventLoop(asyncio.SelectorEventLoop):
+    """
+    param start_ns: the virtual time the loop starts at.
+    """
+
+    def __init__(self, start_ns: int = 0) -> None:
+        self.clock: SimulatedClock = SimulatedClock(start_ns)
+        self.start_ns: int = start_ns
+        super().__init__(VirtualTimeSelector(self.clock))
+
+    # Counted from start_ns, a float holding an epoch-based time in seconds is too
+    # coarse for the loop to ever find its timers due
+    def time(self) -> float:
+        return (self.clock.now_ns - self.start_ns) / 1_000_000_000
@@ -0,0 +1,342 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+
+try:
+    from .Clock import SYSTEM_CLOCK, Clock
+    from .RateLimiter import RateLimiter
+except ImportError:
+    from Clock import SYSTEM_CLOCK, Clock
+    from RateLimiter import RateLimiter
+
+
+"""
+  Protocol of the cluster-wide admission state used by DistributedRateLimiter.
+  The budget is counted in fixed windows of `per` nanoseconds aligned on wall-clock
+  time, so every node agrees on the window index without talking to each other.
+"""
+
+
+class AdmissionStore(ABC):
+    """
+    Leases up to `permits` permits of `key`'s budget for one window.
+    Returns the number of permits granted, 0 once the window's budget is spent.
+    param key: the rate limited key.
+    param window: index of the window, wall-clock time // per.
+    param permits: the number of permits requested.
+    param rate: the budget of a window.
+    param ttl_ms: how long the store has to remember the window.
+    """
+
+    @abstractmethod
+    async def lease(
+        self, key: str, window: int, permits: int, rate: int, ttl_ms: int
+    ) -> int:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class RespError(Exception):
+    pass
+
+
+"""
+  AdmissionStore speaking the Redis protocol (RESP) over a single connection,
+  compatible with Redis, Valkey, KeyDB and similar servers.
+  Each window is a counter key incremented by the leased permits. A lease is a
+  single script run atomically by the server, it grants what is left of the
+  budget, up to the permits requested, so the counter never grants more than
+  `rate` permits per window across the cluster.
+"""
+
+# KEYS[1]: the window's counter, ARGV: permits requested, rate, ttl in ms.
+# Returns the permits granted
+LEASE_SCRIPT: str = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local granted = math.min(tonumber(ARGV[1]), math.max(0, tonumber(ARGV[2]) - used))
+if granted > 0 then
+    redis.call('INCRBY', KEYS[1], granted)
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return granted
+"""
+
+
+class RedisAdmissionStore(AdmissionStore):
+    """
+    param host / port: address of the server.
+    param prefix: prepended to every counter key.
+    """
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 6379, prefix: str = "rl:"
+    ) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.prefix: str = prefix
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        # Replies are matched to commands by order, one pipeline at a time
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+    async def lease(
+        self, key: str, window: int, permits: int, rate: int, ttl_ms: int
+    ) -> int:
+        counter: str = f"{self.prefix}{key}:{window}"
+        return (
+            await self.pipeline(
+                [("EVAL", LEASE_SCRIPT, 1, counter, permits, rate, ttl_ms)]
+            )
+        )[0]
+
+    async def pipeline(self, commands: list[tuple]) -> list:
+        async with self.lock:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(
+                    self.host, self.port
+                )
+            try:
+                self.writer.write(b"".join(encode_command(*c) for c in commands))
+                await self.writer.drain()
+                replies: list = [await read_reply(self.reader) for _ in commands]
+            except (OSError, asyncio.IncompleteReadError):
+                # Reconnect on the next call, replies of this connection are lost
+                await self.close_connection()
+                raise
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def close_connection(self) -> None:
+        writer: asyncio.StreamWriter | None = self.writer
+        self.reader = None
+        self.writer = None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def close(self) -> None:
+        async with self.lock:
+            await self.close_connection()
+
+
+def encode_command(*args) -> bytes:
+    parts: list[bytes] = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data: bytes = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    line: bytes = await reader.readuntil(b"\r\n")
+    kind: bytes = line[:1]
+    body: bytes = line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        return RespError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length: int = int(body)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        count: int = int(body)
+        if count < 0:
+            return None
+        return [await read_reply(reader) for _ in range(count)]
+    raise RespError(f"Unexpected reply: {line!r}")
+
+
+"""
+  Node-local share of a cluster-wide budget. Permits are leased from the store in
+  blocks of `lease_size`, so most admissions are decided locally without a round trip.
+
+  Lease expiry: leased permits are only valid for the window they were leased in,
+  unused permits are dropped when the wall-clock window changes.
+  Node failure: permits leased by a node that dies are lost for the rest of that
+  window, the cluster under-admits until the next window but never over-admits.
+  Store failure: nodes keep spending the permits they already hold and then admit
+  nothing until the store answers again, retrying every `retry_ns`.
+"""
+
+
+class LeasedWindow:
+    def __init__(
+        self,
+        store: AdmissionStore,
+        key: str,
+        rate: int,
+        per: int,
+        lease_size: int,
+        retry_ns: int,
+        on_refill: Callable[[], None],
+        clock: Clock = SYSTEM_CLOCK,
+    ) -> None:
+        self.store: AdmissionStore = store
+        self.key: str = key
+        self.rate: int = rate
+        self.per: int = per
+        self.lease_size: int = lease_size
+        self.retry_ns: int = retry_ns
+        self.on_refill: Callable[[], None] = on_refill
+        self.clock: Clock = clock
+        self.window_index: int = clock.time_ns() // per
+        self.permits: int = 0
+        # Earliest monotonic time at which the store is asked again
+        self.blocked_until: int = 0
+        self.refill_task: asyncio.Task | None = None
+
+    # Drops the permits of an expired window
+    def roll(self) -> None:
+        window_index: int = self.clock.time_ns() // self.per
+        if window_index != self.window_index:
+            self.window_index = window_index
+            self.permits = 0
+            self.blocked_until = 0
+
+    def next_window_start(self) -> int:
+        # Converted from wall-clock time to the monotonic time used for deadlines
+        wall_now: int = self.clock.time_ns()
+        now: int = self.clock.monotonic_ns()
+        return now + (self.window_index + 1) * self.per - wall_now
+
+    # Earliest time at which one more task of `cost` permits may be recorded
+    def ready_at(self, reserved: int = 0, cost: int = 1) -> int:
+        self.roll()
+        if self.permits >= reserved + cost:
+            return 0
+        self.request_refill()
+        if self.refill_task is None:
+            # No refill could be started, the store is blocked until then
+            return min(self.blocked_until, self.next_window_start())
+        # The refill calls back once permits arrive
+        return self.next_window_start()
+
+    def record(self, now: int, cost: int = 1) -> None:
+        self.roll()
+        self.permits -= cost
+        # Lease the next block before the current one runs out
+        if self.permits <= self.lease_size // 4:
+            self.request_refill()
+
+    def try_record(self, now: int, reserved: int = 0, cost: int = 1) -> bool:
+        self.roll()
+        if self.permits < reserved + cost:
+            self.request_refill()
+            return False
+        self.record(now, cost)
+        return True
+
+    # A task costlier than a lease waits for several leases to arrive
+    def max_cost(self) -> int:
+        return self.rate
+
+    def request_refill(self) -> None:
+        if self.refill_task is not None:
+            return
+        if self.clock.monotonic_ns() < self.blocked_until:
+            return
+        self.refill_task = asyncio.get_running_loop().create_task(self.refill())
+
+    async def refill(self) -> None:
+        window_index: int = self.window_index
+        try:
+            granted: int = await self.store.lease(
+                self.key,
+                window_index,
+                self.lease_size,
+                self.rate,
+                self.per // 1_000_000 * 2 + 1_000,
+            )
+        except Exception as e:
+            self.blocked_until = self.clock.monotonic_ns() + self.retry_ns
+            asyncio.get_running_loop().call_exception_handler(
+                {
+                    "message": "Leasing permits from the admission store failed",
+                    "exception": e,
+                }
+            )
+        else:
+            if window_index == self.window_index:
+                self.permits += granted
+                if granted < self.lease_size:
+                    # The window's budget is spent, wait for the next window
+                    self.blocked_until = self.next_window_start()
+        finally:
+            self.refill_task = None
+        self.on_refill()
+
+
+"""
+    Implements a rate limiter enforcing one budget per key across a cluster of nodes,
+    by leasing blocks of permits from a shared AdmissionStore.
+    Tasks are charged when they start. Budgets are counted in fixed wall-clock
+    windows, so up to 2 * rate tasks may start around a window boundary.
+"""
+
+
+class DistributedRateLimiter(RateLimiter):
+    """
+    param store: the shared admission store.
+    param key: the key whose cluster-wide budget is used.
+    param rate: the maximum number of tasks allowed per window, across the cluster.
+    param per: the window in nanoseconds.
+    param lease_size: permits leased per round trip, defaults to a tenth of rate.
+    param retry_ns: delay before asking a failed store again.
+    param max_concurrency / loop / clock: as for RateLimiter, windows follow the
+                                          clock's wall-clock time.
+    """
+
+    def __init__(
+        self,
+        store: AdmissionStore,
+        key: str,
+        rate: int,
+        per: int,
+        lease_size: int | None = None,
+        retry_ns: int = 1_000_000_000,
+        max_concurrency: int = 1,
+        loop: asyncio.AbstractEventLoop | None = None,
+        clock: Clock | None = None,
+    ) -> None:
+        super().__init__(
+            rate,
+            per,
+            engine="GCRA",
+            max_concurrency=max_concurrency,
+            record_on="START",
+            loop=loop,
+            clock=clock,
+        )
+        if lease_size is None:
+            lease_size = max(1, rate // 10)
+        if lease_size <= 0:
+            raise ValueError("lease_size must be a positive integer")
+        self.window: LeasedWindow = LeasedWindow(
+            store, key, rate, per, lease_size, retry_ns, self.onRefill, self.clock
+        )
+
+    # Every node must agree on the budget of the key, and the windows of every
+    # node must line up, so neither can change on one node
+    def set_rate(self, rate: int, per: int | None = None) -> None:
+        raise TypeError(
+            "The rate of a cluster-wide budget is shared by every node, "
+            "use a new key to change it"
+        )
+
+    # Permits arrived or the store can be retried, start waiting tasks
+    def onRefill(self) -> None:
+        if self.wakeupHandle is not None:
+            self.wakeupHandle.cancel()
+            self.wakeupHandle = None
+        self.dispatchPending()
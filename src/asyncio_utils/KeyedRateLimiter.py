@@ -0,0 +1,273 @@
+import asyncio
+import heapq
+from collections import OrderedDict, deque
+from collections.abc import Hashable
+from typing import TYPE_CHECKING
+
+try:
+    from .Clock import Clock, loop_clock
+    from .RateLimiter import Callback, RingBuffer
+except ImportError:
+    from Clock import Clock, loop_clock
+    from RateLimiter import Callback, RingBuffer
+
+if TYPE_CHECKING:
+    from .StateStore import RestoredKeys
+
+
+def ns_to_seconds(ns: int) -> float:
+    return ns / 1_000_000_000
+
+
+class KeyState:
+    __slots__ = ("ring_buffer", "pending_tasks", "last_used", "draining", "scheduled")
+
+    def __init__(self, rate: int, now: int) -> None:
+        self.ring_buffer: RingBuffer = RingBuffer(rate)
+        # Only allocated while the key has queued tasks
+        self.pending_tasks: deque[Callback] | None = None
+        self.last_used: int = now
+        self.draining: bool = False
+        self.scheduled: bool = False
+
+
+"""
+    Implements a rate limiter that enforces the same limit independently per key.
+    All keys share a single wakeup, quiescent keys are evicted once idle and the
+    number of tracked keys is capped. A key evicted before its window expired
+    leaves a tombstone behind, so its budget is not reset by the eviction.
+"""
+
+
+class KeyedRateLimiter:
+    """
+    Initializes the keyed rate limiter.
+    param rate: the maximum number of tasks allowed per key in the time window.
+    param per: the time window in nanoseconds.
+    param max_keys: the maximum number of keys tracked at once, when exceeded the
+                    least recently used quiescent key is evicted. As many
+                    tombstones of evicted keys are kept at most.
+    param idle_ttl_ns: quiescent keys unused for this long are evicted, defaults to
+                       per, after which a key's window history has fully expired.
+    param clock: source of time, defaults to the clock of the running loop.
+    """
+
+    def __init__(
+        self,
+        rate: int,
+        per: int,
+        max_keys: int = 100_000,
+        idle_ttl_ns: int | None = None,
+        clock: Clock | None = None,
+    ) -> None:
+        if rate <= 0 or per <= 0:
+            raise ValueError("rate and per must be positive integers")
+        if max_keys <= 0:
+            raise ValueError("max_keys must be a positive integer")
+
+        self.rate: int = rate
+        self.per: int = per
+        self.max_keys: int = max_keys
+        self.clock: Clock = clock if clock is not None else loop_clock()
+        self.idle_ttl_ns: int = per if idle_ttl_ns is None else idle_ttl_ns
+        self.keys: dict[Hashable, KeyState] = {}
+        # Quiescent keys, the only ones that may be evicted, ordered from least to
+        # most recently used. Keys with queued tasks leave it until drained
+        self.idle: OrderedDict[Hashable, KeyState] = OrderedDict()
+        # (units in the window, newest timestamp) of the keys evicted before their
+        # window expired, ordered by eviction. At most max_keys are kept, the
+        # oldest are dropped first
+        self.evicted: OrderedDict[Hashable, tuple[int, int]] = OrderedDict()
+        # (ready time, sequence, key) for keys waiting for bandwidth
+        self.ready_heap: list[tuple[int, int, Hashable]] = []
+        self.sequence: int = 0
+        self.wakeup_handle: asyncio.TimerHandle | None = None
+        self.wakeup_time: int | None = None
+        # Window history of keys restored by a StateStore, taken on first use
+        self.restored: "RestoredKeys | None" = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def bandWidthAvailable(self, state: KeyState, now: int) -> bool:
+        return (
+            not state.ring_buffer.is_full()
+            or state.ring_buffer.get_front() + self.per < now
+        )
+
+    """
+        Pushes a new task to be executed under the rate limit of the given key.
+        param key: the key whose budget the task is charged to.
+        param task: a callable which can be synchronous or an async coroutine function.
+    """
+
+    async def push(self, key: Hashable, task: Callback) -> None:
+        now: int = self.clock.monotonic_ns()
+        state: KeyState = self.get_state(key, now)
+
+        if state.pending_tasks or state.draining:
+            self.enqueue(key, state, task)
+        elif not self.bandWidthAvailable(state, now):
+            # no pending tasks but bandwidth not available,
+            # queue the task and schedule the key on the shared wakeup
+            self.enqueue(key, state, task)
+            self.schedule(key, state)
+        else:
+            await self.executeAndLogTask(state, task)
+
+    def enqueue(self, key: Hashable, state: KeyState, task: Callback) -> None:
+        if state.pending_tasks is None:
+            state.pending_tasks = deque()
+            # A key with queued tasks cannot be evicted
+            self.idle.pop(key, None)
+        state.pending_tasks.append(task)
+
+    async def executeAndLogTask(self, state: KeyState, task: Callback) -> None:
+        try:
+            if asyncio.iscoroutinefunction(task):
+                await task()
+            else:
+                task()
+        finally:
+            # A task that raised was still admitted and is charged all the same
+            state.last_used = self.clock.monotonic_ns()
+            state.ring_buffer.push(state.last_used)
+
+    def get_state(self, key: Hashable, now: int) -> KeyState:
+        self.evict_idle(now)
+        state: KeyState | None = self.keys.get(key)
+        if state is not None:
+            state.last_used = now
+            if key in self.idle:
+                self.idle.move_to_end(key)
+            return state
+
+        if len(self.keys) >= self.max_keys and not self.idle:
+            raise RuntimeError(
+                f"KeyedRateLimiter is tracking {self.max_keys} keys, "
+                "all with queued tasks"
+            )
+        # Taken before evicting, so the tombstone of the key is not the one dropped
+        tombstone: tuple[int, int] | None = self.evicted.pop(key, None)
+        if len(self.keys) >= self.max_keys:
+            self.evict_one(now)
+        state = KeyState(self.rate, now)
+        if tombstone is not None:
+            # Every unit is put back at the newest timestamp, which never
+            # admits more than the evicted window would have
+            units, newest = tombstone
+            for _ in range(units):
+                state.ring_buffer.push(newest)
+        elif self.restored is not None:
+            self.restore_key(key, state, now)
+        self.keys[key] = state
+        self.idle[key] = state
+        return state
+
+    def restore_key(self, key: Hashable, state: KeyState, now: int) -> None:
+        if self.restored.expires <= now:
+            # Every restored timestamp has left the window
+            self.restored = None
+            return
+        history: list[int] | None = self.restored.pop(key)
+        if history is not None:
+            for timestamp in history:
+                state.ring_buffer.push(timestamp)
+
+    # Evicts quiescent keys from the least recently used end of the idle keys
+    # until one is found that is still within its idle ttl, and drops the
+    # tombstones whose window has expired
+    def evict_idle(self, now: int) -> None:
+        while self.idle:
+            key, state = next(iter(self.idle.items()))
+            if state.last_used + self.idle_ttl_ns > now:
+                break
+            self.evict(key, state, now)
+        while self.evicted:
+            key, (_, newest) = next(iter(self.evicted.items()))
+            if newest + self.per >= now:
+                return
+            del self.evicted[key]
+
+    def evict_one(self, now: int) -> None:
+        key, state = next(iter(self.idle.items()))
+        self.evict(key, state, now)
+
+    # Forgets a quiescent key, keeping a tombstone of its window if it still
+    # holds units
+    def evict(self, key: Hashable, state: KeyState, now: int) -> None:
+        del self.keys[key]
+        del self.idle[key]
+        units: int = self.rate - state.ring_buffer.free_at(now, self.per)
+        if units > 0:
+            self.evicted[key] = (units, state.ring_buffer[-1])
+            if len(self.evicted) > self.max_keys:
+                self.evicted.popitem(last=False)
+
+    def schedule(self, key: Hashable, state: KeyState) -> None:
+        ready_time: int = state.ring_buffer.get_front() + self.per + 1
+        state.scheduled = True
+        self.sequence += 1
+        heapq.heappush(self.ready_heap, (ready_time, self.sequence, key))
+        self.arm()
+
+    # Keeps one loop wakeup armed for the earliest key in the ready heap
+    def arm(self) -> None:
+        if not self.ready_heap:
+            return
+        ready_time: int = self.ready_heap[0][0]
+        if self.wakeup_handle is not None:
+            if self.wakeup_time <= ready_time:
+                return
+            self.wakeup_handle.cancel()
+        self.wakeup_time = ready_time
+        self.wakeup_handle = asyncio.get_running_loop().call_later(
+            max(0.0, ns_to_seconds(ready_time - self.clock.monotonic_ns())),
+            self.onWakeup,
+        )
+
+    def onWakeup(self) -> None:
+        self.wakeup_handle = None
+        self.wakeup_time = None
+        now: int = self.clock.monotonic_ns()
+        while self.ready_heap and self.ready_heap[0][0] <= now:
+            key: Hashable = heapq.heappop(self.ready_heap)[2]
+            state: KeyState = self.keys[key]
+            state.scheduled = False
+            state.draining = True
+            asyncio.create_task(self.onBandWidthAvailable(key, state))
+        self.arm()
+
+    async def onBandWidthAvailable(self, key: Hashable, state: KeyState) -> None:
+        try:
+            while state.pending_tasks and self.bandWidthAvailable(
+                state, self.clock.monotonic_ns()
+            ):
+                now: int = self.clock.monotonic_ns()
+                while (
+                    state.pending_tasks
+                    and state.ring_buffer.get_front() + self.per < now
+                ):
+                    try:
+                        await self.executeAndLogTask(
+                            state, state.pending_tasks.popleft()
+                        )
+                    except Exception as e:
+                        # A failing task does not stop the drain of its key
+                        asyncio.get_running_loop().call_exception_handler(
+                            {
+                                "message": "Unhandled exception in KeyedRateLimiter task",
+                                "exception": e,
+                            }
+                        )
+        finally:
+            state.draining = False
+
+        if state.pending_tasks:
+            # If the bandwidth is exhausted but there are still pending tasks,
+            # put the key back on the shared wakeup
+            self.schedule(key, state)
+        else:
+            state.pending_tasks = None
+            if key in self.keys:
+                self.idle[key] = state
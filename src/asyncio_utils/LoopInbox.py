@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import weakref
+from collections import deque
+from collections.abc import Callable
+from typing import TypeVar
+
+T = TypeVar("T")
+
+"""
+  Hands items from any thread to a handler running on an event loop.
+  Producers append to a deque, which is atomic without a lock, and only the
+  producer that finds no wakeup pending calls call_soon_threadsafe, so a burst
+  of submissions costs a single loop wakeup and is handled as one batch.
+"""
+
+
+class LoopInbox:
+    """
+    param loop: the loop the handler runs on.
+    param handler: called on the loop with the list of items submitted since
+                   the previous batch, in submission order.
+    """
+
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop, handler: Callable[[list[T]], None]
+    ) -> None:
+        # Weak, so that inboxes kept per loop do not keep their loop alive
+        self.loop_ref: weakref.ref[asyncio.AbstractEventLoop] = weakref.ref(loop)
+        self.handler: Callable[[list[T]], None] = handler
+        self.items: deque[T] = deque()
+        self.wakeup_pending: bool = False
+
+    """
+      Submits an item, can be called from any thread.
+    """
+
+    def put(self, item: T) -> None:
+        self.items.append(item)
+        # The loop clears the flag before draining, so an item appended after the
+        # drain has started always finds the flag cleared and schedules a wakeup
+        if not self.wakeup_pending:
+            loop: asyncio.AbstractEventLoop | None = self.loop_ref()
+            if loop is None:
+                raise RuntimeError("The loop of this LoopInbox no longer exists")
+            self.wakeup_pending = True
+            loop.call_soon_threadsafe(self.drain)
+
+    def drain(self) -> None:
+        self.wakeup_pending = False
+        batch: list[T] = []
+        while True:
+            try:
+                batch.append(self.items.popleft())
+            except IndexError:
+                break
+        if batch:
+            self.handler(batch)
+
+
+def run_all(callbacks: list[Callable[[], None]]) -> None:
+    for callback in callbacks:
+        callback()
+
+
+# One shared inbox per loop for call_soon_batched
+loop_inboxes: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LoopInbox]" = (
+    weakref.WeakKeyDictionary()
+)
+loop_inboxes_lock: threading.Lock = threading.Lock()
+
+"""
+  Like loop.call_soon_threadsafe(callback), but callbacks submitted from any
+  thread to the same loop share a single wakeup per batch.
+"""
+
+
+def call_soon_batched(
+    loop: asyncio.AbstractEventLoop, callback: Callable[[], None]
+) -> None:
+    inbox: LoopInbox | None = loop_inboxes.get(loop)
+    if inbox is None:
+        with loop_inboxes_lock:
+            inbox = loop_inboxes.get(loop)
+            if inbox is None:
+                inbox = LoopInbox(loop, run_all)
+                loop_inboxes[loop] = inbox
+    inbox.put(callback)
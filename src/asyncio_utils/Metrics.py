@@ -0,0 +1,252 @@
+from collections.abc import Callable, Iterable
+
+# Significant bits kept per power of two, buckets are at most 1/16th (~6%) wide
+SUB_BUCKET_BITS: int = 4
+SUB_BUCKET_COUNT: int = 1 << SUB_BUCKET_BITS
+
+# Quantiles reported by snapshot and the exporters
+QUANTILES: tuple[float, ...] = (0.5, 0.9, 0.99, 0.999)
+
+
+"""
+  Log-linear latency histogram in the style of HdrHistogram. Values are counted in
+  a fixed array of buckets, each power of two split into SUB_BUCKET_COUNT linear
+  buckets, so recording is a few integer operations and never allocates.
+"""
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max", "max_index")
+
+    """
+    param max_value: values above it are counted in the last bucket,
+                     defaults to 2 ** 44 ns, about 4.9 hours.
+    """
+
+    def __init__(self, max_value: int = 1 << 44) -> None:
+        self.max_index: int = bucket_index(max_value)
+        self.counts: list[int] = [0] * (self.max_index + 1)
+        self.count: int = 0
+        self.total: int = 0
+        self.max: int = 0
+
+    def record(self, value: int) -> None:
+        if value < 0:
+            value = 0
+        index: int = bucket_index(value)
+        self.counts[index if index <= self.max_index else self.max_index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    # Upper bound of the bucket holding the value at quantile q, 0 when empty
+    def quantile(self, q: float) -> int:
+        if self.count == 0:
+            return 0
+        rank: int = max(1, round(q * self.count))
+        seen: int = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_upper_bound(index), self.max)
+        return self.max
+
+    # Adds the values recorded by another histogram with the same max_value
+    def merge(self, other: "Histogram") -> None:
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def reset(self) -> None:
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+def bucket_index(value: int) -> int:
+    if value < 2 * SUB_BUCKET_COUNT:
+        return value
+    shift: int = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKET_COUNT + (value >> shift)
+
+
+def bucket_upper_bound(index: int) -> int:
+    if index < 2 * SUB_BUCKET_COUNT:
+        return index
+    shift: int = index // SUB_BUCKET_COUNT - 1
+    top: int = index % SUB_BUCKET_COUNT + SUB_BUCKET_COUNT
+    return ((top + 1) << shift) - 1
+
+
+"""
+  Base of the per-instance metrics. Subclasses list their counters and gauges in
+  SCALARS, the gauges among them in GAUGES, and their histograms in HISTOGRAMS.
+  The exporters walk all of them.
+"""
+
+
+class Metrics:
+    SCALARS: tuple[str, ...] = ()
+    GAUGES: tuple[str, ...] = ()
+    HISTOGRAMS: tuple[str, ...] = ()
+
+    """
+      Returns every metric as a flat name -> value mapping, histograms are reported
+      as <name>_count, <name>_sum_ns, <name>_max_ns and <name>_p<quantile>_ns.
+    """
+
+    def snapshot(self) -> dict[str, float]:
+        values: dict[str, float] = {name: getattr(self, name) for name in self.SCALARS}
+        for name in self.HISTOGRAMS:
+            histogram: Histogram = getattr(self, name)
+            values[f"{name}_count"] = histogram.count
+            values[f"{name}_sum_ns"] = histogram.total
+            values[f"{name}_max_ns"] = histogram.max
+            for q in QUANTILES:
+                values[f"{name}_p{q * 100:g}_ns"] = histogram.quantile(q)
+        return values
+
+    """
+      Renders the metrics in the Prometheus text exposition format, histograms
+      are rendered as summaries.
+      param prefix: prepended to every metric name.
+      param labels: labels attached to every sample, for instance the instance name.
+    """
+
+    def to_prometheus(self, prefix: str, labels: dict[str, str] | None = None) -> str:
+        label_text: str = ",".join(
+            f'{key}="{escape_label(value)}"' for key, value in (labels or {}).items()
+        )
+        lines: list[str] = []
+        for name in self.SCALARS:
+            kind: str = "gauge" if name in self.GAUGES else "counter"
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            lines.append(f"{prefix}_{name}{{{label_text}}} {getattr(self, name)}")
+        separator: str = "," if label_text else ""
+        for name in self.HISTOGRAMS:
+            histogram: Histogram = getattr(self, name)
+            metric: str = f"{prefix}_{name}_ns"
+            lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                lines.append(
+                    f'{metric}{{{label_text}{separator}quantile="{q:g}"}} '
+                    f"{histogram.quantile(q)}"
+                )
+            lines.append(f"{metric}_sum{{{label_text}}} {histogram.total}")
+            lines.append(f"{metric}_count{{{label_text}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    """
+      Returns a callback for an OpenTelemetry observable instrument reporting one
+      entry of snapshot(), e.g.
+      meter.create_observable_gauge("tick_lateness_p99", callbacks=[
+          metrics.otel_callback("tick_lateness_p99_ns")])
+      param key: the snapshot entry to report.
+      param attributes: attributes attached to the observation.
+      param observation: factory of observations, defaults to
+                         opentelemetry.metrics.Observation.
+    """
+
+    def otel_callback(
+        self,
+        key: str,
+        attributes: dict[str, str] | None = None,
+        observation: Callable | None = None,
+    ) -> Callable[[object], Iterable]:
+        if observation is None:
+            # Imported lazily, so OpenTelemetry is only required by its users
+            from opentelemetry.metrics import Observation as observation
+        if key not in self.snapshot():
+            raise KeyError(f"Unknown metric: {key}")
+
+        def callback(options: object = None) -> Iterable:
+            return (observation(self.snapshot()[key], attributes),)
+
+        return callback
+
+    def reset(self) -> None:
+        for name in self.SCALARS:
+            setattr(self, name, 0)
+        for name in self.HISTOGRAMS:
+            getattr(self, name).reset()
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+"""
+  Metrics of a Timer, all durations in nanoseconds.
+  ticks: callbacks run.
+  skipped_ticks: ticks dropped because the previous callback overran them.
+  errors: callbacks that raised.
+  coalesced_ticks: ticks fired by the same loop wakeup as the tick before them,
+                   of any timer with metrics, i.e. loop wakeups saved.
+  tick_lateness: delay between the scheduled time of a tick and its callback starting.
+  callback_duration: time from a callback starting to it completing.
+"""
+
+
+class TimerMetrics(Metrics):
+    SCALARS = ("ticks", "skipped_ticks", "errors", "coalesced_ticks")
+    HISTOGRAMS = ("tick_lateness", "callback_duration")
+
+    def __init__(self) -> None:
+        self.ticks: int = 0
+        self.skipped_ticks: int = 0
+        self.errors: int = 0
+        self.coalesced_ticks: int = 0
+        self.tick_lateness: Histogram = Histogram()
+        self.callback_duration: Histogram = Histogram()
+
+
+"""
+  Metrics of a RateLimiter, all durations in nanoseconds.
+  admitted: executions started or admitted, including try_acquire / acquire.
+  queued: tasks that had to wait in the queue.
+  dropped: tasks discarded or rejected because the queue was full.
+  expired: queued tasks discarded because their deadline passed.
+  cancelled: queued tasks skipped because their caller cancelled them.
+  retried: failed attempts queued again by the retry policy.
+  queue_depth: tasks currently queued.
+  max_queue_depth: the largest queue seen since the last reset.
+  queue_wait: time queued tasks waited before starting.
+"""
+
+
+class RateLimiterMetrics(Metrics):
+    SCALARS = (
+        "admitted",
+        "queued",
+        "dropped",
+        "expired",
+        "cancelled",
+        "retried",
+        "queue_depth",
+        "max_queue_depth",
+    )
+    GAUGES = ("queue_depth", "max_queue_depth")
+    HISTOGRAMS = ("queue_wait",)
+
+    def __init__(self) -> None:
+        self.admitted: int = 0
+        self.queued: int = 0
+        self.dropped: int = 0
+        self.expired: int = 0
+        self.cancelled: int = 0
+        self.retried: int = 0
+        self.queue_depth: int = 0
+        self.max_queue_depth: int = 0
+        self.queue_wait: Histogram = Histogram()
+
+    # queue_depth is a gauge of the current queue and survives a reset
+    def reset(self) -> None:
+        queue_depth: int = self.queue_depth
+        super().reset()
+        self.queue_depth = queue_depth
+        self.max_queue_depth = queue_depth
@@ -0,0 +1,84 @@
+import asyncio
+import concurrent.futures
+import threading
+from collections.abc import Callable
+from enum import Enum
+
+# Where sync callbacks run: on the loop (None), in a shared pool, or in an Executor
+ExecutorOption = concurrent.futures.Executor | str | None
+
+
+class ExecutorKind(Enum):
+    THREAD = "THREAD"
+    PROCESS = "PROCESS"
+
+
+# Pools shared by every instance asking for a kind, created on first use
+SHARED_EXECUTORS: dict[ExecutorKind, concurrent.futures.Executor] = {}
+SHARED_EXECUTORS_LOCK: threading.Lock = threading.Lock()
+
+
+def shared_executor(kind: ExecutorKind) -> concurrent.futures.Executor:
+    with SHARED_EXECUTORS_LOCK:
+        executor: concurrent.futures.Executor | None = SHARED_EXECUTORS.get(kind)
+        if executor is None:
+            executor = (
+                concurrent.futures.ThreadPoolExecutor(
+                    thread_name_prefix="asyncio_utils"
+                )
+                if kind == ExecutorKind.THREAD
+                else concurrent.futures.ProcessPoolExecutor()
+            )
+            SHARED_EXECUTORS[kind] = executor
+        return executor
+
+
+"""
+  Resolves an executor option to the Executor sync callbacks run in.
+  param executor: None to run sync callbacks on the loop, "THREAD" or "PROCESS"
+                  for the pools shared by every instance, or an Executor, which is
+                  used as is and never shut down by this library.
+"""
+
+
+def resolve_executor(executor: ExecutorOption) -> concurrent.futures.Executor | None:
+    if executor is None or isinstance(executor, concurrent.futures.Executor):
+        return executor
+    try:
+        return shared_executor(ExecutorKind(executor))
+    except ValueError:
+        raise ValueError(
+            f"Invalid executor: {executor}. Must be an Executor or one of {[kind.value for kind in ExecutorKind]}"
+        )
+
+
+"""
+  Runs a sync callback in an executor and returns its result once done. A callback
+  run in a thread that returns a coroutine has the coroutine awaited on the loop.
+"""
+
+
+async def run_in_executor(
+    executor: concurrent.futures.Executor, callback: Callable
+) -> object:
+    result = await asyncio.get_running_loop().run_in_executor(executor, callback)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
+
+
+"""
+  A sync task that runs in an executor when called, calling it returns a coroutine,
+  so the limiter awaits its completion off the loop like any async task.
+"""
+
+
+class OffloadedTask:
+    __slots__ = ("task", "executor")
+
+    def __init__(self, task: Callable, executor: concurrent.futures.Executor) -> None:
+        self.task: Callable = task
+        self.executor: concurrent.futures.Executor = executor
+
+    def __call__(self):
+        return run_in_executor(self.executor, self.task)
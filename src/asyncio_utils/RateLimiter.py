@@ -1,38 +1,766 @@
 import asyncio
-import time
+import bisect
+import concurrent.futures
+import heapq
+import itertools
+from array import array
 from collections import deque
-from collections.abc import Awaitable, Callable
-from typing import TypeVar
+from collections.abc import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+)
+from enum import Enum
+from itertools import repeat
+
+try:
+    from .Clock import SYSTEM_CLOCK, Clock, loop_clock
+    from .LoopInbox import LoopInbox
+    from .Metrics import RateLimiterMetrics
+    from .Offload import ExecutorOption, OffloadedTask, resolve_executor
+    from .Retry import RETRYING, RetryingTask, RetryPlacement, RetryPolicy
+except ImportError:
+    from Clock import SYSTEM_CLOCK, Clock, loop_clock
+    from LoopInbox import LoopInbox
+    from Metrics import RateLimiterMetrics
+    from Offload import ExecutorOption, OffloadedTask, resolve_executor
+    from Retry import RETRYING, RetryingTask, RetryPlacement, RetryPolicy
 
 
 def ns_to_seconds(ns: int) -> float:
     return ns / 1_000_000_000
 
 
+"""
+    Fixed-capacity ring of int64 timestamps, pushed in non-decreasing order, in an
+    array('q'): 8 bytes per slot and no object per timestamp. The array grows up to
+    size as timestamps are pushed, then the oldest one is overwritten in place.
+    Being sorted, the ring answers window queries with a binary search.
+    The ring holds `size` units, one per timestamp until several are pushed at
+    once. The first such push adds a second array('q'), the running total of units
+    up to each timestamp, so a timestamp may stand for any number of units and
+    the ring still never holds more than size timestamps.
+"""
+
+
 class RingBuffer:
+    __slots__ = ("size", "slots", "head", "count", "ends", "start")
+
     def __init__(self, size: int):
-        self.size = size
-        self.buffer: deque[TypeVar("T")] = deque()
+        self.size: int = size
+        self.slots: array = array("q")
+        # Index of the oldest timestamp once the ring wraps, 0 until then
+        self.head: int = 0
+        # Number of timestamps held
+        self.count: int = 0
+        # Running total of units up to each timestamp, None while each is one unit
+        self.ends: array | None = None
+        # Running total before the oldest unit held, older units are forgotten
+        self.start: int = 0
+
+    def push(self, item: int, count: int = 1) -> None:
+        if self.ends is not None:
+            self.push_units(item, count)
+            return
+        if count != 1:
+            self.weigh()
+            self.push_units(item, count)
+            return
+        if len(self.slots) < self.size:
+            self.slots.append(item)
+            self.count += 1
+            return
+        self.slots[self.head] = item
+        self.head += 1
+        if self.head == self.size:
+            self.head = 0
+
+    # Gives every timestamp held its running total, each one being one unit
+    def weigh(self) -> None:
+        held: int = len(self.slots)
+        self.ends = array(
+            "q", ((index - self.head) % held + 1 for index in range(held))
+        )
+        self.start = 0
+
+    def push_units(self, item: int, count: int) -> None:
+        total: int = self.total() + count
+        if self.count > 0 and self.slots[self.slot(self.count - 1)] == item:
+            self.ends[self.slot(self.count - 1)] = total
+            self.forget(total - self.size)
+            return
+        # Frees the slots of the timestamps the new units push out
+        self.forget(total - self.size)
+        if len(self.slots) < self.size:
+            self.slots.append(item)
+            self.ends.append(total)
+        else:
+            index: int = self.slot(self.count)
+            self.slots[index] = item
+            self.ends[index] = total
+        self.count += 1
+
+    # Forgets the units up to the running total start
+    def forget(self, start: int) -> None:
+        if start <= self.start:
+            return
+        self.start = start
+        while self.count > 0 and self.ends[self.head] <= start:
+            self.head += 1
+            if self.head == len(self.slots):
+                self.head = 0
+            self.count -= 1
+        if self.count == 0:
+            self.slots = array("q")
+            self.ends = array("q")
+            self.head = 0
 
-    def push(self, item: TypeVar("T")) -> None:
-        if self.is_full():
-            self.buffer.popleft()
-        self.buffer.append(item)
+    # Running total of the units pushed
+    def total(self) -> int:
+        if self.ends is None:
+            return self.count
+        return self.ends[self.slot(self.count - 1)] if self.count > 0 else self.start
+
+    # Index in the arrays of the index-th oldest timestamp
+    def slot(self, index: int) -> int:
+        index += self.head
+        return index - len(self.slots) if index >= len(self.slots) else index
+
+    # Number of timestamps held whose value in values, an array laid out like
+    # slots and sorted from the oldest, is below value, or at most value if right
+    def search(self, values: array, value: int, right: bool = False) -> int:
+        find: Callable = bisect.bisect_right if right else bisect.bisect_left
+        end: int = self.head + self.count
+        if end <= len(values):
+            return find(values, value, self.head, end) - self.head
+        index: int = find(values, value, self.head)
+        if index < len(values):
+            return index - self.head
+        return len(values) - self.head + find(values, value, 0, end - len(values))
 
     def is_full(self) -> bool:
-        return len(self.buffer) == self.size
+        return len(self) == self.size
+
+    # Changes the capacity in place, keeping the newest units
+    def resize(self, size: int) -> None:
+        entries: list[tuple[int, int]] = list(self.entries())
+        weighted: bool = self.ends is not None
+        self.clear()
+        self.size = size
+        if not weighted:
+            self.slots = array("q", [item for item, _ in entries[-size:]])
+            self.count = len(self.slots)
+            return
+        self.weigh()
+        for item, units in entries:
+            self.push_units(item, units)
+
+    def clear(self) -> None:
+        self.slots = array("q")
+        self.head = 0
+        self.count = 0
+        self.ends = None
+        self.start = 0
 
     def is_empty(self) -> bool:
-        return len(self.buffer) == 0
+        return self.count == 0
 
-    def get_front(self) -> TypeVar("T"):
+    def get_front(self) -> int:
         if self.is_empty():
             raise IndexError("RingBuffer is empty")
-        return self.buffer[0]
+        return self.slots[self.head]
+
+    # Number of units held
+    def __len__(self) -> int:
+        return self.count if self.ends is None else self.total() - self.start
+
+    # Timestamps of the units from the oldest, negative indexes count from the newest
+    def __getitem__(self, index: int) -> int:
+        count: int = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("RingBuffer index out of range")
+        if self.ends is not None:
+            index = self.search(self.ends, self.start + index, right=True)
+        return self.slots[self.slot(index)]
+
+    # Timestamp of every unit held, from the oldest
+    def __iter__(self) -> Iterator[int]:
+        if self.ends is None:
+            return itertools.chain(self.slots[self.head :], self.slots[: self.head])
+        return itertools.chain.from_iterable(
+            repeat(item, units) for item, units in self.entries()
+        )
+
+    # (timestamp, units) of every timestamp held, from the oldest
+    def entries(self) -> Iterator[tuple[int, int]]:
+        if self.ends is None:
+            return zip(self, repeat(1))
+        return self.weighted_entries()
+
+    def weighted_entries(self) -> Iterator[tuple[int, int]]:
+        previous: int = self.start
+        for index in range(self.count):
+            index = self.slot(index)
+            yield self.slots[index], self.ends[index] - previous
+            previous = self.ends[index]
+
+    # Number of units free at time now: the missing ones and those more than per old
+    def free_at(self, now: int, per: int) -> int:
+        expired: int = self.search(self.slots, now - per)
+        if self.ends is not None and expired > 0:
+            expired = self.ends[self.slot(expired - 1)] - self.start
+        return self.size - len(self) + expired
+
+    # Earliest time at which count units are free, count must not exceed size
+    def ready_at(self, count: int, per: int) -> int:
+        index: int = count - (self.size - len(self)) - 1
+        if index < 0:
+            return 0
+        return self[index] + per + 1
+
+
+"""
+    Sliding window admission state: the completion timestamps of the last
+    `rate` units charged, a task charges as many units as its cost. A new task
+    may run once enough of them are older than `per`.
+"""
+
+
+class SlidingWindow:
+    def __init__(self, rate: int, per: int, clock: Clock = SYSTEM_CLOCK) -> None:
+        self.ringBuffer: RingBuffer = RingBuffer(rate)
+        self.per: int = per
+        self.clock: Clock = clock
+
+    # Earliest time at which one more task of `cost` units may be recorded,
+    # given `reserved` units that will be recorded before it
+    def ready_at(self, reserved: int = 0, cost: int = 1) -> int:
+        # Each reserved unit will displace one of the oldest timestamps
+        if reserved > 0 and reserved + cost > self.ringBuffer.size:
+            # A displaced timestamp is a reservation itself, wait for it to be recorded
+            return self.clock.monotonic_ns() + self.per + 1
+        # A task larger than the window, after a set_rate shrank it,
+        # waits for the window to be empty rather than forever
+        return self.ringBuffer.ready_at(
+            min(reserved + cost, self.ringBuffer.size), self.per
+        )
+
+    # Number of tasks, up to limit, that may be recorded at time now
+    def available_permits(self, now: int, limit: int) -> int:
+        return min(self.ringBuffer.free_at(now, self.per), limit)
+
+    def record(self, now: int, cost: int = 1) -> None:
+        self.ringBuffer.push(now, cost)
+
+    # The largest cost a task may have
+    def max_cost(self) -> int:
+        return self.ringBuffer.size
+
+    # A smaller rate forgets the oldest timestamps, which no longer bound admission
+    def resize(self, rate: int, per: int) -> None:
+        self.ringBuffer.resize(rate)
+        self.per = per
+
+    # Records one task at time now if the window allows it
+    def try_record(self, now: int, reserved: int = 0, cost: int = 1) -> bool:
+        if self.ready_at(reserved, cost) > now:
+            return False
+        self.record(now, cost)
+        return True
+
+    # The recorded timestamps, relative to now, each followed by its units,
+    # see StateStore
+    def snapshot(self, now: int) -> list[int]:
+        return [
+            value
+            for timestamp, units in self.ringBuffer.entries()
+            for value in (timestamp - now, units)
+        ]
+
+    # Replaces the history with a snapshot taken at the moment now
+    def restore(self, values: list[int], now: int) -> None:
+        self.ringBuffer.clear()
+        for index in range(0, len(values), 2):
+            self.ringBuffer.push(values[index] + now, values[index + 1])
+
+
+"""
+    Generic cell rate algorithm admission state, a single theoretical arrival time.
+    Units are spaced per / rate apart on average and up to `burst` units may run
+    back to back, a task charges as many units as its cost. The arrival time is
+    kept scaled by `rate`, so the state stays an exact integer whatever the ratio
+    of per to rate.
+"""
+
+
+class GcraWindow:
+    __slots__ = ("rate", "per", "burst", "tat", "clock")
+
+    def __init__(
+        self, rate: int, per: int, burst: int, clock: Clock = SYSTEM_CLOCK
+    ) -> None:
+        self.rate: int = rate
+        self.per: int = per
+        self.burst: int = burst
+        self.clock: Clock = clock
+        # Theoretical arrival time of the next task, multiplied by rate
+        self.tat: int = 0
+
+    # Earliest time at which one more task of `cost` units may be recorded,
+    # given `reserved` units that will be recorded before it
+    def ready_at(self, reserved: int = 0, cost: int = 1) -> int:
+        # Reserved units are recorded no earlier than now
+        tat: int = (
+            self.tat
+            if reserved == 0
+            else max(self.tat, self.clock.monotonic_ns() * self.rate)
+        )
+        return (tat + (reserved + cost - self.burst) * self.per) // self.rate + 1
+
+    # Number of tasks, up to limit, that may be recorded at time now
+    def available_permits(self, now: int, limit: int) -> int:
+        if limit <= 0 or self.tat - (self.burst - 1) * self.per >= now * self.rate:
+            return 0
+        # Every task after the first advances the arrival time from max(tat, now)
+        slack: int = (self.burst - 1) * self.per - max(0, self.tat - now * self.rate)
+        return min(limit, 1 + max(0, (slack + self.per - 1) // self.per - 1))
+
+    def record(self, now: int, cost: int = 1) -> None:
+        self.tat = max(self.tat, now * self.rate) + cost * self.per
+
+    # The largest cost a task may have, a task never exceeds the burst
+    def max_cost(self) -> int:
+        return self.burst
+
+    # Rescales the arrival time, so the debt of past tasks carries over in real time
+    def resize(self, rate: int, per: int) -> None:
+        self.tat = -(-self.tat * rate // self.rate)
+        self.rate = rate
+        self.per = per
+
+    # Records one task at time now if the window allows it
+    def try_record(self, now: int, reserved: int = 0, cost: int = 1) -> bool:
+        if self.ready_at(reserved, cost) > now:
+            return False
+        self.record(now, cost)
+        return True
+
+    # The rate and the arrival time relative to now, see StateStore. An arrival
+    # time a nanosecond or more in the past admits as much as one a nanosecond
+    # ago, clamping it keeps the snapshot of an idle limiter within int64
+    def snapshot(self, now: int) -> list[int]:
+        return [self.rate, max(self.tat - now * self.rate, -self.rate)]
+
+    # Restores a snapshot taken at the moment now, rescaled if the rate changed
+    def restore(self, values: list[int], now: int) -> None:
+        rate, tat = values
+        self.tat = now * self.rate + -(-tat * self.rate // rate)
+
+
+"""
+    Admission state of several simultaneous limits, e.g. 10/s and 500/min, and of
+    the budgets of a parent limiter. A task is admitted once every window admits
+    it and is then recorded in all of them, so waiting on one window never
+    consumes a slot in another, and ready_at is the latest of their ready times,
+    a single wakeup for all of them.
+    The first window is the primary one, the one resized by set_rate.
+"""
+
+
+class CompositeWindow:
+    __slots__ = ("windows", "parent")
+
+    def __init__(
+        self,
+        windows: list[SlidingWindow | GcraWindow],
+        parent: "RateLimiter | None" = None,
+    ) -> None:
+        self.windows: list[SlidingWindow | GcraWindow] = windows
+        # The parent's window is checked with the parent's own reservations,
+        # which include those of all its children
+        self.parent: RateLimiter | None = parent
+
+    # Earliest time at which one more task of `cost` units may be recorded,
+    # given `reserved` units that will be recorded before it
+    def ready_at(self, reserved: int = 0, cost: int = 1) -> int:
+        ready_at: int = max(window.ready_at(reserved, cost) for window in self.windows)
+        if self.parent is not None:
+            ready_at = max(
+                ready_at, self.parent.window.ready_at(self.parent.reserved(), cost)
+            )
+        return ready_at
+
+    # Number of tasks, up to limit, that may be recorded at time now
+    def available_permits(self, now: int, limit: int) -> int:
+        for window in self.windows:
+            limit = window.available_permits(now, limit)
+        if self.parent is not None:
+            limit = self.parent.window.available_permits(now, limit)
+        return limit
+
+    def record(self, now: int, cost: int = 1) -> None:
+        for window in self.windows:
+            window.record(now, cost)
+        if self.parent is not None:
+            self.parent.window.record(now, cost)
+
+    # Records one task at time now if every window allows it
+    def try_record(self, now: int, reserved: int = 0, cost: int = 1) -> bool:
+        if self.ready_at(reserved, cost) > now:
+            return False
+        self.record(now, cost)
+        return True
+
+    # The largest cost every window, the parent's included, may admit
+    def max_cost(self) -> int:
+        cost: int = min(window.max_cost() for window in self.windows)
+        if self.parent is not None:
+            cost = min(cost, self.parent.window.max_cost())
+        return cost
+
+    def resize(self, rate: int, per: int) -> None:
+        self.windows[0].resize(rate, per)
+
+
+# Create an enum for the admission engine
+class AdmissionEngine(Enum):
+    SLIDING_WINDOW = "SLIDING_WINDOW"
+    GCRA = "GCRA"
+
+
+# Create an enum for which timestamp of a task is charged to the window
+class RecordPolicy(Enum):
+    START = "START"
+    COMPLETION = "COMPLETION"
+
+
+# Create an enum for what a push does when the queue is full
+class OverflowPolicy(Enum):
+    BLOCK = "BLOCK"
+    REJECT = "REJECT"
+    DROP_OLDEST = "DROP_OLDEST"
+    DROP_NEWEST = "DROP_NEWEST"
+
+
+# Create an enum for what a queued task whose cost does not fit yet does to the
+# tasks behind it
+# STRICT: they wait behind it, tasks start in FIFO order
+# BYPASS: cheaper tasks that fit may start ahead of it, until it has waited `per`
+class HeadOfLinePolicy(Enum):
+    STRICT = "STRICT"
+    BYPASS = "BYPASS"
+
+
+# Queued tasks looked at behind a blocked head for one that may bypass it
+BYPASS_LOOKAHEAD: int = 32
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class QueueTimeoutError(Exception):
+    pass
 
 
 # A function returning None that can be either synchronous or asynchronous
 Callback = Callable[[], None | Awaitable[None]]
+# Called with a task the limiter discarded without running it, and the reason
+DropCallback = Callable[[Callback, Exception], None]
+
+
+"""
+    A queued task with a caller waiting on its outcome, fail is called instead of
+    the task when the limiter discards it, so the caller is not left waiting.
+    When `cancelled` reports that the caller has gone away, the task is skipped
+    without being charged to the window.
+"""
+
+
+class WaitedTask:
+    __slots__ = ("run", "fail", "cancelled")
+
+    def __init__(
+        self,
+        run: Callback,
+        fail: Callable[[Exception], None],
+        cancelled: Callable[[], bool] | None = None,
+    ) -> None:
+        self.run: Callback = run
+        self.fail: Callable[[Exception], None] = fail
+        self.cancelled: Callable[[], bool] | None = cancelled
+
+    def __call__(self) -> None | Awaitable[None]:
+        return self.run()
+
+    def abandoned(self) -> bool:
+        return self.cancelled is not None and self.cancelled()
+
+
+"""
+    Awaitable handle of a task submitted with RateLimiter.submit, resolving with
+    the task's return value or exception.
+    Cancelling the handle, directly or by cancelling a coroutine awaiting it,
+    skips the task if it has not started yet, without charging it to the window.
+    A task that has already started runs to completion, its result is discarded.
+"""
+
+
+class TaskHandle:
+    __slots__ = ("task", "future")
+
+    def __init__(self, task: Callable) -> None:
+        self.task: Callable = task
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def __await__(self):
+        return self.future.__await__()
+
+    def __call__(self) -> None | Awaitable[None]:
+        if self.future.done():
+            return None
+        try:
+            result = self.task()
+        except Exception as e:
+            self.fail(e)
+            return None
+        if asyncio.iscoroutine(result):
+            return self.settle(result)
+        if result is not RETRYING:
+            self.future.set_result(result)
+        return None
+
+    async def settle(self, result: Awaitable) -> None:
+        try:
+            value = await result
+        except Exception as e:
+            self.fail(e)
+        else:
+            if not self.future.done() and value is not RETRYING:
+                self.future.set_result(value)
+
+    def fail(self, error: Exception) -> None:
+        if not self.future.done():
+            self.future.set_exception(error)
+
+    def abandoned(self) -> bool:
+        return self.future.cancelled()
+
+    def cancel(self) -> bool:
+        return self.future.cancel()
+
+    def cancelled(self) -> bool:
+        return self.future.cancelled()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    def exception(self) -> BaseException | None:
+        return self.future.exception()
+
+
+# The task behind acquire, being admitted is all it needs
+def admit_nothing() -> None:
+    pass
+
+
+# Iterates an async or a plain iterable asynchronously
+async def iterate(source: AsyncIterable | Iterable) -> AsyncIterator:
+    if isinstance(source, AsyncIterable):
+        async for item in source:
+            yield item
+    else:
+        for item in source:
+            yield item
+
+
+# Ends the queue of results of RateLimiter.map
+END_OF_MAP: object = object()
+
+
+# A queued task that is discarded instead of run once its deadline has passed
+class ExpiringTask:
+    __slots__ = ("task", "deadline", "queued")
+
+    def __init__(self, task: Callback, deadline: int) -> None:
+        self.task: Callback = task
+        self.deadline: int = deadline
+        # Cleared once the task leaves the queue, its expiry is then moot
+        self.queued: bool = True
+
+
+# Removes the entries of a deque for which expired(entry) is true, in place.
+# Returns the removed entries with their index before the removal
+def remove_expired(lane: deque, expired: Callable) -> list[tuple[int, object]]:
+    kept: list = []
+    removed: list[tuple[int, object]] = []
+    for index, entry in enumerate(lane):
+        if expired(entry):
+            removed.append((index, entry))
+        else:
+            kept.append(entry)
+    if removed:
+        lane.clear()
+        lane.extend(kept)
+    return removed
+
+
+# A queued task charging more than one unit to the window, inside the ExpiringTask
+# of a task with a deadline
+class CostedTask:
+    __slots__ = ("task", "cost", "queued_at")
+
+    def __init__(self, task: Callback, cost: int, queued_at: int) -> None:
+        self.task: Callback = task
+        self.cost: int = cost
+        self.queued_at: int = queued_at
+
+
+# The task behind a queue entry
+def unwrap(entry) -> Callback:
+    if type(entry) is ExpiringTask:
+        entry = entry.task
+    return entry.task if type(entry) is CostedTask else entry
+
+
+"""
+    Pending task queue shared by named flows, each flow queued in its own lane.
+    Lanes are served by deficit round robin: on each visit a flow may start as
+    many tasks as its weight before the next flow with queued tasks is served,
+    so a backlog in one flow delays another by at most the sum of the other
+    weights per task, and idle flows leave their share to the busy ones.
+"""
+
+
+class FlowQueue:
+    """
+    param weights: flow name -> positive integer weight. The first flow is the
+                   default flow of tasks pushed without one.
+    """
+
+    def __init__(self, weights: dict[str, int]) -> None:
+        if not weights:
+            raise ValueError("flows must name at least one flow")
+        for flow, weight in weights.items():
+            if weight <= 0:
+                raise ValueError(
+                    f"The weight of flow {flow} must be a positive integer"
+                )
+        self.weights: dict[str, int] = dict(weights)
+        self.default_flow: str = next(iter(weights))
+        self.lanes: dict[str, deque] = {flow: deque() for flow in weights}
+        # Tasks the flow at the head of `active` may still start in this round
+        self.deficits: dict[str, int] = dict.fromkeys(weights, 0)
+        # Flows with queued tasks, in round robin order
+        self.active: deque[str] = deque()
+        self.count: int = 0
+        # The flow of the task returned by the last popleft
+        self.last_flow: str | None = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lane(self, flow: str | None) -> deque:
+        try:
+            return self.lanes[self.default_flow if flow is None else flow]
+        except KeyError:
+            raise ValueError(
+                f"Unknown flow: {flow}. Must be one of {list(self.lanes)}"
+            ) from None
+
+    def append(self, task, flow: str | None = None) -> None:
+        lane: deque = self.lane(flow)
+        if not lane:
+            self.active.append(self.default_flow if flow is None else flow)
+        lane.append(task)
+        self.count += 1
+
+    # Queues a task ahead of the other tasks of its flow
+    def appendleft(self, task, flow: str | None = None) -> None:
+        lane: deque = self.lane(flow)
+        if not lane:
+            self.active.append(self.default_flow if flow is None else flow)
+        lane.appendleft(task)
+        self.count += 1
+
+    def extend(self, tasks: Iterable, flow: str | None = None) -> None:
+        lane: deque = self.lane(flow)
+        queued: int = len(lane)
+        lane.extend(tasks)
+        if queued == 0 and lane:
+            self.active.append(self.default_flow if flow is None else flow)
+        self.count += len(lane) - queued
+
+    # Removes the next task, or the one `index` tasks behind it in its flow
+    def popleft(self, index: int = 0):
+        if self.count == 0:
+            raise IndexError("pop from an empty FlowQueue")
+        flow: str = self.active[0]
+        if self.deficits[flow] == 0:
+            self.deficits[flow] = self.weights[flow]
+        lane: deque = self.lanes[flow]
+        if index == 0:
+            task = lane.popleft()
+        else:
+            task = lane[index]
+            del lane[index]
+        self.count -= 1
+        self.deficits[flow] -= 1
+        if not lane:
+            # An emptied flow gives up the rest of its round
+            self.deficits[flow] = 0
+            self.active.popleft()
+        elif self.deficits[flow] == 0:
+            self.active.rotate(-1)
+        self.last_flow = flow
+        return task
+
+    # The task the next popleft returns
+    def peek(self):
+        if self.count == 0:
+            raise IndexError("peek from an empty FlowQueue")
+        return self.lanes[self.active[0]][0]
+
+    # Removes the oldest task of one flow, regardless of the round robin order
+    def popleft_flow(self, flow: str | None = None):
+        flow = self.default_flow if flow is None else flow
+        lane: deque = self.lane(flow)
+        task = lane.popleft()
+        self.count -= 1
+        if not lane:
+            self.deficits[flow] = 0
+            self.active.remove(flow)
+        return task
+
+    # Removes the tasks of every flow for which expired(task) is true. Returns the
+    # removed tasks with their flow and their index in it before the removal
+    def remove_expired(self, expired: Callable) -> list[tuple[str, int, object]]:
+        removed: list[tuple[str, int, object]] = []
+        for flow, lane in self.lanes.items():
+            for index, task in remove_expired(lane, expired):
+                removed.append((flow, index, task))
+            if not lane and flow in self.active:
+                self.deficits[flow] = 0
+                self.active.remove(flow)
+        self.count -= len(removed)
+        return removed
+
+    def clear(self) -> None:
+        for lane in self.lanes.values():
+            lane.clear()
+        for flow in self.deficits:
+            self.deficits[flow] = 0
+        self.active.clear()
+        self.count = 0
+
 
 """
     Implements a rate limiter that allows a certain number of tasks to be executed
@@ -45,68 +773,1425 @@ class RateLimiter:
     Initializes the rate limiter with a specified rate and time window.
     param rate: the maximum number of tasks allowed in the time window.
     param per: the time window in nanoseconds.
+    param engine: "SLIDING_WINDOW" keeps the timestamps of the last `rate` tasks,
+                  "GCRA" keeps a single theoretical arrival time instead.
+    param burst: number of tasks the GCRA engine lets run back to back,
+                 ignored by the sliding window engine.
+    param max_concurrency: maximum number of tasks in flight at once, 1 keeps
+                           execution serialized.
+    param record_on: "COMPLETION" or "START", which timestamp of a task is charged
+                     to the window. Tasks recorded on completion hold a reservation
+                     in the window while in flight.
+    param loop: the loop owning the limiter, required by the *_threadsafe methods,
+                defaults to the running loop if constructed inside one.
+    param clock: source of time, defaults to the clock of the loop.
+    param metrics: when True, admissions, queue depth and queue wait times are
+                   recorded in self.metrics, which is None otherwise.
+    param flows: optional flow name -> weight, queued tasks of different flows
+                 are then started in weighted fair order instead of FIFO,
+                 see FlowQueue. Tasks are pushed to a flow with push(task, flow).
+    param max_queue: optional bound on the number of queued tasks.
+    param overflow: what a push does when max_queue tasks are queued,
+                    "BLOCK" waits for room, "REJECT" raises QueueFullError,
+                    "DROP_OLDEST" discards the oldest task of the pushed flow and
+                    "DROP_NEWEST" discards the pushed task. Thread-safe pushes
+                    cannot wait, so "BLOCK" and "REJECT" discard the pushed task.
+    param max_wait_ns: optional bound on the time a task may stay queued.
+    param on_drop: called with every discarded task and a QueueFullError or
+                   QueueTimeoutError. Callers of acquire and submit_threadsafe
+                   receive the error either way.
+    param limits: optional further (rate, per) limits enforced together with
+                  rate / per, every task is charged to all of them.
+    param parent: optional limiter whose budget is shared with this one, e.g. a
+                  global limiter above per-tenant ones. A task is only admitted
+                  when the parent's limits and its ancestors' also allow it,
+                  and is charged to all of them. Limiters with a parent never
+                  wait on the tasks they start, as in the concurrent mode.
+    param executor: where sync tasks run, None runs them on the loop, "THREAD" or
+                    "PROCESS" in a pool shared by all limiters, or an Executor.
+                    An offloaded task is awaited like an async one, so it is
+                    charged on completion and holds its concurrency slot until
+                    it is done. Async tasks always run on the loop.
+    param retry: optional RetryPolicy, failed tasks are then queued again after a
+                 backoff, and charged to the window again, until an attempt
+                 succeeds or the policy gives up. Handles resolve with the
+                 outcome of the last attempt.
+    param head_of_line: "STRICT" or "BYPASS", whether cheaper tasks may start
+                        ahead of a queued task whose cost does not fit yet,
+                        see HeadOfLinePolicy and push(cost=).
     """
 
-    def __init__(self, rate: int, per: int) -> None:
-        self.ringBuffer: RingBuffer = RingBuffer(rate)
+    def __init__(
+        self,
+        rate: int,
+        per: int,
+        engine: str = "SLIDING_WINDOW",
+        burst: int = 1,
+        max_concurrency: int = 1,
+        record_on: str = "COMPLETION",
+        loop: asyncio.AbstractEventLoop | None = None,
+        clock: Clock | None = None,
+        metrics: bool = False,
+        flows: dict[str, int] | None = None,
+        max_queue: int | None = None,
+        overflow: str = "BLOCK",
+        max_wait_ns: int | None = None,
+        on_drop: DropCallback | None = None,
+        limits: Iterable[tuple[int, int]] | None = None,
+        parent: "RateLimiter | None" = None,
+        executor: ExecutorOption = None,
+        retry: RetryPolicy | None = None,
+        head_of_line: str = "STRICT",
+    ) -> None:
+        try:
+            self.engine: AdmissionEngine = AdmissionEngine(engine)
+        except ValueError:
+            raise ValueError(
+                f"Invalid engine: {engine}. Must be one of {[engine.value for engine in AdmissionEngine]}"
+            )
+        if burst <= 0:
+            raise ValueError("burst must be a positive integer")
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be a positive integer")
+        try:
+            self.recordOn: RecordPolicy = RecordPolicy(record_on)
+        except ValueError:
+            raise ValueError(
+                f"Invalid record_on: {record_on}. Must be one of {[policy.value for policy in RecordPolicy]}"
+            )
+        try:
+            self.overflow: OverflowPolicy = OverflowPolicy(overflow)
+        except ValueError:
+            raise ValueError(
+                f"Invalid overflow: {overflow}. Must be one of {[policy.value for policy in OverflowPolicy]}"
+            )
+        try:
+            self.headOfLine: HeadOfLinePolicy = HeadOfLinePolicy(head_of_line)
+        except ValueError:
+            raise ValueError(
+                f"Invalid head_of_line: {head_of_line}. Must be one of {[policy.value for policy in HeadOfLinePolicy]}"
+            )
+        if max_queue is not None and max_queue <= 0:
+            raise ValueError("max_queue must be a positive integer")
+        if max_wait_ns is not None and max_wait_ns < 0:
+            raise ValueError("max_wait_ns must not be negative")
+        for limitRate, limitPer in limits or ():
+            if limitRate <= 0 or limitPer <= 0:
+                raise ValueError(
+                    "limits must be (rate, per) pairs of positive integers"
+                )
+
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+        self.loop: asyncio.AbstractEventLoop | None = loop
+        self.clock: Clock = clock if clock is not None else loop_clock(loop)
+
+        windows: list[SlidingWindow | GcraWindow] = [
+            (
+                SlidingWindow(limitRate, limitPer, self.clock)
+                if self.engine == AdmissionEngine.SLIDING_WINDOW
+                else GcraWindow(limitRate, limitPer, burst, self.clock)
+            )
+            for limitRate, limitPer in [(rate, per), *(limits or ())]
+        ]
+        self.ringBuffer: RingBuffer | None = getattr(windows[0], "ringBuffer", None)
+        self.window: SlidingWindow | GcraWindow | CompositeWindow = (
+            windows[0]
+            if len(windows) == 1 and parent is None
+            else CompositeWindow(windows, parent)
+        )
+        self.parent: RateLimiter | None = parent
+        # Units of the tasks in flight in child limiters that will still be
+        # charged to the window
+        self.childReservations: int = 0
         self.rate: int = rate
         self.per: int = per
-        self.pendingTasks: deque[Callback] = deque()
+        self.flows: FlowQueue | None = FlowQueue(flows) if flows is not None else None
+        self.pendingTasks: deque[Callback] | FlowQueue = (
+            self.flows if self.flows is not None else deque()
+        )
+        self.maxConcurrency: int = max_concurrency
+        # Serialized execution keeps the original awaiting dispatch path,
+        # anything else is dispatched by dispatchPending
+        self.concurrent: bool = (
+            max_concurrency > 1
+            or self.recordOn == RecordPolicy.START
+            or parent is not None
+        )
+        self.inFlight: int = 0
+        # Units the tasks in flight charge to the window
+        self.inFlightCost: int = 0
+        self.wakeupHandle: asyncio.TimerHandle | None = None
+        self.wakeupTime: int = 0
+        self.inbox: LoopInbox | None = None
+        self.metrics: RateLimiterMetrics | None = (
+            RateLimiterMetrics() if metrics else None
+        )
+        # Enqueue time of every pending task per flow (None without flows),
+        # only kept while metrics are enabled
+        self.enqueueTimes: dict[str | None, deque[int]] = {}
+        self.maxQueue: int | None = max_queue
+        self.maxWait: int | None = max_wait_ns
+        self.onDrop: DropCallback | None = on_drop
+        # Producers blocked until the queue has room
+        self.roomWaiters: deque[asyncio.Future] = deque()
+        # The sleep before the next bandwidthAvailable event of the serialized mode
+        self.bandwidthEvent: asyncio.Task | None = None
+        # Set while queued tasks are run by onBandWidthAvailable or its event is
+        # pending, a single drain runs them in the serialized mode
+        self.draining: bool = False
+        self.executor: concurrent.futures.Executor | None = resolve_executor(executor)
+        self.retry: RetryPolicy | None = retry
+        # (due time, sequence, task) of the retries waiting for their backoff,
+        # all of them are timed by a single loop timer
+        self.retryHeap: list[tuple[int, int, RetryingTask]] = []
+        self.retrySequence: itertools.count = itertools.count()
+        self.retryHandle: asyncio.TimerHandle | None = None
+        self.retryTime: int = 0
+        # (deadline, sequence, entry) of the queued tasks with a deadline, they
+        # are failed by a single loop timer when the earliest one passes
+        self.expiryHeap: list[tuple[int, int, ExpiringTask]] = []
+        self.expirySequence: itertools.count = itertools.count()
+        self.expiryHandle: asyncio.TimerHandle | None = None
+        self.expiryTime: int = 0
 
-    def bandWidthAvailable(self) -> bool:
-        return (
-            not self.ringBuffer.is_full()
-            or self.ringBuffer.get_front() + self.per < time.monotonic_ns()
+    """
+        Changes the rate, and optionally the window, at runtime. The window state is
+        resized in place: the history of recent executions still counts against the
+        new rate and queued tasks are kept, they are then admitted at the new rate.
+        param rate: the new maximum number of tasks allowed in the time window.
+        param per: the new time window in nanoseconds, unchanged by default.
+    """
+
+    def set_rate(self, rate: int, per: int | None = None) -> None:
+        if per is None:
+            per = self.per
+        if rate <= 0 or per <= 0:
+            raise ValueError("rate and per must be positive integers")
+        self.window.resize(rate, per)
+        self.rate = rate
+        self.per = per
+        # Queued tasks were waiting for a wakeup armed at the old rate
+        self.wakeDispatch()
+
+    # Dispatches queued tasks now instead of at the pending wakeup
+    def wakeDispatch(self) -> None:
+        if self.concurrent:
+            if len(self.pendingTasks) == 0:
+                return
+            if self.wakeupHandle is not None:
+                self.wakeupHandle.cancel()
+                self.wakeupHandle = None
+            self.dispatchPending()
+        elif self.bandwidthEvent is not None and not self.bandwidthEvent.done():
+            # Cancelling the sleep fires the event now, it re-arms itself if needed
+            self.bandwidthEvent.cancel()
+
+    # Wraps a sync task to run in the executor. Handles and waited tasks are built
+    # around a task that is offloaded already
+    def offload(self, task: Callback) -> Callback:
+        if (
+            self.executor is None
+            or type(task) is TaskHandle
+            or type(task) is WaitedTask
+            or type(task) is OffloadedTask
+            or asyncio.iscoroutinefunction(task)
+        ):
+            return task
+        return OffloadedTask(task, self.executor)
+
+    # Wraps a task in the retry policy, handles and waited tasks are built around
+    # a task that is wrapped already
+    def retrying(
+        self,
+        task: Callback,
+        flow: str | None,
+        cost: int = 1,
+        deadline_ns: int | None = None,
+    ) -> Callback:
+        if (
+            self.retry is None
+            or type(task) is TaskHandle
+            or type(task) is WaitedTask
+            or type(task) is RetryingTask
+        ):
+            return task
+        # Retries are queued under the deadline of the first attempt
+        return RetryingTask(task, self, flow, cost, self.deadlineFor(deadline_ns))
+
+    # Queues the entry of a retrying task again once its backoff has passed,
+    # returns False when the policy gives up on the task
+    def scheduleRetry(self, task: RetryingTask, error: Exception) -> bool:
+        if not self.retry.should_retry(error, task.attempt):
+            return False
+        now: int = self.clock.monotonic_ns()
+        due: int = now + self.retry.delay_ns(task.attempt)
+        task.attempt += 1
+        heapq.heappush(self.retryHeap, (due, next(self.retrySequence), task))
+        if self.metrics is not None:
+            self.metrics.retried += 1
+        self.armRetries(now)
+        return True
+
+    def armRetries(self, now: int) -> None:
+        due: int = self.retryHeap[0][0]
+        if self.retryHandle is not None:
+            if self.retryTime <= due:
+                return
+            self.retryHandle.cancel()
+        self.retryTime = due
+        self.retryHandle = asyncio.get_running_loop().call_later(
+            ns_to_seconds(due - now), self.onRetriesDue
         )
 
+    def onRetriesDue(self) -> None:
+        self.retryHandle = None
+        now: int = self.clock.monotonic_ns()
+        due: list[RetryingTask] = []
+        while self.retryHeap and self.retryHeap[0][0] <= now:
+            due.append(heapq.heappop(self.retryHeap)[2])
+        if self.retry.placement == RetryPlacement.FRONT:
+            # Queued front first in reverse, so that they keep their order
+            for task in reversed(due):
+                self.requeue(task, front=True)
+        else:
+            for task in due:
+                self.requeue(task, front=False)
+        if self.retryHeap:
+            self.armRetries(now)
+
+        if self.concurrent:
+            self.dispatchPending()
+        # A drain in progress runs the retries once it reaches them
+        elif due and not self.draining:
+            self.draining = True
+            asyncio.create_task(self.onBandWidthAvailable())
+
+    # Queues the entry of a retrying task again, ahead of the other tasks of its
+    # flow or behind them, under the deadline of its first attempt
+    def requeue(self, task: RetryingTask, front: bool) -> None:
+        entry: Callback | CostedTask | ExpiringTask = task.entry
+        if task.cost != 1:
+            entry = CostedTask(entry, task.cost, self.clock.monotonic_ns())
+        if task.deadline is not None:
+            entry = self.expiring(entry, task.deadline)
+        if front:
+            if self.flows is None:
+                self.pendingTasks.appendleft(entry)
+            else:
+                self.flows.appendleft(entry, task.flow)
+        elif self.flows is None:
+            self.pendingTasks.append(entry)
+        else:
+            self.pendingTasks.append(entry, task.flow)
+        if self.metrics is not None:
+            self.onEnqueued(1, task.flow, front=front)
+
+    def checkFlow(self, flow: str) -> None:
+        if self.flows is None:
+            raise ValueError("flow requires a RateLimiter constructed with flows=")
+        self.flows.lane(flow)
+
+    # Every queue operation goes through enqueue, enqueueMany and dequeue,
+    # so metrics cost a single None check when disabled
+    def enqueue(
+        self,
+        task: Callback,
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> None:
+        if cost != 1:
+            task = CostedTask(task, cost, self.clock.monotonic_ns())
+        if deadline_ns is not None or self.maxWait is not None:
+            task = self.expiring(task, self.deadlineFor(deadline_ns))
+        if flow is None:
+            self.pendingTasks.append(task)
+        else:
+            self.pendingTasks.append(task, flow)
+        if self.metrics is not None:
+            self.onEnqueued(1, flow)
+
+    def enqueueMany(
+        self,
+        tasks: Iterable[Callback],
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> None:
+        if cost != 1:
+            now: int = self.clock.monotonic_ns()
+            tasks = (CostedTask(task, cost, now) for task in tasks)
+        if deadline_ns is not None or self.maxWait is not None:
+            deadline: int = self.deadlineFor(deadline_ns)
+            tasks = (self.expiring(task, deadline) for task in tasks)
+        queued: int = len(self.pendingTasks)
+        if flow is None:
+            self.pendingTasks.extend(tasks)
+        else:
+            self.pendingTasks.extend(tasks, flow)
+        if self.metrics is not None:
+            self.onEnqueued(len(self.pendingTasks) - queued, flow)
+
+    # Wraps a task queued with a deadline, and times its expiry
+    def expiring(self, task: Callback, deadline: int) -> ExpiringTask:
+        entry: ExpiringTask = ExpiringTask(task, deadline)
+        heapq.heappush(self.expiryHeap, (deadline, next(self.expirySequence), entry))
+        if self.expiryHandle is None or deadline < self.expiryTime:
+            self.armExpiry(self.clock.monotonic_ns())
+        return entry
+
+    # Arms the expiry timer for the earliest deadline of a queued task, a task
+    # expires once its deadline has passed
+    def armExpiry(self, now: int) -> None:
+        while self.expiryHeap and not self.expiryHeap[0][2].queued:
+            heapq.heappop(self.expiryHeap)
+        if self.expiryHandle is not None:
+            self.expiryHandle.cancel()
+            self.expiryHandle = None
+        if not self.expiryHeap:
+            return
+        self.expiryTime = self.expiryHeap[0][0]
+        self.expiryHandle = asyncio.get_running_loop().call_later(
+            ns_to_seconds(max(0, self.expiryTime + 1 - now)), self.onExpiry
+        )
+
+    def onExpiry(self) -> None:
+        self.expiryHandle = None
+        now: int = self.clock.monotonic_ns()
+        due: bool = False
+        while self.expiryHeap and self.expiryHeap[0][0] < now:
+            entry: ExpiringTask = heapq.heappop(self.expiryHeap)[2]
+            due = due or entry.queued
+        if due:
+            self.expireQueued(now)
+        self.armExpiry(now)
+
+    # Fails every queued task whose deadline has passed, wherever it is queued
+    def expireQueued(self, now: int) -> None:
+        def expired(entry) -> bool:
+            return type(entry) is ExpiringTask and entry.deadline < now
+
+        removed: list[tuple[str | None, int, ExpiringTask]] = (
+            [
+                (None, index, entry)
+                for index, entry in remove_expired(self.pendingTasks, expired)
+            ]
+            if self.flows is None
+            else self.flows.remove_expired(expired)
+        )
+        if not removed:
+            return
+        if self.metrics is not None:
+            indexes: dict[str | None, set[int]] = {}
+            for flow, index, _ in removed:
+                indexes.setdefault(flow, set()).add(index)
+            for flow, expiredIndexes in indexes.items():
+                times: deque[int] = self.enqueueTimes[flow]
+                kept: list[int] = [
+                    queuedAt
+                    for index, queuedAt in enumerate(times)
+                    if index not in expiredIndexes
+                ]
+                times.clear()
+                times.extend(kept)
+            self.metrics.expired += len(removed)
+            self.metrics.queue_depth = len(self.pendingTasks)
+        for _, _, entry in removed:
+            entry.queued = False
+            self.onDropped(
+                unwrap(entry), QueueTimeoutError("Task expired while queued")
+            )
+        for _ in removed:
+            if not self.roomWaiters:
+                break
+            self.wakeRoomWaiter()
+        # The head may have changed, the pending wakeup was armed for the old one
+        self.wakeDispatch()
+
+    # Removes the next task, callers prune the head first so that it is one to run.
+    # A task bypassing the head is removed from `index` tasks behind it in its flow
+    def dequeue(self, index: int = 0) -> Callback:
+        task: Callback | ExpiringTask | CostedTask
+        if index == 0:
+            task = self.pendingTasks.popleft()
+        elif self.flows is None:
+            task = self.pendingTasks[index]
+            del self.pendingTasks[index]
+        else:
+            task = self.flows.popleft(index)
+        if type(task) is ExpiringTask:
+            self.onExpiringDequeued(task)
+        if self.metrics is not None:
+            self.onDequeued(1, index)
+        if self.roomWaiters:
+            self.wakeRoomWaiter()
+        return unwrap(task)
+
+    # The entry at the head of the queue, without its deadline
+    def peekHead(self) -> Callback | CostedTask:
+        task: Callback | ExpiringTask | CostedTask = (
+            self.pendingTasks[0] if self.flows is None else self.flows.peek()
+        )
+        return task.task if type(task) is ExpiringTask else task
+
+    def headCost(self) -> int:
+        task: Callback | CostedTask = self.peekHead()
+        return task.cost if type(task) is CostedTask else 1
+
+    # Whether tasks may start ahead of the head of the queue, see HeadOfLinePolicy
+    def canBypass(self, now: int) -> bool:
+        if self.headOfLine == HeadOfLinePolicy.STRICT:
+            return False
+        task: Callback | CostedTask = self.peekHead()
+        return type(task) is CostedTask and now - task.queued_at < self.per
+
+    # (index, cost) of the tasks behind the head, in its flow, cheaper than it
+    # and still to run
+    def bypassCandidates(self, now: int) -> Iterator[tuple[int, int]]:
+        headCost: int = self.headCost()
+        lane: deque = (
+            self.pendingTasks
+            if self.flows is None
+            else self.flows.lanes[self.flows.active[0]]
+        )
+        for index, task in enumerate(
+            itertools.islice(lane, 1, BYPASS_LOOKAHEAD + 1), 1
+        ):
+            if type(task) is ExpiringTask:
+                if task.deadline < now:
+                    continue
+                task = task.task
+            cost: int = 1
+            if type(task) is CostedTask:
+                cost = task.cost
+                task = task.task
+            if cost >= headCost:
+                continue
+            if (
+                type(task) is TaskHandle or type(task) is WaitedTask
+            ) and task.abandoned():
+                continue
+            yield index, cost
+
     """
-        Pushes a new task to be executed under the rate limit.
-        param task: a callable which can be synchronous or an async coroutine function.
+        Removes the next task admitted at time now and returns it with its cost,
+        None while no queued task is admitted. Under RecordPolicy.START the task
+        is charged to the window already.
     """
 
-    async def executeAndLogTask(self, task: Callback) -> None:
-        if asyncio.iscoroutinefunction(task):
-            await task()
+    def nextTask(self, now: int) -> tuple[Callback, int] | None:
+        cost: int = self.headCost()
+        if self.admit(now, cost):
+            return self.dequeue(), cost
+        if cost == 1 or not self.canBypass(now):
+            return None
+        for index, cost in self.bypassCandidates(now):
+            if self.admit(now, cost):
+                return self.dequeue(index), cost
+        return None
+
+    # Cost of the cheapest queued task that may start next, bandwidth is awaited for it
+    def wakeupCost(self, now: int) -> int:
+        cost: int = self.headCost()
+        if cost == 1 or not self.canBypass(now):
+            return cost
+        return min((cost for _, cost in self.bypassCandidates(now)), default=cost)
+
+    # Discards expired tasks and tasks whose caller has gone away from the head of
+    # the queue, so that admission is only ever checked and charged for a task
+    # that will run
+    def pruneHead(self) -> None:
+        now: int | None = None
+        while len(self.pendingTasks) > 0:
+            task: Callback | ExpiringTask = (
+                self.pendingTasks[0] if self.flows is None else self.flows.peek()
+            )
+            if type(task) is ExpiringTask:
+                if now is None:
+                    now = self.clock.monotonic_ns()
+                if task.deadline < now:
+                    self.dequeue()
+                    if self.metrics is not None:
+                        self.metrics.expired += 1
+                    self.onDropped(
+                        unwrap(task), QueueTimeoutError("Task expired while queued")
+                    )
+                    continue
+                task = task.task
+            if type(task) is CostedTask:
+                task = task.task
+            if type(task) is not TaskHandle and type(task) is not WaitedTask:
+                return
+            if not task.abandoned():
+                return
+            self.dequeue()
+            if self.metrics is not None:
+                self.metrics.cancelled += 1
+
+    # Deadline of a task queued now, the earlier of its own and max_wait_ns
+    def deadlineFor(self, deadline_ns: int | None) -> int | None:
+        if self.maxWait is None:
+            return deadline_ns
+        expiry: int = self.clock.monotonic_ns() + self.maxWait
+        return expiry if deadline_ns is None else min(expiry, deadline_ns)
+
+    def isFull(self) -> bool:
+        return self.maxQueue is not None and len(self.pendingTasks) >= self.maxQueue
+
+    # Applies the overflow policy to a push that finds the queue full,
+    # returns True if the task may now be queued
+    async def makeRoom(self, task: Callback, flow: str | None) -> bool:
+        if self.overflow == OverflowPolicy.BLOCK:
+            while self.isFull():
+                room: asyncio.Future = asyncio.get_running_loop().create_future()
+                self.roomWaiters.append(room)
+                await room
+            return True
+        if self.overflow == OverflowPolicy.REJECT:
+            if self.metrics is not None:
+                self.metrics.dropped += 1
+            raise QueueFullError(f"{len(self.pendingTasks)} tasks are already queued")
+        return self.makeRoomNow(task, flow)
+
+    # Non-blocking variant of makeRoom, used where a push cannot wait
+    def makeRoomNow(self, task: Callback, flow: str | None) -> bool:
+        error: QueueFullError = QueueFullError(
+            f"{len(self.pendingTasks)} tasks are already queued"
+        )
+        oldest: Callback | None = (
+            self.popOldest(flow)
+            if self.overflow == OverflowPolicy.DROP_OLDEST
+            else None
+        )
+        if self.metrics is not None:
+            self.metrics.dropped += 1
+        if oldest is None:
+            self.onDropped(task, error)
+            return False
+        self.onDropped(oldest, error)
+        return True
+
+    # Removes the oldest queued task of the flow, None if the flow has none queued
+    def popOldest(self, flow: str | None) -> Callback | None:
+        if self.flows is None:
+            oldest: Callback | ExpiringTask = self.pendingTasks.popleft()
         else:
-            task()
-        self.ringBuffer.push(time.monotonic_ns())
+            flow = self.flows.default_flow if flow is None else flow
+            if not self.flows.lanes[flow]:
+                return None
+            oldest = self.flows.popleft_flow(flow)
+        if type(oldest) is ExpiringTask:
+            self.onExpiringDequeued(oldest)
+        if self.metrics is not None:
+            self.enqueueTimes[flow].popleft()
+            self.metrics.queue_depth = len(self.pendingTasks)
+        return unwrap(oldest)
 
-    # Schedule the onBandWidthAvailable event for when bandwidth becomes available
-    # i.e., when the oldest timestamp in the ring buffer + per is reached
-    # i.e when t = ringBuffer.get_front() + per
-    async def scheduleBandWidthAvailableEvt(self) -> None:
-        asyncio.create_task(
-            asyncio.sleep(
-                ns_to_seconds(
-                    (self.ringBuffer.get_front() + self.per) - time.monotonic_ns()
+    # A task with a deadline left the queue. Its heap entry is dropped once on top,
+    # the timer armed for it only fires early, then re-arms for the next one
+    def onExpiringDequeued(self, entry: ExpiringTask) -> None:
+        entry.queued = False
+        while self.expiryHeap and not self.expiryHeap[0][2].queued:
+            heapq.heappop(self.expiryHeap)
+        if not self.expiryHeap and self.expiryHandle is not None:
+            self.expiryHandle.cancel()
+            self.expiryHandle = None
+
+    def wakeRoomWaiter(self) -> None:
+        while self.roomWaiters:
+            room: asyncio.Future = self.roomWaiters.popleft()
+            if not room.done():
+                room.set_result(None)
+                return
+
+    def onDropped(self, task: Callback, error: Exception) -> None:
+        if type(task) is WaitedTask or type(task) is TaskHandle:
+            task.fail(error)
+        if self.onDrop is not None:
+            try:
+                self.onDrop(task.task if type(task) is OffloadedTask else task, error)
+            except Exception as e:
+                asyncio.get_running_loop().call_exception_handler(
+                    {
+                        "message": "Unhandled exception in RateLimiter on_drop",
+                        "exception": e,
+                    }
                 )
+
+    def onEnqueued(
+        self, count: int, flow: str | None = None, front: bool = False
+    ) -> None:
+        if self.flows is not None and flow is None:
+            flow = self.flows.default_flow
+        times: deque[int] | None = self.enqueueTimes.get(flow)
+        if times is None:
+            times = self.enqueueTimes[flow] = deque()
+        if front:
+            times.extendleft(repeat(self.clock.monotonic_ns(), count))
+        else:
+            times.extend(repeat(self.clock.monotonic_ns(), count))
+        self.metrics.queued += count
+        self.metrics.queue_depth = len(self.pendingTasks)
+        if self.metrics.queue_depth > self.metrics.max_queue_depth:
+            self.metrics.max_queue_depth = self.metrics.queue_depth
+
+    def onDequeued(self, count: int, index: int = 0) -> None:
+        now: int = self.clock.monotonic_ns()
+        times: deque[int] = self.enqueueTimes[
+            self.flows.last_flow if self.flows is not None else None
+        ]
+        if index > 0:
+            # A task that bypassed the head of its flow
+            self.metrics.queue_wait.record(now - times[index])
+            del times[index]
+        else:
+            for _ in range(count):
+                self.metrics.queue_wait.record(now - times.popleft())
+        self.metrics.queue_depth = len(self.pendingTasks)
+
+    # Units of the tasks in flight that will still be charged to the window
+    def reserved(self) -> int:
+        if self.recordOn == RecordPolicy.COMPLETION:
+            return self.inFlightCost + self.childReservations
+        return self.childReservations
+
+    # Holds or releases reservations in the windows of every ancestor
+    def reserveInAncestors(self, cost: int) -> None:
+        ancestor: RateLimiter | None = self.parent
+        while ancestor is not None:
+            ancestor.childReservations += cost
+            ancestor = ancestor.parent
+
+    def bandWidthAvailable(self, cost: int = 1) -> bool:
+        return self.window.ready_at(self.reserved(), cost) <= self.clock.monotonic_ns()
+
+    # Admission check of a task of `cost` units, tasks recorded on start
+    # are charged to the window atomically with the check
+    def admit(self, now: int, cost: int = 1) -> bool:
+        if self.recordOn == RecordPolicy.START:
+            return self.window.try_record(now, cost=cost)
+        return self.window.ready_at(self.reserved(), cost) <= now
+
+    # A cost the window can never admit would leave the task queued forever
+    def checkCost(self, cost: int) -> None:
+        if cost <= 0 or cost > self.window.max_cost():
+            raise ValueError(
+                f"cost must be a positive integer no larger than {self.window.max_cost()}"
             )
-        ).add_done_callback(
+
+    """
+        Admits one execution right away if bandwidth is available and no task is queued.
+        Returns True if the execution was admitted and charged to the window,
+        False otherwise.
+        param cost: the units charged to the window, see push.
+    """
+
+    def try_acquire(self, cost: int = 1) -> bool:
+        if cost != 1:
+            self.checkCost(cost)
+        self.pruneHead()
+        if len(self.pendingTasks) > 0:
+            return False
+        if not self.window.try_record(self.clock.monotonic_ns(), self.reserved(), cost):
+            return False
+        if self.metrics is not None:
+            self.metrics.admitted += 1
+        return True
+
+    """
+        Waits, in FIFO order with pushed tasks, until one execution is admitted
+        and charged to the window.
+        param flow: the flow to wait in, when the limiter has flows.
+        param deadline_ns: as for push, raises QueueTimeoutError once it passes.
+        param cost: as for push.
+    """
+
+    async def acquire(
+        self, flow: str | None = None, deadline_ns: int | None = None, cost: int = 1
+    ) -> None:
+        if self.try_acquire(cost):
+            return
+        # Cancelling the caller cancels the handle, which is then skipped
+        handle: TaskHandle = TaskHandle(admit_nothing)
+        await self.push(handle, flow, deadline_ns, cost)
+        await handle
+
+    """
+        Like push, but returns a TaskHandle resolving with the task's return value or
+        exception. The task's exception is delivered to the handle only.
+        param task: a callable which can be synchronous or an async coroutine function.
+        param flow / deadline_ns / cost: as for push.
+    """
+
+    async def submit(
+        self,
+        task: Callable,
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> TaskHandle:
+        task = self.retrying(self.offload(task), flow, cost, deadline_ns)
+        handle: TaskHandle = TaskHandle(task)
+        if type(task) is RetryingTask:
+            task.entry = handle
+        await self.push(handle, flow, deadline_ns, cost)
+        return handle
+
+    """
+        Yields the items of a source, waiting before each pull of the source until
+        it is admitted and charged to the window, as acquire. Items are pulled
+        lazily, so pulls that do work, such as fetching the next page of a crawl,
+        are rate limited and the source is never read ahead. The pull that finds
+        the source exhausted is charged too.
+        param source: an async iterable or an iterable.
+        param flow: as for acquire.
+    """
+
+    async def throttle(
+        self, source: AsyncIterable | Iterable, flow: str | None = None
+    ) -> AsyncIterator:
+        iterator: AsyncIterator = iterate(source)
+        try:
+            while True:
+                await self.acquire(flow)
+                try:
+                    item = await anext(iterator)
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            await iterator.aclose()
+
+    """
+        Yields func(item) for the items of a source, every call admitted and charged
+        to the window, as acquire, before it starts. Calls are started ahead of the
+        consumer, up to `prefetch` results are in flight or waiting to be consumed,
+        so memory is bounded whatever the size of the source. Closing the generator
+        cancels the calls in flight.
+        param func: called with each item, can be synchronous or async. Sync
+                    functions run in the limiter's executor when it has one.
+        param source: an async iterable or an iterable, pulled lazily.
+        param prefetch: the maximum number of results in flight or unconsumed.
+        param ordered: when True results are yielded in the order of the source,
+                       otherwise as soon as they complete.
+        param flow: as for acquire.
+        An exception raised by func or the source is raised by the generator.
+    """
+
+    def map(
+        self,
+        func: Callable,
+        source: AsyncIterable | Iterable,
+        prefetch: int = 16,
+        ordered: bool = True,
+        flow: str | None = None,
+    ) -> AsyncIterator:
+        if prefetch <= 0:
+            raise ValueError("prefetch must be a positive integer")
+        if flow is not None:
+            self.checkFlow(flow)
+        return self.yieldMapped(func, source, prefetch, ordered, flow)
+
+    async def yieldMapped(
+        self,
+        func: Callable,
+        source: AsyncIterable | Iterable,
+        prefetch: int,
+        ordered: bool,
+        flow: str | None,
+    ) -> AsyncIterator:
+        results: asyncio.Queue = asyncio.Queue()
+        room: asyncio.Semaphore = asyncio.Semaphore(prefetch)
+        calls: set[asyncio.Future] = set()
+        feeder: asyncio.Task = asyncio.create_task(
+            self.feedMap(func, source, ordered, flow, results, room, calls)
+        )
+        try:
+            while True:
+                result: asyncio.Future | object = await results.get()
+                if result is END_OF_MAP:
+                    return
+                value = await result
+                room.release()
+                yield value
+        finally:
+            feeder.cancel()
+            for call in calls:
+                call.cancel()
+            # The feeder may be waiting for admission, it is gone once closed
+            await asyncio.gather(feeder, return_exceptions=True)
+
+    # Pulls, admits and starts the calls of map, results are queued as futures,
+    # in source order or once done
+    async def feedMap(
+        self,
+        func: Callable,
+        source: AsyncIterable | Iterable,
+        ordered: bool,
+        flow: str | None,
+        results: asyncio.Queue,
+        room: asyncio.Semaphore,
+        calls: set[asyncio.Future],
+    ) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        offload: bool = self.executor is not None and not asyncio.iscoroutinefunction(
+            func
+        )
+        try:
+            async for item in iterate(source):
+                await room.acquire()
+                await self.acquire(flow)
+                call: asyncio.Future
+                if offload:
+                    call = loop.run_in_executor(self.executor, func, item)
+                else:
+                    call = loop.create_future()
+                    try:
+                        result = func(item)
+                    except Exception as e:
+                        call.set_exception(e)
+                    else:
+                        if asyncio.iscoroutine(result):
+                            call = asyncio.ensure_future(result)
+                        else:
+                            call.set_result(result)
+                if not call.done():
+                    calls.add(call)
+                    call.add_done_callback(calls.discard)
+                if ordered or call.done():
+                    results.put_nowait(call)
+                else:
+                    call.add_done_callback(results.put_nowait)
+            # Unordered results are queued as they complete, the end comes last
+            if not ordered and calls:
+                await asyncio.wait(set(calls))
+        except Exception as e:
+            failed: asyncio.Future = loop.create_future()
+            failed.set_exception(e)
+            results.put_nowait(failed)
+        results.put_nowait(END_OF_MAP)
+
+    # Returns the completion timestamp charged to the window
+    async def executeAndLogTask(self, task: Callback, cost: int = 1) -> int:
+        if self.metrics is not None:
+            self.metrics.admitted += 1
+        result: None | Awaitable[None] = task()
+        # Supports both async and sync callbacks
+        if asyncio.iscoroutine(result):
+            await result
+        now: int = self.clock.monotonic_ns()
+        self.window.record(now, cost)
+        return now
+
+    # Schedule the onBandWidthAvailable event for when bandwidth becomes available
+    # i.e., for the sliding window when the oldest timestamp in the ring buffer + per
+    # is passed, i.e when t = ringBuffer.get_front() + per + 1
+    async def scheduleBandWidthAvailableEvt(self) -> None:
+        self.draining = True
+        now: int = self.clock.monotonic_ns()
+        delay: int = self.window.ready_at(self.reserved(), self.wakeupCost(now)) - now
+        self.bandwidthEvent = asyncio.create_task(asyncio.sleep(ns_to_seconds(delay)))
+        self.bandwidthEvent.add_done_callback(
             lambda coro_object: asyncio.create_task(self.onBandWidthAvailable())
         )
 
-    async def push(self, task: Callback) -> None:
-        if len(self.pendingTasks) > 0:
-            self.pendingTasks.append(task)
+    """
+        Pushes a new task to be executed under the rate limit.
+        param task: a callable which can be synchronous or an async coroutine function.
+        param flow: the flow the task is queued in, defaults to the first flow
+                    when the limiter has flows.
+        param deadline_ns: optional time, on the limiter's clock, after which the
+                           task is discarded instead of run if it is still queued.
+        param cost: the units the task charges to the window, e.g. bytes or
+                    tokens, at most the capacity of the window, see max_cost.
+    """
+
+    async def push(
+        self,
+        task: Callback,
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> None:
+        if flow is not None:
+            self.checkFlow(flow)
+        if cost != 1:
+            self.checkCost(cost)
+        task = self.retrying(self.offload(task), flow, cost, deadline_ns)
+        if self.maxQueue is not None and self.isFull():
+            if not await self.makeRoom(task, flow):
+                return
+        if self.concurrent:
+            if (
+                len(self.pendingTasks) > 0
+                or self.inFlight >= self.maxConcurrency
+                or not self.admit(self.clock.monotonic_ns(), cost)
+            ):
+                self.enqueue(task, flow, deadline_ns, cost)
+                self.dispatchPending()
+            else:
+                self.startTask(task, cost)
+            return
+
+        if len(self.pendingTasks) > 0 or self.draining:
+            # The drain in progress runs the task once it reaches it
+            self.enqueue(task, flow, deadline_ns, cost)
+            # The sleep awaits bandwidth for the queued tasks, a cheaper one may
+            # bypass them now, cancelling the sleep fires the event at once
+            if (
+                self.headOfLine == HeadOfLinePolicy.BYPASS
+                and cost < self.headCost()
+                and self.bandwidthEvent is not None
+                and not self.bandwidthEvent.done()
+            ):
+                self.bandwidthEvent.cancel()
             return
-        elif not self.bandWidthAvailable():
+        elif not self.bandWidthAvailable(cost):
             # no pending tasks but bandwidth not available,
             # queue the task and schedule the next bandwidthAvailable event
-            self.pendingTasks.append(task)
+            self.enqueue(task, flow, deadline_ns, cost)
             await self.scheduleBandWidthAvailableEvt()
         else:
-            await self.executeAndLogTask(task)
+            await self.executeAndLogTask(task, cost)
+
+    # The largest cost a pushed task may have
+    def max_cost(self) -> int:
+        return self.window.max_cost()
+
+    """
+        Pushes several tasks at once, tasks run inline while bandwidth is available
+        and the rest are queued in bulk behind a single bandwidthAvailable event.
+        With max_queue set, tasks are pushed one at a time so that the overflow
+        policy applies to each of them.
+        param tasks: callables which can be synchronous or async coroutine functions.
+        param flow / deadline_ns: as for push.
+        param cost: as for push, the cost of each task.
+    """
+
+    async def push_many(
+        self,
+        tasks: Iterable[Callback],
+        flow: str | None = None,
+        deadline_ns: int | None = None,
+        cost: int = 1,
+    ) -> None:
+        if flow is not None:
+            self.checkFlow(flow)
+        if cost != 1:
+            self.checkCost(cost)
+        if self.executor is not None or self.retry is not None:
+            tasks = (
+                self.retrying(self.offload(task), flow, cost, deadline_ns)
+                for task in tasks
+            )
+        if self.maxQueue is not None:
+            for task in tasks:
+                await self.push(task, flow, deadline_ns, cost)
+            return
+        if self.concurrent:
+            self.enqueueMany(tasks, flow, deadline_ns, cost)
+            self.dispatchPending()
+            return
+
+        if len(self.pendingTasks) > 0 or self.draining:
+            self.enqueueMany(tasks, flow, deadline_ns, cost)
+            return
+
+        iterator = iter(tasks)
+        now: int = self.clock.monotonic_ns()
+        for task in iterator:
+            if self.window.ready_at(0, cost) > now:
+                self.enqueue(task, flow, deadline_ns, cost)
+                self.enqueueMany(iterator, flow, deadline_ns, cost)
+                await self.scheduleBandWidthAvailableEvt()
+                return
+            # The completion timestamp doubles as the clock for the next check
+            now = await self.executeAndLogTask(task, cost)
 
     async def onBandWidthAvailable(self) -> None:
-        while len(self.pendingTasks) > 0 and self.bandWidthAvailable():
-            now: int = time.monotonic_ns()
-            while (
-                len(self.pendingTasks) > 0
-                and self.ringBuffer.get_front() + self.per < now
-            ):
-                await self.executeAndLogTask(self.pendingTasks.popleft())
+        self.draining = True
+        now: int = self.clock.monotonic_ns()
+        try:
+            while True:
+                self.pruneHead()
+                if len(self.pendingTasks) == 0:
+                    break
+                task: tuple[Callback, int] | None = self.nextTask(now)
+                if task is None:
+                    break
+                now = await self.executeAndLogTask(*task)
+        except BaseException:
+            self.draining = False
+            raise
 
         # If the bandwidth is exhausted but there are still pending tasks,
         # schedule the next bandwidthAvailable event
         if len(self.pendingTasks) > 0:
             await self.scheduleBandWidthAvailableEvt()
+        else:
+            self.draining = False
+
+    """
+        Pushes a task from any thread, tasks submitted from other threads are
+        handed to the loop in batches with a single wakeup per batch.
+        param task: a callable which can be synchronous or an async coroutine function.
+        param flow / cost: as for push.
+    """
+
+    def push_threadsafe(
+        self, task: Callback, flow: str | None = None, cost: int = 1
+    ) -> None:
+        if flow is not None:
+            self.checkFlow(flow)
+        task = self.retrying(self.offload(task), flow, cost)
+        if cost != 1:
+            self.checkCost(cost)
+            task = CostedTask(task, cost, self.clock.monotonic_ns())
+        if self.inbox is None:
+            if self.loop is None:
+                raise RuntimeError(
+                    "RateLimiter is not bound to a loop, pass loop= when constructing it"
+                )
+            self.inbox = LoopInbox(self.loop, self.onThreadSafeBatch)
+        # Limiters with flows receive (task, flow) pairs
+        self.inbox.put(task if self.flows is None else (task, flow))
+
+    """
+        Like push_threadsafe, but returns a concurrent.futures.Future that resolves
+        with the task's return value, or its exception, once the task has run.
+        param task: a callable which can be synchronous or an async coroutine function.
+        param flow / cost: as for push.
+    """
+
+    def submit_threadsafe(
+        self, task: Callback, flow: str | None = None, cost: int = 1
+    ) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        task = self.retrying(self.offload(task), flow, cost)
+
+        async def run_and_resolve() -> None:
+            # A retried task is already running
+            if not future.running() and not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = task()
+                if asyncio.iscoroutine(result):
+                    result = await result
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                if result is not RETRYING:
+                    future.set_result(result)
+
+        def fail(error: Exception) -> None:
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+        waited: WaitedTask = WaitedTask(run_and_resolve, fail, future.cancelled)
+        if type(task) is RetryingTask:
+            task.entry = waited
+        self.push_threadsafe(waited, flow, cost)
+        return future
+
+    # Runs on the loop with the tasks submitted from other threads
+    def onThreadSafeBatch(self, tasks: list) -> None:
+        if self.flows is None and self.maxQueue is None:
+            self.enqueueMany(tasks)
+        else:
+            for entry in tasks:
+                task, flow = entry if self.flows is not None else (entry, None)
+                if self.isFull() and not self.makeRoomNow(unwrap(task), flow):
+                    continue
+                self.enqueue(task, flow)
+
+        if self.concurrent:
+            self.dispatchPending()
+            return
+        # A drain in progress runs the new tasks once it reaches them
+        if not self.draining:
+            self.draining = True
+            asyncio.create_task(self.onBandWidthAvailable())
+
+    """
+        Starts an admitted task in concurrent mode, sync tasks run to completion inline,
+        coroutines run in their own task so the caller does not wait for them.
+        param task: a callable which can be synchronous or an async coroutine function.
+        param cost: the units the task charges to the window.
+    """
+
+    def startTask(self, task: Callback, cost: int = 1) -> None:
+        self.inFlight += 1
+        self.inFlightCost += cost
+        if self.parent is not None and self.recordOn == RecordPolicy.COMPLETION:
+            self.reserveInAncestors(cost)
+        if self.metrics is not None:
+            self.metrics.admitted += 1
+
+        try:
+            result: None | Awaitable[None] = task()
+        except BaseException:
+            self.onTaskDone(cost)
+            raise
+
+        # Supports both async and sync callbacks
+        if asyncio.iscoroutine(result):
+            asyncio.create_task(self.executeConcurrently(result, cost))
+        else:
+            self.onTaskDone(cost)
+
+    async def executeConcurrently(self, result: Awaitable[None], cost: int) -> None:
+        try:
+            await result
+        finally:
+            self.onTaskDone(cost)
+            self.dispatchPending()
+
+    # A task that failed still reached the downstream system, so it is charged too
+    def onTaskDone(self, cost: int = 1) -> None:
+        self.inFlight -= 1
+        self.inFlightCost -= cost
+        if self.recordOn == RecordPolicy.COMPLETION:
+            if self.parent is not None:
+                self.reserveInAncestors(-cost)
+            self.window.record(self.clock.monotonic_ns(), cost)
+
+    # Starts pending tasks in FIFO order while concurrency and bandwidth allow,
+    # otherwise arms a single wakeup for when bandwidth becomes available
+    def dispatchPending(self) -> None:
+        now: int = self.clock.monotonic_ns()
+        while self.inFlight < self.maxConcurrency:
+            self.pruneHead()
+            if len(self.pendingTasks) == 0:
+                return
+            if self.recordOn == RecordPolicy.START:
+                # The start is what gets charged, a cached reading would backdate it
+                now = self.clock.monotonic_ns()
+            task: tuple[Callback, int] | None = self.nextTask(now)
+            if task is None:
+                # Only re-read the clock once the cached reading is exhausted
+                now = self.clock.monotonic_ns()
+                task = self.nextTask(now)
+                if task is None:
+                    self.scheduleWakeup(
+                        self.window.ready_at(self.reserved(), self.wakeupCost(now)),
+                        now,
+                    )
+                    return
+            try:
+                self.startTask(*task)
+            except Exception as e:
+                asyncio.get_running_loop().call_exception_handler(
+                    {
+                        "message": "Unhandled exception in RateLimiter task",
+                        "exception": e,
+                    }
+                )
+
+    def scheduleWakeup(self, ready_at: int, now: int) -> None:
+        if self.wakeupHandle is not None:
+            if self.wakeupTime <= ready_at:
+                return
+            self.wakeupHandle.cancel()
+        self.wakeupTime = ready_at
+        self.wakeupHandle = asyncio.get_running_loop().call_later(
+            ns_to_seconds(ready_at - now), self.onWakeup
+        )
+
+    def onWakeup(self) -> None:
+        self.wakeupHandle = None
+        self.dispatchPending()
+
+
+# A function receiving a list of items that can be either synchronous or asynchronous
+BatchCallback = Callable[[list], None | Awaitable[None]]
+
+"""
+    Implements a rate limiter that hands queued items to a single callback in batches,
+    each batch holding as many items as the window permits at that moment.
+    Every item is charged to the window, so a batch of n items costs n executions.
+    It queues plain items rather than tasks, so it shares RateLimiter's windows
+    but none of its task entry points.
+"""
+
+
+class BatchRateLimiter:
+    """
+    Initializes the batch rate limiter.
+    param rate: the maximum number of items allowed in the time window.
+    param per: the time window in nanoseconds.
+    param callback: called with a list of items, can be synchronous or async.
+    param max_batch: the largest batch handed to the callback, defaults to rate.
+    param engine / burst / loop / clock: as for RateLimiter.
+    param metrics: when True, admitted items, queue depth and queue wait times are
+                   recorded in self.metrics, which is None otherwise.
+    """
+
+    def __init__(
+        self,
+        rate: int,
+        per: int,
+        callback: BatchCallback,
+        max_batch: int | None = None,
+        engine: str = "SLIDING_WINDOW",
+        burst: int = 1,
+        loop: asyncio.AbstractEventLoop | None = None,
+        clock: Clock | None = None,
+        metrics: bool = False,
+    ) -> None:
+        try:
+            self.engine: AdmissionEngine = AdmissionEngine(engine)
+        except ValueError:
+            raise ValueError(
+                f"Invalid engine: {engine}. Must be one of {[engine.value for engine in AdmissionEngine]}"
+            )
+        if rate <= 0 or per <= 0:
+            raise ValueError("rate and per must be positive integers")
+        if burst <= 0:
+            raise ValueError("burst must be a positive integer")
+        if max_batch is not None and max_batch <= 0:
+            raise ValueError("max_batch must be a positive integer")
+
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+        self.loop: asyncio.AbstractEventLoop | None = loop
+        self.clock: Clock = clock if clock is not None else loop_clock(loop)
+        self.window: SlidingWindow | GcraWindow = (
+            SlidingWindow(rate, per, self.clock)
+            if self.engine == AdmissionEngine.SLIDING_WINDOW
+            else GcraWindow(rate, per, burst, self.clock)
+        )
+        self.ringBuffer: RingBuffer | None = getattr(self.window, "ringBuffer", None)
+        self.rate: int = rate
+        self.per: int = per
+        self.batchCallback: BatchCallback = callback
+        self.maxBatch: int = rate if max_batch is None else max_batch
+        self.pendingItems: deque = deque()
+        self.inbox: LoopInbox | None = None
+        self.metrics: RateLimiterMetrics | None = (
+            RateLimiterMetrics() if metrics else None
+        )
+        # Enqueue time of every pending item, only kept while metrics are enabled
+        self.enqueueTimes: deque[int] = deque()
+        # The sleep before the next bandwidthAvailable event
+        self.bandwidthEvent: asyncio.Task | None = None
+        # Set while a batch is being executed or a bandwidthAvailable event is pending
+        self.draining: bool = False
+
+    """
+        Changes the rate, and optionally the window, at runtime, as for RateLimiter.
+        param rate: the new maximum number of items allowed in the time window.
+        param per: the new time window in nanoseconds, unchanged by default.
+    """
+
+    def set_rate(self, rate: int, per: int | None = None) -> None:
+        if per is None:
+            per = self.per
+        if rate <= 0 or per <= 0:
+            raise ValueError("rate and per must be positive integers")
+        self.window.resize(rate, per)
+        self.rate = rate
+        self.per = per
+        # Cancelling the sleep fires the event now, it re-arms itself if needed
+        if self.bandwidthEvent is not None and not self.bandwidthEvent.done():
+            self.bandwidthEvent.cancel()
+
+    # Queues an item, it is handed to the callback in the next batch the window permits
+    async def push(self, item) -> None:
+        await self.push_many((item,))
+
+    # Queues several items at once, the first batch runs inline if the window permits
+    async def push_many(self, items: Iterable) -> None:
+        self.enqueueMany(items)
+        if not self.draining:
+            await self.onBandWidthAvailable()
+
+    """
+        Queues an item from any thread, items pushed from other threads are handed
+        to the loop in batches with a single wakeup per batch.
+        param item: the item to hand to the callback.
+    """
+
+    def push_threadsafe(self, item) -> None:
+        if self.inbox is None:
+            if self.loop is None:
+                raise RuntimeError(
+                    "BatchRateLimiter is not bound to a loop, pass loop= when constructing it"
+                )
+            self.inbox = LoopInbox(self.loop, self.onThreadSafeBatch)
+        self.inbox.put(item)
+
+    # Runs on the loop with the items pushed from other threads
+    def onThreadSafeBatch(self, items: list) -> None:
+        self.enqueueMany(items)
+        if not self.draining:
+            self.draining = True
+            asyncio.create_task(self.onBandWidthAvailable())
+
+    def enqueueMany(self, items: Iterable) -> None:
+        queued: int = len(self.pendingItems)
+        self.pendingItems.extend(items)
+        if self.metrics is None:
+            return
+        count: int = len(self.pendingItems) - queued
+        self.enqueueTimes.extend(repeat(self.clock.monotonic_ns(), count))
+        self.metrics.queued += count
+        self.metrics.queue_depth = len(self.pendingItems)
+        if self.metrics.queue_depth > self.metrics.max_queue_depth:
+            self.metrics.max_queue_depth = self.metrics.queue_depth
+
+    def dequeueBatch(self, count: int) -> list:
+        batch: list = [self.pendingItems.popleft() for _ in range(count)]
+        if self.metrics is not None:
+            now: int = self.clock.monotonic_ns()
+            for _ in range(count):
+                self.metrics.queue_wait.record(now - self.enqueueTimes.popleft())
+            self.metrics.queue_depth = len(self.pendingItems)
+        return batch
+
+    # Returns the completion timestamp charged to the window for every item
+    async def executeAndLogBatch(self, batch: list) -> int:
+        if self.metrics is not None:
+            self.metrics.admitted += len(batch)
+        result: None | Awaitable[None] = self.batchCallback(batch)
+        if asyncio.iscoroutine(result):
+            await result
+        now: int = self.clock.monotonic_ns()
+        self.window.record(now, len(batch))
+        return now
+
+    # Schedule the onBandWidthAvailable event for when the next item fits the window
+    async def scheduleBandWidthAvailableEvt(self) -> None:
+        delay: int = self.window.ready_at() - self.clock.monotonic_ns()
+        self.bandwidthEvent = asyncio.create_task(asyncio.sleep(ns_to_seconds(delay)))
+        self.bandwidthEvent.add_done_callback(
+            lambda coro_object: asyncio.create_task(self.onBandWidthAvailable())
+        )
+
+    async def onBandWidthAvailable(self) -> None:
+        self.draining = True
+        now: int = self.clock.monotonic_ns()
+        try:
+            while len(self.pendingItems) > 0:
+                count: int = self.window.available_permits(
+                    now, min(self.maxBatch, len(self.pendingItems))
+                )
+                if count == 0:
+                    break
+                now = await self.executeAndLogBatch(self.dequeueBatch(count))
+        except BaseException:
+            self.draining = False
+            raise
+
+        # If the bandwidth is exhausted but there are still pending items,
+        # schedule the next bandwidthAvailable event
+        if len(self.pendingItems) > 0:
+            await self.scheduleBandWidthAvailableEvt()
+        else:
+            self.draining = False
@@ -0,0 +1,172 @@
+import asyncio
+import math
+import random
+from collections.abc import Callable
+from enum import Enum
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .RateLimiter import RateLimiter
+
+
+# Returned in place of a result by an attempt that failed and was queued again,
+# the handle of the task then waits for the next attempt
+RETRYING: object = object()
+
+
+# Decides whether an exception raised by a task is worth another attempt
+RetryPredicate = Callable[[Exception], bool]
+
+
+def retry_everything(error: Exception) -> bool:
+    return True
+
+
+# Create an enum for how backoff delays are randomized
+# FULL: uniformly between 0 and the backoff
+# EQUAL: uniformly between half the backoff and the backoff
+# NONE: the backoff itself
+class Jitter(Enum):
+    FULL = "FULL"
+    EQUAL = "EQUAL"
+    NONE = "NONE"
+
+
+# Create an enum for where a retry is queued once its backoff has passed
+# BACK: behind the tasks queued meanwhile, as a new task would be
+# FRONT: ahead of the other tasks of its flow
+class RetryPlacement(Enum):
+    BACK = "BACK"
+    FRONT = "FRONT"
+
+
+"""
+  Retry policy of a RateLimiter, failed tasks are retried with exponential backoff.
+  Retries go through the limiter's queue again, so every attempt is admitted and
+  charged to the window like a new task and retries never exceed the rate.
+"""
+
+
+class RetryPolicy:
+    """
+    param max_attempts: attempts per task, the first one included.
+    param base_delay_ns: backoff before the first retry.
+    param max_delay_ns: the backoff is never longer than this.
+    param multiplier: factor applied to the backoff after every retry.
+    param jitter: "FULL", "EQUAL" or "NONE", see Jitter.
+    param retry_on: which exceptions are retried, defaults to every exception,
+                    e.g. lambda e: isinstance(e, TimeoutError).
+    param placement: "BACK" or "FRONT", see RetryPlacement.
+    param seed: optional seed of the jitter, for reproducible delays.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay_ns: int = 100_000_000,
+        max_delay_ns: int = 10_000_000_000,
+        multiplier: float = 2.0,
+        jitter: str = "FULL",
+        retry_on: RetryPredicate = retry_everything,
+        placement: str = "BACK",
+        seed: int | None = None,
+    ) -> None:
+        if max_attempts <= 0:
+            raise ValueError("max_attempts must be a positive integer")
+        if base_delay_ns < 0 or max_delay_ns < base_delay_ns:
+            raise ValueError("delays must satisfy 0 <= base_delay_ns <= max_delay_ns")
+        if multiplier < 1:
+            raise ValueError("multiplier must not be lower than 1")
+        try:
+            self.jitter: Jitter = Jitter(jitter)
+        except ValueError:
+            raise ValueError(
+                f"Invalid jitter: {jitter}. Must be one of {[kind.value for kind in Jitter]}"
+            )
+        try:
+            self.placement: RetryPlacement = RetryPlacement(placement)
+        except ValueError:
+            raise ValueError(
+                f"Invalid placement: {placement}. Must be one of {[kind.value for kind in RetryPlacement]}"
+            )
+
+        self.max_attempts: int = max_attempts
+        self.base_delay_ns: int = base_delay_ns
+        self.max_delay_ns: int = max_delay_ns
+        self.multiplier: float = multiplier
+        # Exponent from which the backoff reaches max_delay_ns, the power of the
+        # multiplier is capped at it so that it never overflows
+        self.max_exponent: int = (
+            math.ceil(math.log(max_delay_ns / base_delay_ns, multiplier))
+            if base_delay_ns > 0 and multiplier > 1
+            else 0
+        )
+        self.retry_on: RetryPredicate = retry_on
+        self.random: random.Random = random.Random(seed)
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        return attempt < self.max_attempts and self.retry_on(error)
+
+    # Delay before the retry following the given failed attempt, counted from 1
+    def delay_ns(self, attempt: int) -> int:
+        backoff: int = int(
+            min(
+                self.max_delay_ns,
+                self.base_delay_ns
+                * self.multiplier ** min(attempt - 1, self.max_exponent),
+            )
+        )
+        if self.jitter == Jitter.FULL:
+            return self.random.randint(0, backoff)
+        if self.jitter == Jitter.EQUAL:
+            return backoff - self.random.randint(0, backoff // 2)
+        return backoff
+
+
+"""
+  A task retried by its RateLimiter when it fails. A failed attempt the policy
+  retries returns RETRYING instead of raising, and `entry`, the task as it was
+  queued, e.g. the TaskHandle around this one, is queued again once its backoff
+  has passed. The last attempt raises as if the task were not wrapped.
+"""
+
+
+class RetryingTask:
+    __slots__ = ("task", "limiter", "flow", "cost", "deadline", "attempt", "entry")
+
+    def __init__(
+        self,
+        task: Callable,
+        limiter: "RateLimiter",
+        flow: str | None,
+        cost: int = 1,
+        deadline: int | None = None,
+    ) -> None:
+        self.task: Callable = task
+        self.limiter: RateLimiter = limiter
+        self.flow: str | None = flow
+        self.cost: int = cost
+        # Deadline of the first attempt, every retry is queued under it
+        self.deadline: int | None = deadline
+        self.attempt: int = 1
+        self.entry: Callable = self
+
+    def __call__(self):
+        try:
+            result = self.task()
+        except Exception as e:
+            return self.retry(e)
+        if asyncio.iscoroutine(result):
+            return self.settle(result)
+        return result
+
+    async def settle(self, result):
+        try:
+            return await result
+        except Exception as e:
+            return self.retry(e)
+
+    def retry(self, error: Exception):
+        if not self.limiter.scheduleRetry(self, error):
+            raise error
+        return RETRYING
@@ -0,0 +1,487 @@
+import asyncio
+import heapq
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone, tzinfo
+
+try:
+    from .Clock import Clock, loop_clock
+    from .Metrics import TimerMetrics
+except ImportError:
+    from Clock import Clock, loop_clock
+    from Metrics import TimerMetrics
+
+Callback = Callable[[], None | Awaitable[None]]
+ErrCallback = Callable[[Exception], None]
+
+
+def ns_to_seconds(ns: int) -> float:
+    return ns / 1_000_000_000
+
+
+"""
+  When a scheduled job fires, as wall-clock times in nanoseconds since the epoch.
+"""
+
+
+class Schedule(ABC):
+    # The first fire time strictly after `after_ns`
+    @abstractmethod
+    def next_fire_ns(self, after_ns: int) -> int:
+        pass
+
+
+"""
+  Fires at every multiple of the interval on the wall clock, shifted by offset_ns,
+  e.g. IntervalSchedule(60_000_000_000) fires every minute at :00.
+"""
+
+
+class IntervalSchedule(Schedule):
+    """
+    param interval_ns: the interval in nanoseconds.
+    param offset_ns: shift from the multiples of the interval since the epoch,
+                     e.g. 15 seconds to fire every minute at :15.
+    """
+
+    def __init__(self, interval_ns: int, offset_ns: int = 0) -> None:
+        if interval_ns <= 0:
+            raise ValueError("interval_ns must be a positive integer")
+        self.interval_ns: int = interval_ns
+        self.offset_ns: int = offset_ns % interval_ns
+
+    def next_fire_ns(self, after_ns: int) -> int:
+        return (
+            after_ns - (after_ns - self.offset_ns) % self.interval_ns + self.interval_ns
+        )
+
+
+MACROS: dict[str, str] = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+MONTH_NAMES: tuple[str, ...] = (
+    "jan", "feb", "mar", "apr", "may", "jun",
+    "jul", "aug", "sep", "oct", "nov", "dec",
+)  # fmt: skip
+DAY_NAMES: tuple[str, ...] = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+# A schedule that matches nothing in this many years never fires, e.g. Feb 30
+MAX_YEARS: int = 8
+
+
+def parse_value(text: str, low: int, names: tuple[str, ...]) -> int:
+    name: str = text.lower()
+    if name in names:
+        return names.index(name) + low
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"Invalid cron value: {text}") from None
+
+
+# Returns the sorted values matched by one cron field, e.g. "1-5", "*/15", "mon,wed"
+def parse_field(
+    field: str, low: int, high: int, names: tuple[str, ...] = ()
+) -> list[int]:
+    values: set[int] = set()
+    for item in field.split(","):
+        body, _, step_text = item.partition("/")
+        step: int = int(step_text) if step_text else 1
+        if step <= 0:
+            raise ValueError(f"Invalid cron step: {item}")
+        if body == "*":
+            start, end = low, high
+        elif "-" in body:
+            first, _, last = body.partition("-")
+            start, end = parse_value(first, low, names), parse_value(last, low, names)
+        else:
+            start = parse_value(body, low, names)
+            # a/n runs from a to the end of the range
+            end = high if step_text else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Cron value out of range {low}-{high}: {item}")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+"""
+  Fires at the wall-clock times matched by a cron expression:
+  "minute hour day-of-month month day-of-week", with an optional leading seconds
+  field, or one of @yearly, @monthly, @weekly, @daily, @hourly.
+  Fields accept *, values, ranges a-b, steps */n a-b/n a/n, lists, and the
+  names jan-dec and sun-sat. As in cron, a job restricting both the day of the
+  month and the day of the week fires on days matching either.
+  Times are matched in `tz`: a local time skipped by a DST change fires at the
+  same offset from the change, and a local time repeated by one fires once.
+"""
+
+
+class CronSchedule(Schedule):
+    """
+    param expression: the cron expression.
+    param tz: time zone of the expression, defaults to UTC.
+    """
+
+    def __init__(self, expression: str, tz: tzinfo | None = None) -> None:
+        self.expression: str = expression
+        self.tz: tzinfo = tz if tz is not None else timezone.utc
+        fields: list[str] = MACROS.get(expression.strip(), expression).split()
+        if len(fields) == 5:
+            fields.insert(0, "0")
+        if len(fields) != 6:
+            raise ValueError(f"A cron expression has 5 or 6 fields: {expression}")
+        self.seconds: list[int] = parse_field(fields[0], 0, 59)
+        self.minutes: list[int] = parse_field(fields[1], 0, 59)
+        self.hours: list[int] = parse_field(fields[2], 0, 23)
+        self.days: list[int] = parse_field(fields[3], 1, 31)
+        self.months: list[int] = parse_field(fields[4], 1, 12, MONTH_NAMES)
+        # 7 is Sunday too, folded into 0
+        self.weekdays: list[int] = sorted(
+            {day % 7 for day in parse_field(fields[5], 0, 7, DAY_NAMES)}
+        )
+        self.any_day: bool = fields[3] == "*"
+        self.any_weekday: bool = fields[5] == "*"
+        # Fails early for expressions that never fire
+        self.next_after(datetime(2000, 1, 1))
+
+    def day_matches(self, day: datetime) -> bool:
+        in_month: bool = day.day in self.days
+        # isoweekday is 1 (Monday) to 7 (Sunday)
+        in_week: bool = day.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    """
+      The first naive local time strictly after `after` matched by the expression.
+      Each step jumps to the next matching value of the coarsest mismatching field.
+    """
+
+    def next_after(self, after: datetime) -> datetime:
+        time: datetime = after.replace(microsecond=0) + timedelta(seconds=1)
+        last_year: int = after.year + MAX_YEARS
+        while time.year <= last_year:
+            if time.month not in self.months:
+                index: int = bisect_left(self.months, time.month)
+                if index == len(self.months):
+                    time = datetime(time.year + 1, self.months[0], 1)
+                else:
+                    time = datetime(time.year, self.months[index], 1)
+                continue
+            if not self.day_matches(time):
+                time = datetime(time.year, time.month, time.day) + timedelta(days=1)
+                continue
+            index = bisect_left(self.hours, time.hour)
+            if index == len(self.hours):
+                time = datetime(time.year, time.month, time.day) + timedelta(days=1)
+                continue
+            if self.hours[index] != time.hour:
+                time = time.replace(hour=self.hours[index], minute=0, second=0)
+                continue
+            index = bisect_left(self.minutes, time.minute)
+            if index == len(self.minutes):
+                time = time.replace(minute=0, second=0) + timedelta(hours=1)
+                continue
+            if self.minutes[index] != time.minute:
+                time = time.replace(minute=self.minutes[index], second=0)
+                continue
+            index = bisect_left(self.seconds, time.second)
+            if index == len(self.seconds):
+                time = time.replace(second=0) + timedelta(minutes=1)
+                continue
+            return time.replace(second=self.seconds[index])
+        raise ValueError(f"The cron expression never fires: {self.expression}")
+
+    def next_fire_ns(self, after_ns: int) -> int:
+        after_s: int = after_ns // 1_000_000_000
+        local: datetime = datetime.fromtimestamp(after_s, self.tz).replace(tzinfo=None)
+        while True:
+            local = self.next_after(local)
+            fire_s: int = int(local.replace(tzinfo=self.tz).timestamp())
+            # Local times repeated by a DST change map to their first occurrence
+            if fire_s > after_s:
+                return fire_s * 1_000_000_000
+
+
+"""
+  A job registered with a Scheduler, started and stopped like a Timer.
+"""
+
+
+class ScheduledJob:
+    def __init__(
+        self,
+        scheduler: "Scheduler",
+        schedule: Schedule,
+        callback: Callback,
+        err_callback: ErrCallback | None = None,
+        metrics: bool = False,
+    ) -> None:
+        self.scheduler: Scheduler = scheduler
+        self.schedule: Schedule = schedule
+        self.callback: Callback = callback
+        self.err_callback: ErrCallback | None = err_callback
+        self.started: bool = False
+        self.stopped: bool = False
+        # Incremented on every start, heap entries and callbacks in flight from an
+        # earlier generation are ignored
+        self.generation: int = 0
+        # The fire time the job is waiting for, None while a callback runs
+        self.next_fire_ns: int | None = None
+        self.callback_task: asyncio.Task | None = None
+        self.metrics: TimerMetrics | None = TimerMetrics() if metrics else None
+
+    """
+      Starts the job if not already started, it first fires at the next time of
+      its schedule. Returns True if the job was started, False if it was running.
+    """
+
+    def start(self) -> bool:
+        if self.started:
+            return False
+        self.started = True
+        self.stopped = False
+        self.generation += 1
+        self.scheduler.enqueue(
+            self, self.schedule.next_fire_ns(self.scheduler.clock.time_ns())
+        )
+        return True
+
+    """
+      Stops the job if it is running, no callback starts after stop returns.
+    """
+
+    def stop(self) -> bool:
+        if self.stopped or not self.started:
+            return False
+        self.stopped = True
+        self.started = False
+        if self.next_fire_ns is not None:
+            self.next_fire_ns = None
+            self.scheduler.discard()
+        return True
+
+    def fire(self, scheduled_ns: int) -> None:
+        self.next_fire_ns = None
+        started: int = self.on_fire_started(scheduled_ns)
+        try:
+            result: None | Awaitable[None] = self.callback()
+        except Exception as e:
+            self.on_error(e)
+            result = None
+
+        if asyncio.iscoroutine(result):
+            self.callback_task = asyncio.create_task(
+                self.await_fire(result, scheduled_ns, started)
+            )
+            return
+        self.on_fire_done(scheduled_ns, started)
+
+    async def await_fire(
+        self, result: Awaitable[None], scheduled_ns: int, started: int
+    ) -> None:
+        generation: int = self.generation
+        try:
+            await result
+        except Exception as e:
+            self.on_error(e)
+        finally:
+            self.callback_task = None
+        if not self.stopped and generation == self.generation:
+            self.on_fire_done(scheduled_ns, started)
+
+    def on_error(self, error: Exception) -> None:
+        if self.metrics is not None:
+            self.metrics.errors += 1
+        if self.err_callback is not None:
+            self.err_callback(error)
+            return
+        # A failing fire does not stop the job, nor the other jobs due with it
+        asyncio.get_running_loop().call_exception_handler(
+            {"message": "Unhandled exception in scheduled job", "exception": error}
+        )
+
+    # Queues the next fire, fire times missed while the callback ran are skipped
+    def on_fire_done(self, scheduled_ns: int, started: int) -> None:
+        now: int = self.scheduler.clock.time_ns()
+        if self.metrics is not None:
+            self.metrics.callback_duration.record(
+                self.scheduler.clock.monotonic_ns() - started
+            )
+        if self.stopped:
+            return
+        next_fire_ns: int = self.schedule.next_fire_ns(scheduled_ns)
+        if next_fire_ns <= now:
+            if self.metrics is None:
+                next_fire_ns = self.schedule.next_fire_ns(now)
+            else:
+                while next_fire_ns <= now:
+                    self.metrics.skipped_ticks += 1
+                    next_fire_ns = self.schedule.next_fire_ns(next_fire_ns)
+        self.scheduler.enqueue(self, next_fire_ns)
+
+    # Records the fire and its lateness, returns the monotonic time the callback
+    # started, or 0 when metrics are disabled
+    def on_fire_started(self, scheduled_ns: int) -> int:
+        if self.metrics is None:
+            return 0
+        self.metrics.ticks += 1
+        self.metrics.tick_lateness.record(self.scheduler.clock.time_ns() - scheduled_ns)
+        return self.scheduler.clock.monotonic_ns()
+
+
+"""
+  Runs jobs on wall-clock schedules, cron expressions or aligned intervals.
+  Every job's next fire time is kept in one min-heap and the scheduler keeps a
+  single loop wakeup armed for the earliest of them, however many jobs it runs.
+  As with Timer, callbacks of a job never run concurrently, fire times missed
+  while a callback overran are skipped, and a stopped job never fires again.
+  The wakeup is re-checked against the wall clock when it fires, so a clock
+  stepped back delays the jobs instead of firing them early.
+"""
+
+
+class Scheduler:
+    """
+    param clock: source of wall-clock time, defaults to the clock of the loop.
+    param loop: the loop running the jobs, defaults to the running loop.
+    """
+
+    def __init__(
+        self,
+        clock: Clock | None = None,
+        loop: asyncio.AbstractEventLoop | None = None,
+    ) -> None:
+        self.clock: Clock = clock if clock is not None else loop_clock(loop)
+        self.event_loop: asyncio.AbstractEventLoop | None = loop
+        # (fire time, sequence, generation, job), entries of stopped or restarted
+        # jobs are discarded lazily
+        self.heap: list[tuple[int, int, int, ScheduledJob]] = []
+        self.sequence: int = 0
+        self.stale: int = 0
+        self.jobs: list[ScheduledJob] = []
+        self.wakeup_handle: asyncio.TimerHandle | None = None
+        self.wakeup_time: int | None = None
+        self.dispatching: bool = False
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    """
+      Registers a job and, unless start is False, starts it.
+      param schedule: a cron expression or a Schedule, e.g. IntervalSchedule.
+      param callback: a callable which can be synchronous or an async coroutine function.
+      param err_callback: called with the exceptions raised by callback, they are
+                          reported to the loop's exception handler otherwise.
+      param tz: time zone of a cron expression, defaults to UTC.
+      param metrics: when True, fires, skipped fire times, lateness and callback
+                     durations are recorded in job.metrics.
+    """
+
+    def schedule(
+        self,
+        schedule: str | Schedule,
+        callback: Callback,
+        err_callback: ErrCallback | None = None,
+        tz: tzinfo | None = None,
+        metrics: bool = False,
+        start: bool = True,
+    ) -> ScheduledJob:
+        if isinstance(schedule, str):
+            schedule = CronSchedule(schedule, tz)
+        job: ScheduledJob = ScheduledJob(
+            self, schedule, callback, err_callback, metrics
+        )
+        self.jobs.append(job)
+        if start:
+            job.start()
+        return job
+
+    """
+      Stops a job and forgets it.
+      Returns True if the job was registered with this scheduler.
+    """
+
+    def unschedule(self, job: ScheduledJob) -> bool:
+        if job not in self.jobs:
+            return False
+        job.stop()
+        self.jobs.remove(job)
+        return True
+
+    """
+      Stops every job, see ScheduledJob.stop.
+    """
+
+    def stop(self) -> None:
+        for job in self.jobs:
+            job.stop()
+
+    def enqueue(self, job: ScheduledJob, fire_ns: int) -> None:
+        job.next_fire_ns = fire_ns
+        self.sequence += 1
+        heapq.heappush(self.heap, (fire_ns, self.sequence, job.generation, job))
+        self.arm()
+
+    # A job left the heap, its entry is dropped once it reaches the top
+    def discard(self) -> None:
+        self.stale += 1
+        if self.stale > len(self.heap) // 2:
+            self.heap = [entry for entry in self.heap if self.is_live(entry)]
+            heapq.heapify(self.heap)
+            self.stale = 0
+        self.arm()
+
+    def is_live(self, entry: tuple[int, int, int, ScheduledJob]) -> bool:
+        fire_ns, _, generation, job = entry
+        return generation == job.generation and job.next_fire_ns == fire_ns
+
+    def arm(self) -> None:
+        if self.dispatching:
+            return
+        while self.heap and not self.is_live(self.heap[0]):
+            heapq.heappop(self.heap)
+            self.stale = max(0, self.stale - 1)
+        if not self.heap:
+            if self.wakeup_handle is not None:
+                self.wakeup_handle.cancel()
+                self.wakeup_handle = None
+                self.wakeup_time = None
+            return
+        fire_ns: int = self.heap[0][0]
+        if self.wakeup_handle is not None:
+            if self.wakeup_time == fire_ns:
+                return
+            self.wakeup_handle.cancel()
+        self.wakeup_time = fire_ns
+        loop: asyncio.AbstractEventLoop = (
+            self.event_loop
+            if self.event_loop is not None
+            else asyncio.get_running_loop()
+        )
+        self.wakeup_handle = loop.call_later(
+            max(0.0, ns_to_seconds(fire_ns - self.clock.time_ns())), self.on_wakeup
+        )
+
+    def on_wakeup(self) -> None:
+        self.wakeup_handle = None
+        self.wakeup_time = None
+        now: int = self.clock.time_ns()
+        self.dispatching = True
+        try:
+            while self.heap and self.heap[0][0] <= now:
+                entry: tuple[int, int, int, ScheduledJob] = heapq.heappop(self.heap)
+                if not self.is_live(entry):
+                    self.stale = max(0, self.stale - 1)
+                    continue
+                # Jobs stopped by an earlier callback of this batch are not live
+                entry[3].fire(entry[0])
+        finally:
+            self.dispatching = False
+            self.arm()
@@ -0,0 +1,255 @@
+import asyncio
+import contextlib
+import os
+import struct
+import sys
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+
+try:
+    from .Clock import SYSTEM_CLOCK
+    from .RateLimiter import RateLimiter
+except ImportError:
+    from Clock import SYSTEM_CLOCK
+    from RateLimiter import RateLimiter
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# The arrival time as whole nanoseconds and the remainder of its scaling by rate,
+# then rate, per and burst, as signed 64 bit integers. The scaled arrival time
+# itself, monotonic time * rate, does not fit in 64 bits on a host up for long
+LAYOUT: struct.Struct = struct.Struct("=qqqqq")
+TAT: struct.Struct = struct.Struct("=qq")
+
+# SharedMemory(track=False) is available from Python 3.13
+TRACK_SUPPORTED: bool = sys.version_info >= (3, 13)
+
+
+"""
+  Inter-process lock backed by flock on a lock file, usable by unrelated processes.
+"""
+
+
+class FileLock:
+    def __init__(self, path: str) -> None:
+        if fcntl is None:
+            raise RuntimeError(
+                "File locks are not supported on this platform, pass lock= instead"
+            )
+        self.fd: int = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def acquire(self) -> bool:
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return True
+
+    def release(self) -> None:
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+@contextlib.contextmanager
+def untracked_shared_memory():
+    # Before Python 3.13 every process that opens a block registers it with the
+    # resource tracker, which unlinks it as soon as that process exits. The
+    # registration is skipped, so the block is only removed by unlink()
+    register = resource_tracker.register
+    unregister = resource_tracker.unregister
+
+    def register_except_shared_memory(name: str, rtype: str) -> None:
+        if rtype != "shared_memory":
+            register(name, rtype)
+
+    def unregister_except_shared_memory(name: str, rtype: str) -> None:
+        if rtype != "shared_memory":
+            unregister(name, rtype)
+
+    resource_tracker.register = register_except_shared_memory
+    resource_tracker.unregister = unregister_except_shared_memory
+    try:
+        yield
+    finally:
+        resource_tracker.register = register
+        resource_tracker.unregister = unregister
+
+
+def open_shared_memory(name: str, create: bool) -> shared_memory.SharedMemory:
+    if TRACK_SUPPORTED:
+        return shared_memory.SharedMemory(
+            name=name, create=create, size=LAYOUT.size, track=False
+        )
+    with untracked_shared_memory():
+        return shared_memory.SharedMemory(name=name, create=create, size=LAYOUT.size)
+
+
+"""
+  GCRA admission state shared by every process on the host that opens the same name.
+  The theoretical arrival time lives in a shared memory block next to the limiter
+  configuration, and updates happen under an inter-process lock, so concurrent
+  processes never admit more than the shared budget.
+  A check that fails is decided from a lock free read, only admissions take the
+  lock. An admission costs a few µs, mostly interpreter overhead and the lock's
+  system calls, and a refusal about a third of that. Sub-µs admission would need
+  the check and the update done in native code with an atomic compare-and-swap,
+  which the standard library does not expose.
+"""
+
+
+class SharedGcraWindow:
+    """
+    param name: name of the shared memory block, processes sharing a budget
+                use the same name.
+    param rate / per / burst: as for GcraWindow, must match across processes.
+    param lock: inter-process lock with acquire / release, for instance a
+                multiprocessing.Lock created before forking the workers.
+                Defaults to flock on a lock file in the system temp directory.
+    """
+
+    def __init__(
+        self, name: str, rate: int, per: int, burst: int = 1, lock=None
+    ) -> None:
+        self.name: str = name
+        self.rate: int = rate
+        self.per: int = per
+        self.burst: int = burst
+        self.lock = (
+            lock
+            if lock is not None
+            else FileLock(os.path.join(tempfile.gettempdir(), f"{name}.lock"))
+        )
+
+        with self.lock:
+            try:
+                self.block: shared_memory.SharedMemory = open_shared_memory(name, True)
+                LAYOUT.pack_into(self.block.buf, 0, 0, 0, rate, per, burst)
+            except FileExistsError:
+                self.block = open_shared_memory(name, False)
+                if self.block.size < LAYOUT.size:
+                    self.block.close()
+                    raise ValueError(
+                        f"Shared rate limit {name} was created by an older version"
+                    )
+                config: tuple[int, int, int] = LAYOUT.unpack_from(self.block.buf)[2:]
+                if config != (rate, per, burst):
+                    self.block.close()
+                    raise ValueError(
+                        f"Shared rate limit {name} is configured as "
+                        f"rate={config[0]}, per={config[1]}, burst={config[2]}"
+                    )
+
+    # Lock free read, only used to decide when to check again
+    def ready_at(self, reserved: int = 0, cost: int = 1) -> int:
+        return (
+            self.load_tat() + (reserved + cost - self.burst) * self.per
+        ) // self.rate + 1
+
+    def record(self, now: int, cost: int = 1) -> None:
+        with self.lock:
+            self.store_tat(max(self.load_tat(), now * self.rate) + cost * self.per)
+
+    # Checks and records atomically across processes
+    def try_record(self, now: int, reserved: int = 0, cost: int = 1) -> bool:
+        # The arrival time only moves forward, a task refused by a lock free
+        # read would be refused under the lock too, a torn read is off by under 1 ns
+        if self.ready_at(reserved, cost) > now:
+            return False
+        with self.lock:
+            tat: int = self.load_tat()
+            if tat + (reserved + cost - self.burst) * self.per >= now * self.rate:
+                return False
+            self.store_tat(max(tat, now * self.rate) + cost * self.per)
+            return True
+
+    def max_cost(self) -> int:
+        return self.burst
+
+    # The arrival time scaled by rate, as GcraWindow.tat
+    def load_tat(self) -> int:
+        nanoseconds, remainder = TAT.unpack_from(self.block.buf)
+        return nanoseconds * self.rate + remainder
+
+    def store_tat(self, tat: int) -> None:
+        TAT.pack_into(self.block.buf, 0, *divmod(tat, self.rate))
+
+    def close(self) -> None:
+        self.block.close()
+        if isinstance(self.lock, FileLock):
+            self.lock.close()
+
+    """
+      Removes the shared memory block, call once when the budget is no longer used
+      by any process.
+    """
+
+    def unlink(self) -> None:
+        if TRACK_SUPPORTED:
+            self.block.unlink()
+            return
+        with untracked_shared_memory():
+            self.block.unlink()
+
+
+"""
+    Implements a rate limiter whose budget is shared by every process on the host
+    that uses the same name, for instance the workers of a prefork server.
+    Tasks are charged when they start, atomically with the admission check.
+"""
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    param name: name of the shared budget.
+    param rate: the maximum number of tasks allowed in the time window,
+                across all processes.
+    param per: the time window in nanoseconds.
+    param burst / max_concurrency / loop: as for RateLimiter.
+    param lock: inter-process lock, see SharedGcraWindow.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: int,
+        per: int,
+        burst: int = 1,
+        max_concurrency: int = 1,
+        lock=None,
+        loop: asyncio.AbstractEventLoop | None = None,
+    ) -> None:
+        super().__init__(
+            rate,
+            per,
+            engine="GCRA",
+            burst=burst,
+            max_concurrency=max_concurrency,
+            record_on="START",
+            loop=loop,
+            # The state is shared with other processes, so only real time applies
+            clock=SYSTEM_CLOCK,
+        )
+        self.window: SharedGcraWindow = SharedGcraWindow(name, rate, per, burst, lock)
+
+    # Every process must agree on the rate, which is checked once, when each
+    # process opens the block, so it cannot change afterwards
+    def set_rate(self, rate: int, per: int | None = None) -> None:
+        raise TypeError(
+            "The rate of a shared budget is fixed when its block is created, "
+            "create a budget under a new name to change it"
+        )
+
+    def close(self) -> None:
+        self.window.close()
+
+    def unlink(self) -> None:
+        self.window.unlink()
@@ -0,0 +1,545 @@
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from collections.abc import Hashable, Iterator
+from enum import IntEnum
+from typing import TYPE_CHECKING
+
+try:
+    from .RateLimiter import CompositeWindow, GcraWindow, RateLimiter, SlidingWindow
+    from .Timer import Timer
+except ImportError:
+    from RateLimiter import CompositeWindow, GcraWindow, RateLimiter, SlidingWindow
+    from Timer import Timer
+
+if TYPE_CHECKING:
+    from .KeyedRateLimiter import KeyedRateLimiter
+
+MAGIC: bytes = b"AUST"
+VERSION: int = 3
+FILE_HEADER: bytes = MAGIC + struct.pack("<H", VERSION)
+
+# Payload size, crc32 of the rest of the record, kind, wall-clock time of the
+# snapshot and name size, followed by the name and the payload
+RECORD = struct.Struct("<IIBqH")
+WINDOW = struct.Struct("<BI")
+TIMER = struct.Struct("<?q")
+KEYED = struct.Struct("<IIq")
+# Type tag and size of an encoded key: bytes of a str, bytes or int, items of a tuple
+KEY = struct.Struct("<BI")
+FLOAT = struct.Struct("<d")
+
+
+class RecordKind(IntEnum):
+    DELETED = 0
+    LIMITER = 1
+    TIMER = 2
+    KEYED = 3
+
+
+class WindowKind(IntEnum):
+    SLIDING_WINDOW = 0
+    GCRA = 1
+
+
+class KeyTag(IntEnum):
+    STR = 0
+    BYTES = 1
+    INT = 2
+    FLOAT = 3
+    TUPLE = 4
+
+
+"""
+  Window history of the keys of a KeyedRateLimiter restored by a StateStore.
+  Keys are only materialized when first used, so restoring is a few bulk copies
+  whatever the number of keys, and the whole table is dropped once the newest
+  timestamp in it has left the window.
+"""
+
+
+class RestoredKeys:
+    __slots__ = ("index", "ends", "timestamps", "base", "expires")
+
+    """
+    param keys: the restored keys.
+    param ends: end of each key's timestamps in timestamps.
+    param timestamps: every key's timestamps, relative to base.
+    param base: the monotonic time the snapshot was taken at.
+    param expires: the monotonic time from which no timestamp matters anymore.
+    """
+
+    def __init__(
+        self, keys: list, ends: array, timestamps: array, base: int, expires: int
+    ) -> None:
+        self.index: dict[Hashable, int] = dict(zip(keys, range(len(keys))))
+        self.ends: array = ends
+        self.timestamps: array = timestamps
+        self.base: int = base
+        self.expires: int = expires
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    # Monotonic timestamps of a key, None when it was not restored or is taken
+    def pop(self, key: Hashable) -> list[int] | None:
+        index: int | None = self.index.pop(key, None)
+        if index is None:
+            return None
+        return self.history(index)
+
+    def items(self) -> Iterator[tuple[Hashable, list[int]]]:
+        for key, index in self.index.items():
+            yield key, self.history(index)
+
+    def history(self, index: int) -> list[int]:
+        start: int = self.ends[index - 1] if index > 0 else 0
+        return [
+            value + self.base for value in self.timestamps[start : self.ends[index]]
+        ]
+
+
+"""
+  Persists the window state of rate limiters and the schedule of timers in a
+  binary file, so a restarted process resumes where the budgets left off instead
+  of admitting a full window at once.
+  Snapshots are appended under a name and the newest one of each name wins. Each
+  record carries a crc32, a record torn by a crash is discarded, along with any
+  after it, when the file is opened again. Once the file holds more than
+  compact_ratio times the size of the live records, it is rewritten with only
+  those, into a temporary file atomically renamed over it.
+  Times are saved relative to the wall-clock time of the snapshot and mapped back
+  onto the monotonic clock of the restoring process, see Clock.to_monotonic_ns,
+  so the host's wall clock must not jump between the save and the restore.
+"""
+
+
+class StateStore:
+    """
+    param path: the state file, created if missing.
+    param fsync: when True every save is flushed to disk before returning, so a
+                 power loss keeps it. Otherwise saves survive a crash of the
+                 process but not of the host.
+    param compact_ratio: the file is compacted once larger than compact_ratio
+                         times its live records.
+    param compact_min_bytes: files smaller than this are never compacted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fsync: bool = True,
+        compact_ratio: float = 2.0,
+        compact_min_bytes: int = 1 << 16,
+    ) -> None:
+        if compact_ratio <= 1:
+            raise ValueError("compact_ratio must be greater than 1")
+
+        self.path: str = path
+        self.fsync: bool = fsync
+        self.compact_ratio: float = compact_ratio
+        self.compact_min_bytes: int = compact_min_bytes
+        # name -> (kind, wall-clock time of the snapshot, payload)
+        self.records: dict[str, tuple[RecordKind, int, bytes]] = {}
+        # Size of the newest record of each name
+        self.record_sizes: dict[str, int] = {}
+        self.live_bytes: int = 0
+        self.file_bytes: int = self.load()
+        self.file = open(path, "r+b")
+        self.file.truncate(self.file_bytes)
+        self.file.seek(self.file_bytes)
+
+    # Reads every intact record of the file, returns the size of the intact part
+    def load(self) -> int:
+        try:
+            size: int = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size < len(FILE_HEADER):
+            # A new file, or one torn while its header was written
+            if size > 0:
+                with open(self.path, "rb") as file:
+                    if not FILE_HEADER.startswith(file.read()):
+                        raise ValueError(f"{self.path} is not a state file")
+            with open(self.path, "wb") as file:
+                file.write(FILE_HEADER)
+            return len(FILE_HEADER)
+
+        with open(self.path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                if view[: len(MAGIC)] != MAGIC:
+                    raise ValueError(f"{self.path} is not a state file")
+                if view[len(MAGIC) : len(FILE_HEADER)] != FILE_HEADER[len(MAGIC) :]:
+                    raise ValueError(f"{self.path} has an unsupported version")
+                return self.scan(view, size)
+
+    def scan(self, view: mmap.mmap, size: int) -> int:
+        offset: int = len(FILE_HEADER)
+        while offset + RECORD.size <= size:
+            payload_size, crc, kind, wall, name_size = RECORD.unpack_from(view, offset)
+            end: int = offset + RECORD.size + name_size + payload_size
+            if end > size or zlib.crc32(view[offset + 8 : end]) != crc:
+                break
+            name_start: int = offset + RECORD.size
+            name: str = view[name_start : name_start + name_size].decode()
+            self.put(
+                name,
+                RecordKind(kind),
+                wall,
+                view[name_start + name_size : end],
+                end - offset,
+            )
+            offset = end
+        return offset
+
+    def put(
+        self, name: str, kind: RecordKind, wall: int, payload: bytes, size: int
+    ) -> None:
+        self.live_bytes -= self.record_sizes.pop(name, 0)
+        self.records.pop(name, None)
+        if kind == RecordKind.DELETED:
+            return
+        self.records[name] = (kind, wall, payload)
+        self.record_sizes[name] = size
+        self.live_bytes += size
+
+    def append(self, name: str, kind: RecordKind, wall: int, payload: bytes) -> None:
+        record: bytes = encode_record(name, kind, wall, payload)
+        self.file.write(record)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.file_bytes += len(record)
+        self.put(name, kind, wall, payload, len(record))
+        if (
+            self.file_bytes >= self.compact_min_bytes
+            and self.file_bytes
+            > self.compact_ratio * (self.live_bytes + len(FILE_HEADER))
+        ):
+            self.compact()
+
+    # Rewrites the file with only the newest record of each name
+    def compact(self) -> None:
+        temporary: str = self.path + ".compact"
+        with open(temporary, "wb") as file:
+            file.write(FILE_HEADER)
+            for name, (kind, wall, payload) in self.records.items():
+                file.write(encode_record(name, kind, wall, payload))
+            file.flush()
+            os.fsync(file.fileno())
+        self.file.close()
+        os.replace(temporary, self.path)
+        sync_directory(self.path)
+        self.file_bytes = len(FILE_HEADER) + self.live_bytes
+        self.file = open(self.path, "r+b")
+        self.file.seek(self.file_bytes)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.records
+
+    def names(self) -> list[str]:
+        return list(self.records)
+
+    # Forgets a snapshot, returns False if there was none
+    def delete(self, name: str) -> bool:
+        if name not in self.records:
+            return False
+        self.append(name, RecordKind.DELETED, 0, b"")
+        return True
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> "StateStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    """
+      Saves the window state of a limiter, every window of a composite limit
+      included. The windows of a parent limiter are saved with the parent.
+      Raises TypeError for a window kept outside the process, such as those of
+      SharedRateLimiter and DistributedRateLimiter.
+    """
+
+    def save_limiter(self, name: str, limiter: RateLimiter) -> None:
+        now: int = limiter.clock.monotonic_ns()
+        wall: int = limiter.clock.to_wall_ns(now)
+        windows: list = limiter_windows(limiter)
+        payload: list[bytes] = [struct.pack("<H", len(windows))]
+        for window in windows:
+            values: array = array("q", window.snapshot(now))
+            payload.append(WINDOW.pack(window_kind(window), len(values)))
+            payload.append(values.tobytes())
+        self.append(name, RecordKind.LIMITER, wall, b"".join(payload))
+
+    """
+      Restores the window state saved under name into a limiter configured like
+      the saved one, rates and periods may differ. Returns False when nothing was
+      saved under name. Raises ValueError if the limiter's windows do not match,
+      TypeError as save_limiter.
+    """
+
+    def restore_limiter(self, name: str, limiter: RateLimiter) -> bool:
+        windows: list = limiter_windows(limiter)
+        record: tuple[RecordKind, int, bytes] | None = self.get(
+            name, RecordKind.LIMITER
+        )
+        if record is None:
+            return False
+        _, wall, payload = record
+        (count,) = struct.unpack_from("<H", payload)
+        if count != len(windows):
+            raise ValueError(
+                f"{name} was saved with {count} windows, the limiter has {len(windows)}"
+            )
+        now: int = limiter.clock.to_monotonic_ns(wall)
+        offset: int = 2
+        restored: list[tuple[SlidingWindow | GcraWindow, list[int]]] = []
+        for window in windows:
+            kind, size = WINDOW.unpack_from(payload, offset)
+            offset += WINDOW.size
+            if kind != window_kind(window):
+                raise ValueError(
+                    f"{name} was saved with a {WindowKind(kind).name} window, "
+                    f"the limiter has a {window_kind(window).name} one"
+                )
+            values: array = array("q")
+            values.frombytes(payload[offset : offset + 8 * size])
+            offset += 8 * size
+            restored.append((window, values.tolist()))
+        for window, values in restored:
+            window.restore(values, now)
+        return True
+
+    # Saves the next tick of a timer, or that it is stopped
+    def save_timer(self, name: str, timer: Timer) -> None:
+        now: int = timer.clock.monotonic_ns()
+        payload: bytes = TIMER.pack(timer.started, timer.next_tick_time - now)
+        self.append(name, RecordKind.TIMER, timer.clock.to_wall_ns(now), payload)
+
+    """
+      Starts a timer with the next tick saved under name, a tick missed while
+      the process was down fires at once and the schedule resumes from it.
+      Returns False when nothing was saved under name, the timer was saved
+      stopped or the timer is already running.
+    """
+
+    def restore_timer(self, name: str, timer: Timer) -> bool:
+        record: tuple[RecordKind, int, bytes] | None = self.get(name, RecordKind.TIMER)
+        if record is None:
+            return False
+        _, wall, payload = record
+        started, next_tick = TIMER.unpack(payload)
+        if not started:
+            return False
+        return timer.start(timer.clock.to_monotonic_ns(wall) + next_tick)
+
+    """
+      Saves the window history of every key of a keyed limiter whose window has
+      not fully expired. Keys must be str, bytes, int, float or tuples of them,
+      see encode_key.
+    """
+
+    def save_keyed(self, name: str, keyed: "KeyedRateLimiter") -> None:
+        now: int = keyed.clock.monotonic_ns()
+        oldest: int = now - keyed.per
+        histories: list = [
+            (key, state.ring_buffer) for key, state in keyed.keys.items()
+        ]
+        # Keys evicted before their window expired are saved from their tombstone
+        histories.extend(
+            (key, [newest] * units) for key, (units, newest) in keyed.evicted.items()
+        )
+        # Restored keys not used since are saved again, until they expire
+        if keyed.restored is not None and keyed.restored.expires > now:
+            histories.extend(
+                (key, history)
+                for key, history in keyed.restored.items()
+                if key not in keyed.keys
+            )
+        keys: list = []
+        ends: array = array("q")
+        timestamps: array = array("q")
+        for key, history in histories:
+            relevant: list[int] = [
+                timestamp - now for timestamp in history if timestamp >= oldest
+            ]
+            if relevant:
+                keys.append(key)
+                timestamps.extend(relevant)
+                ends.append(len(timestamps))
+        parts: list[bytes] = []
+        try:
+            for key in keys:
+                encode_key(key, parts)
+        except TypeError:
+            raise ValueError(
+                f"Keys of {name} must be str, bytes, int, float or tuples of them"
+            )
+        encoded: bytes = b"".join(parts)
+        newest: int = max(timestamps) if timestamps else -keyed.per
+        payload: bytes = b"".join(
+            (
+                KEYED.pack(len(keys), len(encoded), newest),
+                encoded,
+                ends.tobytes(),
+                timestamps.tobytes(),
+            )
+        )
+        self.append(name, RecordKind.KEYED, keyed.clock.to_wall_ns(now), payload)
+
+    """
+      Restores the keys saved under name into a keyed limiter, each key gets its
+      history back when it is first used. Returns False when nothing was saved
+      under name.
+    """
+
+    def restore_keyed(self, name: str, keyed: "KeyedRateLimiter") -> bool:
+        record: tuple[RecordKind, int, bytes] | None = self.get(name, RecordKind.KEYED)
+        if record is None:
+            return False
+        _, wall, payload = record
+        # Sliced without copying, the timestamps can take megabytes
+        view: memoryview = memoryview(payload)
+        count, encoded_size, newest = KEYED.unpack_from(view)
+        offset: int = KEYED.size
+        keys: list
+        keys, offset = decode_keys(view, offset, count)
+        ends: array = array("q")
+        ends.frombytes(view[offset : offset + 8 * count])
+        offset += 8 * count
+        timestamps: array = array("q")
+        timestamps.frombytes(view[offset:])
+        base: int = keyed.clock.to_monotonic_ns(wall)
+        keyed.restored = RestoredKeys(
+            keys, ends, timestamps, base, base + newest + keyed.per
+        )
+        return True
+
+    def get(self, name: str, kind: RecordKind) -> tuple[RecordKind, int, bytes] | None:
+        record: tuple[RecordKind, int, bytes] | None = self.records.get(name)
+        if record is not None and record[0] != kind:
+            raise ValueError(
+                f"{name} holds a {record[0].name} snapshot, not a {kind.name} one"
+            )
+        return record
+
+
+def encode_record(name: str, kind: RecordKind, wall: int, payload: bytes) -> bytes:
+    encoded: bytes = name.encode()
+    body: bytes = RECORD.pack(len(payload), 0, kind, wall, len(encoded))[8:]
+    body += encoded + payload
+    return struct.pack("<II", len(payload), zlib.crc32(body)) + body
+
+
+"""
+  Appends the encoding of a key to parts: a type tag and a size, followed by the
+  UTF-8 of a str, the bytes of a bytes, the little-endian two's complement of an
+  int, the IEEE 754 double of a float or the encoded items of a tuple. Unlike
+  marshal or pickle, the format does not depend on the Python version.
+  Raises TypeError for any other type.
+"""
+
+
+def encode_key(key, parts: list[bytes]) -> None:
+    if isinstance(key, str):
+        data: bytes = key.encode("utf-8", "surrogatepass")
+        parts.append(KEY.pack(KeyTag.STR, len(data)))
+        parts.append(data)
+    elif isinstance(key, bytes):
+        parts.append(KEY.pack(KeyTag.BYTES, len(key)))
+        parts.append(key)
+    elif isinstance(key, int):
+        data = key.to_bytes(key.bit_length() // 8 + 1, "little", signed=True)
+        parts.append(KEY.pack(KeyTag.INT, len(data)))
+        parts.append(data)
+    elif isinstance(key, float):
+        parts.append(KEY.pack(KeyTag.FLOAT, FLOAT.size))
+        parts.append(FLOAT.pack(key))
+    elif isinstance(key, tuple):
+        parts.append(KEY.pack(KeyTag.TUPLE, len(key)))
+        for item in key:
+            encode_key(item, parts)
+    else:
+        raise TypeError(f"Cannot store a key of type {type(key).__name__}")
+
+
+# Returns the count keys encoded from offset and the offset following them
+def decode_keys(view: memoryview, offset: int, count: int) -> tuple[list, int]:
+    keys: list = []
+    # str keys are by far the most common, they skip the dispatch of decode_key
+    str_tag: int = KeyTag.STR.value
+    for _ in range(count):
+        tag, size = KEY.unpack_from(view, offset)
+        if tag == str_tag:
+            offset += KEY.size
+            keys.append(str(view[offset : offset + size], "utf-8", "surrogatepass"))
+            offset += size
+        else:
+            key, offset = decode_key(view, offset)
+            keys.append(key)
+    return keys, offset
+
+
+# Returns the key encoded at offset and the offset following it
+def decode_key(view: memoryview, offset: int) -> tuple[Hashable, int]:
+    tag, size = KEY.unpack_from(view, offset)
+    offset += KEY.size
+    if tag == KeyTag.TUPLE:
+        items: list = []
+        for _ in range(size):
+            item, offset = decode_key(view, offset)
+            items.append(item)
+        return tuple(items), offset
+    data: memoryview = view[offset : offset + size]
+    offset += size
+    if tag == KeyTag.STR:
+        return str(data, "utf-8", "surrogatepass"), offset
+    if tag == KeyTag.BYTES:
+        return bytes(data), offset
+    if tag == KeyTag.INT:
+        return int.from_bytes(data, "little", signed=True), offset
+    if tag == KeyTag.FLOAT:
+        return FLOAT.unpack(data)[0], offset
+    raise ValueError(f"Unknown key type tag {tag}")
+
+
+def limiter_windows(limiter: RateLimiter) -> list:
+    windows: list = (
+        limiter.window.windows
+        if isinstance(limiter.window, CompositeWindow)
+        else [limiter.window]
+    )
+    for window in windows:
+        if not isinstance(window, (SlidingWindow, GcraWindow)):
+            raise TypeError(
+                f"{type(window).__name__} keeps its state outside the process, "
+                "it has nothing to save"
+            )
+    return windows
+
+
+def window_kind(window: SlidingWindow | GcraWindow) -> WindowKind:
+    return (
+        WindowKind.SLIDING_WINDOW
+        if isinstance(window, SlidingWindow)
+        else WindowKind.GCRA
+    )
+
+
+# Makes a rename durable, where the platform allows opening a directory
+def sync_directory(path: str) -> None:
+    try:
+        descriptor: int = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
@@ -1,7 +1,26 @@
 import asyncio
-import time
+import concurrent.futures
+import itertools
+import math
+import weakref
+import zlib
 from collections.abc import Awaitable, Callable
 from enum import Enum
+from typing import TYPE_CHECKING
+
+try:
+    from .Clock import Clock, loop_clock
+    from .LoopInbox import call_soon_batched
+    from .Metrics import TimerMetrics
+    from .Offload import ExecutorOption, resolve_executor, run_in_executor
+except ImportError:
+    from Clock import Clock, loop_clock
+    from LoopInbox import call_soon_batched
+    from Metrics import TimerMetrics
+    from Offload import ExecutorOption, resolve_executor, run_in_executor
+
+if TYPE_CHECKING:
+    from .TimerWheel import TimerWheel, WheelEntry
 
 Callback = Callable[[], None | Awaitable[None]]
 ErrCallback = Callable[[Exception], None]
@@ -11,12 +30,45 @@ def ns_to_seconds(ns: int) -> float:
     return ns / 1_000_000_000
 
 
+# Jitter keys of timers constructed without one, in construction order
+JITTER_SEQUENCE: itertools.count = itertools.count()
+
+# The wakeup that fired the last tick recorded on each loop, a tick fired by the
+# same wakeup as the tick before it did not need a wakeup of its own
+LAST_WAKEUP: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def set_result_unless_done(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+# Sleeps until the loop time `when`, so that sleepers sharing it wake up together
+async def sleep_until(when: float) -> None:
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    future: asyncio.Future = loop.create_future()
+    handle: asyncio.TimerHandle = loop.call_at(when, set_result_unless_done, future)
+    try:
+        await future
+    finally:
+        handle.cancel()
+
+
 # Create an enum for schedule policy
 class SchedulePolicy(Enum):
     FIXED_SCHEDULE = "FIXED_SCHEDULE"
     FIXED_DELAY = "FIXED_DELAY"
 
 
+# Create an enum for how ticks are driven
+# TASK: every tick sleeps in its own task and runs the callback in another task
+# CALL_AT: ticks are driven by loop.call_at handles, a task is only created
+#          when the callback returns a coroutine
+class TickMode(Enum):
+    TASK = "TASK"
+    CALL_AT = "CALL_AT"
+
+
 """
   Implements a repeating async-friendly timer that calls a provided function at a fixed
   timeout interval until stopped.
@@ -28,6 +80,29 @@ class Timer:
     Stores the timeout and the callback function and initializes two flags:
     param timeout_ns: interval between ticks in nanoseconds.
     param callback: a callable which can be synchronous or an async coroutine function.
+    param wheel: optional shared TimerWheel, when provided the timer registers its
+                 deadlines with the wheel instead of creating its own sleep tasks.
+    param tick_mode: "TASK" or "CALL_AT", ignored when a wheel is provided.
+    param loop: the loop running the timer, required by start_threadsafe before the
+                first start, defaults to the running loop if constructed inside one.
+    param clock: source of tick times, defaults to the wheel's clock or the clock
+                 of the loop.
+    param metrics: when True, tick lateness, skipped ticks and callback durations
+                   are recorded in self.metrics, which is None otherwise.
+    param slack_ns: how late a tick may fire. Wakeups are rounded up to a grid of
+                    slack_ns on the loop's time, so timers sharing the same slack
+                    whose ticks fall in the same slot fire from a single wakeup.
+                    The schedule itself is not rounded, so it does not drift.
+    param jitter_ns: spreads timers started together over up to jitter_ns, by
+                     delaying the first tick, and every tick after it, by a fixed
+                     offset derived from jitter_key.
+    param jitter_key: any value whose repr identifies the timer, e.g. a peer name,
+                      the same key always gets the same offset. Defaults to the
+                      timer's construction order.
+    param executor: where a sync callback runs, None runs it on the loop, "THREAD"
+                    or "PROCESS" in a pool shared by all timers, or an Executor.
+                    The tick awaits the callback like an async one, so ticks do
+                    not overlap. Async callbacks always run on the loop.
 
     started / stopped: booleans used to prevent double-starts and to signal stopping.
     """
@@ -38,9 +113,20 @@ class Timer:
         callback: Callback,
         err_callback: ErrCallback | None = None,
         schedule_policy: str = "FIXED_SCHEDULE",
+        wheel: "TimerWheel | None" = None,
+        tick_mode: str = "TASK",
+        loop: asyncio.AbstractEventLoop | None = None,
+        clock: Clock | None = None,
+        metrics: bool = False,
+        slack_ns: int = 0,
+        jitter_ns: int = 0,
+        jitter_key: object = None,
+        executor: ExecutorOption = None,
     ) -> None:
         if timeout_ns <= 0:
             raise ValueError("timeout_ns must be a positive integer")
+        if slack_ns < 0 or jitter_ns < 0:
+            raise ValueError("slack_ns and jitter_ns must not be negative")
 
         self.timeout_ns: int = timeout_ns
         self.callback: Callback = callback
@@ -48,6 +134,42 @@ class Timer:
         self.stopped: bool = False
         self.started: bool = False
         self.background_sleep_task: asyncio.Task | None = None
+        self.wheel: "TimerWheel | None" = wheel
+        self.wheel_entry: "WheelEntry | None" = None
+        self.timer_handle: asyncio.TimerHandle | None = None
+        # Task awaiting an async callback fired by the wheel or a timer handle,
+        # never cancelled by stop
+        self.callback_task: asyncio.Task | None = None
+        # Incremented on every start, so a callback still in flight from before a
+        # stop/start cycle does not schedule a second chain of ticks
+        self.generation: int = 0
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+        self.event_loop: asyncio.AbstractEventLoop | None = loop
+        if clock is None:
+            clock = wheel.clock if wheel is not None else loop_clock(loop)
+        self.clock: Clock = clock
+        self.metrics: TimerMetrics | None = TimerMetrics() if metrics else None
+        self.slack_ns: int = slack_ns
+        if jitter_key is None:
+            jitter_key = next(JITTER_SEQUENCE)
+        # crc32 rather than hash, which is salted per process for strings
+        self.jitter_offset_ns: int = (
+            zlib.crc32(repr(jitter_key).encode()) % jitter_ns if jitter_ns > 0 else 0
+        )
+        # Identifies the wakeup armed for the next tick, see LAST_WAKEUP
+        self.wakeup_key: object = None
+        # The tick armed next, or the one running, e.g. saved by a StateStore.
+        # The wheel entry's own deadline is rounded to the slack grid
+        self.next_tick_time: int = 0
+        self.executor: concurrent.futures.Executor | None = (
+            None
+            if asyncio.iscoroutinefunction(callback)
+            else resolve_executor(executor)
+        )
 
         try:
             # Check if the provided schedule_policy is valid
@@ -57,29 +179,52 @@ class Timer:
                 f"Invalid schedule_policy: {schedule_policy}. Must be one of {[policy.value for policy in SchedulePolicy]}"
             )
 
+        try:
+            self.tick_mode: TickMode = TickMode(tick_mode)
+        except ValueError:
+            raise ValueError(
+                f"Invalid tick_mode: {tick_mode}. Must be one of {[mode.value for mode in TickMode]}"
+            )
+
     """
       Starts the timer loop if not already started.
       Returns True if the timer was started, False if it was already running.
+      param first_tick_ns: monotonic time of the first tick, e.g. restored by a
+                           StateStore, defaults to timeout_ns from now plus the
+                           jitter offset. A time in the past fires at once.
     """
 
-    def start(self) -> bool:
+    def start(self, first_tick_ns: int | None = None) -> bool:
         if self.started:
             return False
 
         self.started = True
         self.stopped = False
-        now: int = time.monotonic_ns()
-        scheduled_time: int = now + self.timeout_ns
+        self.generation += 1
+        if self.event_loop is None:
+            self.event_loop = asyncio.get_running_loop()
+        now: int = self.clock.monotonic_ns()
+        scheduled_time: int = (
+            now + self.timeout_ns + self.jitter_offset_ns
+            if first_tick_ns is None
+            else first_tick_ns
+        )
+
+        if self.wheel is not None or self.tick_mode == TickMode.CALL_AT:
+            self.schedule_tick(scheduled_time)
+            return True
 
         self.background_sleep_task = asyncio.create_task(
-            asyncio.sleep(ns_to_seconds(scheduled_time - now))
+            self.sleep_until_tick(scheduled_time, now)
         )
 
         self.background_sleep_task.add_done_callback(
-            lambda coro_object, st=scheduled_time: asyncio.create_task(self.loop(st))
-            # This may happen if the stop method is called before background_sleep_task completes
-            if not coro_object.cancelled()
-            else None
+            lambda coro_object, st=scheduled_time: (
+                asyncio.create_task(self.loop(st))
+                # This may happen if the stop method is called before background_sleep_task completes
+                if not coro_object.cancelled()
+                else None
+            )
         )
         return True
 
@@ -95,19 +240,51 @@ class Timer:
         if self.stopped:
             return
 
+        started: int = self.on_tick_started(scheduled_time)
         try:
-            result: None | Awaitable[None] = self.callback()
+            result: None | Awaitable[None] = self.invoke_callback()
 
             # Supports both async and sync callbacks
             if asyncio.iscoroutine(result):
                 await result
         except Exception as e:
+            if self.metrics is not None:
+                self.metrics.errors += 1
             if self.err_callback is not None:
                 self.err_callback(e)
             else:
                 raise e
 
-        now: int = time.monotonic_ns()
+        now: int = self.clock.monotonic_ns()
+        if self.metrics is not None:
+            self.metrics.callback_duration.record(now - started)
+        next_scheduled_time: int = self.next_scheduled_time(scheduled_time, now)
+
+        self.background_sleep_task = asyncio.create_task(
+            self.sleep_until_tick(next_scheduled_time, now)
+        )
+
+        self.background_sleep_task.add_done_callback(
+            lambda coro_object, st=next_scheduled_time: (
+                asyncio.create_task(self.loop(st))
+                if not coro_object.cancelled()
+                else None
+            )
+        )
+
+    # Calls the callback, or returns a coroutine running it in the executor
+    def invoke_callback(self) -> None | Awaitable[None]:
+        if self.executor is None:
+            return self.callback()
+        return run_in_executor(self.executor, self.callback)
+
+    """
+      Computes the next tick time according to the schedule policy.
+      param scheduled_time: the time the tick that just completed was scheduled for.
+      param now: the time the tick completed.
+    """
+
+    def next_scheduled_time(self, scheduled_time: int, now: int) -> int:
         next_scheduled_time: int = (
             scheduled_time + self.timeout_ns
             if self.schedule_policy == SchedulePolicy.FIXED_SCHEDULE
@@ -115,21 +292,143 @@ class Timer:
         )
 
         # If the task overruns, schedule next execution based on current time
-        while next_scheduled_time <= now:
-            next_scheduled_time += self.timeout_ns
+        if next_scheduled_time <= now:
+            skipped: int = (now - next_scheduled_time) // self.timeout_ns + 1
+            next_scheduled_time += skipped * self.timeout_ns
+            if self.metrics is not None:
+                self.metrics.skipped_ticks += skipped
+        return next_scheduled_time
+
+    # Records the tick and its lateness, returns the time the callback started,
+    # or 0 when metrics are disabled
+    def on_tick_started(self, scheduled_time: int) -> int:
+        if self.metrics is None:
+            return 0
+        started: int = self.clock.monotonic_ns()
+        self.metrics.ticks += 1
+        self.metrics.tick_lateness.record(started - scheduled_time)
+        wakeup_key: object = (
+            (self.wheel, self.wheel.wakeups)
+            if self.wheel is not None
+            else self.wakeup_key
+        )
+        if wakeup_key is not None:
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            if LAST_WAKEUP.get(loop) == wakeup_key:
+                self.metrics.coalesced_ticks += 1
+            else:
+                LAST_WAKEUP[loop] = wakeup_key
+        return started
 
-        self.background_sleep_task = asyncio.create_task(
-            asyncio.sleep(ns_to_seconds(next_scheduled_time - now))
+    """
+      Loop time at which to wake up for a tick, rounded up to the slack grid.
+      The grid is computed on the loop's time, so every timer sharing a slot gets
+      the very same time and the loop runs them from one wakeup.
+      param scheduled_time: the time the tick is scheduled for.
+    """
+
+    def wakeup_time(self, scheduled_time: int) -> float:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        when: float = loop.time() + ns_to_seconds(
+            scheduled_time - self.clock.monotonic_ns()
         )
+        if self.slack_ns > 0:
+            slack: float = ns_to_seconds(self.slack_ns)
+            when = math.ceil(when / slack) * slack
+        return when
+
+    # Sleep of the TASK tick mode, on the slack grid when slack_ns is set
+    def sleep_until_tick(self, scheduled_time: int, now: int) -> Awaitable[None]:
+        self.next_tick_time = scheduled_time
+        if self.slack_ns == 0:
+            self.wakeup_key = None
+            return asyncio.sleep(ns_to_seconds(scheduled_time - now))
+        when: float = self.wakeup_time(scheduled_time)
+        self.wakeup_key = when
+        return sleep_until(when)
 
-        self.background_sleep_task.add_done_callback(
-            lambda coro_object, st=next_scheduled_time: asyncio.create_task(
-                self.loop(st)
-            )
-            if not coro_object.cancelled()
-            else None
+    """
+      Arms the wheel entry or the loop timer handle for the next tick.
+      param scheduled_time: the time the next tick is scheduled for.
+    """
+
+    def schedule_tick(self, scheduled_time: int) -> None:
+        self.next_tick_time = scheduled_time
+        if self.wheel is not None:
+            deadline: int = scheduled_time
+            if self.slack_ns > 0:
+                deadline = -(-deadline // self.slack_ns) * self.slack_ns
+            if self.wheel_entry is None:
+                self.wheel_entry = self.wheel.schedule(deadline, self.on_wheel_tick)
+            else:
+                self.wheel.reschedule(self.wheel_entry, deadline)
+            return
+
+        when: float = self.wakeup_time(scheduled_time)
+        self.wakeup_key = when
+        self.timer_handle = asyncio.get_running_loop().call_at(
+            when, self.on_tick, scheduled_time
         )
 
+    def on_wheel_tick(self, deadline: int) -> None:
+        self.on_tick(self.next_tick_time)
+
+    """
+      Invoked by the wheel or the timer handle when a tick is due, sync callbacks
+      run inline and async callbacks are awaited in a task before the next tick
+      is scheduled.
+      param scheduled_time: the time the tick was scheduled for.
+    """
+
+    def on_tick(self, scheduled_time: int) -> None:
+        self.timer_handle = None
+
+        if self.stopped:
+            return
+
+        started: int = self.on_tick_started(scheduled_time)
+        try:
+            result: None | Awaitable[None] = self.invoke_callback()
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.errors += 1
+            if self.err_callback is None:
+                raise e
+            self.err_callback(e)
+            result = None
+
+        if asyncio.iscoroutine(result):
+            self.callback_task = asyncio.create_task(
+                self.await_tick(result, scheduled_time, started)
+            )
+            return
+
+        now: int = self.clock.monotonic_ns()
+        if self.metrics is not None:
+            self.metrics.callback_duration.record(now - started)
+        self.schedule_tick(self.next_scheduled_time(scheduled_time, now))
+
+    async def await_tick(
+        self, result: Awaitable[None], scheduled_time: int, started: int
+    ) -> None:
+        generation: int = self.generation
+        try:
+            await result
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.errors += 1
+            if self.err_callback is None:
+                raise e
+            self.err_callback(e)
+        finally:
+            self.callback_task = None
+
+        now: int = self.clock.monotonic_ns()
+        if self.metrics is not None:
+            self.metrics.callback_duration.record(now - started)
+        if not self.stopped and generation == self.generation:
+            self.schedule_tick(self.next_scheduled_time(scheduled_time, now))
+
     """
       Stops the timer if it is running.
     """
@@ -144,4 +443,41 @@ class Timer:
         if self.background_sleep_task is not None:
             self.background_sleep_task.cancel()
 
+        if self.wheel_entry is not None:
+            self.wheel.cancel(self.wheel_entry)
+
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+
         return True
+
+    """
+      Thread-safe variants of start and stop, can be called from any thread.
+      Return a concurrent.futures.Future resolving to the result of start / stop
+      once it has run on the timer's loop.
+    """
+
+    def start_threadsafe(self) -> concurrent.futures.Future:
+        return self.call_threadsafe(self.start)
+
+    def stop_threadsafe(self) -> concurrent.futures.Future:
+        return self.call_threadsafe(self.stop)
+
+    def call_threadsafe(self, method: Callable[[], bool]) -> concurrent.futures.Future:
+        if self.event_loop is None:
+            raise RuntimeError(
+                "Timer is not bound to a loop, pass loop= when constructing it"
+            )
+        future: concurrent.futures.Future = concurrent.futures.Future()
+
+        def run_and_resolve() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(method())
+            except BaseException as e:
+                future.set_exception(e)
+
+        call_soon_batched(self.event_loop, run_and_resolve)
+        return future
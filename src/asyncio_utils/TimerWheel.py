@@ -0,0 +1,240 @@
+import asyncio
+from collections.abc import Callable
+
+try:
+    from .Clock import Clock, loop_clock
+except ImportError:
+    from Clock import Clock, loop_clock
+
+# Invoked with the deadline (in nanoseconds) the entry was scheduled for
+WheelCallback = Callable[[int], None]
+
+
+def ns_to_seconds(ns: int) -> float:
+    return ns / 1_000_000_000
+
+
+class WheelEntry:
+    __slots__ = ("deadline_ns", "expiry_tick", "callback", "level", "slot")
+
+    def __init__(self, deadline_ns: int, expiry_tick: int, callback: WheelCallback):
+        self.deadline_ns: int = deadline_ns
+        self.expiry_tick: int = expiry_tick
+        self.callback: WheelCallback = callback
+        # Position of the entry inside the wheel, None when not scheduled
+        self.level: int | None = None
+        self.slot: int | None = None
+
+
+"""
+  Implements a hierarchical timing wheel shared by many timers.
+  Entries are bucketed by expiry tick, so scheduling and cancelling are O(1),
+  and the wheel keeps a single loop wakeup armed for the next non-empty tick
+  regardless of how many entries it holds.
+"""
+
+
+class TimerWheel:
+    """
+    Initializes an empty wheel.
+    param tick_ns: resolution of the wheel in nanoseconds, entries never fire
+                   before their deadline and at most one tick after it.
+    param wheel_size: number of slots per level, must be a power of two.
+    param levels: number of levels, the wheel covers tick_ns * wheel_size ** levels
+                  nanoseconds before falling back to an overflow bucket.
+    param clock: source of deadlines, defaults to the clock of the running loop.
+    """
+
+    def __init__(
+        self,
+        tick_ns: int = 1_000_000,
+        wheel_size: int = 256,
+        levels: int = 4,
+        clock: Clock | None = None,
+    ) -> None:
+        if tick_ns <= 0:
+            raise ValueError("tick_ns must be a positive integer")
+        if wheel_size < 2 or wheel_size & (wheel_size - 1) != 0:
+            raise ValueError("wheel_size must be a power of two")
+        if levels <= 0:
+            raise ValueError("levels must be a positive integer")
+
+        self.tick_ns: int = tick_ns
+        self.clock: Clock = clock if clock is not None else loop_clock()
+        self.wheel_size: int = wheel_size
+        self.levels: int = levels
+        self.bits: int = wheel_size.bit_length() - 1
+        self.mask: int = wheel_size - 1
+        self.wheels: list[list[dict[WheelEntry, None]]] = [
+            [{} for _ in range(wheel_size)] for _ in range(levels)
+        ]
+        # Entries too far in the future for the top level
+        self.overflow: dict[WheelEntry, None] = {}
+        # All ticks before current_tick have been processed
+        self.current_tick: int = self.clock.monotonic_ns() // tick_ns
+        self.count: int = 0
+        self.wakeup_handle: asyncio.TimerHandle | None = None
+        self.wakeup_tick: int | None = None
+        # Set while expired entries are dispatched, re-arming is deferred until the end
+        self.dispatching: bool = False
+        # Number of loop wakeups so far, entries fired by the same wakeup share it
+        self.wakeups: int = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    """
+      Schedules callback(deadline_ns) to run once the deadline has passed.
+      Returns the entry, which can be passed to cancel or reschedule.
+    """
+
+    def schedule(self, deadline_ns: int, callback: WheelCallback) -> WheelEntry:
+        entry: WheelEntry = WheelEntry(deadline_ns, 0, callback)
+        self.reschedule(entry, deadline_ns)
+        return entry
+
+    """
+      Moves an entry to a new deadline, scheduling it if it is not scheduled.
+    """
+
+    def reschedule(self, entry: WheelEntry, deadline_ns: int) -> None:
+        self._remove(entry)
+        if self.count == 0:
+            # Nothing is stored, so the wheel can jump straight to the present
+            self.current_tick = max(
+                self.current_tick, self.clock.monotonic_ns() // self.tick_ns
+            )
+        entry.deadline_ns = deadline_ns
+        # Round up so that an entry never fires before its deadline
+        entry.expiry_tick = -(-deadline_ns // self.tick_ns)
+        self._place(entry)
+        self.count += 1
+        self._arm()
+
+    """
+      Removes an entry from the wheel.
+      Returns True if the entry was scheduled, False otherwise.
+    """
+
+    def cancel(self, entry: WheelEntry) -> bool:
+        if not self._remove(entry):
+            return False
+        if self.count == 0 and self.wakeup_handle is not None:
+            self.wakeup_handle.cancel()
+            self.wakeup_handle = None
+            self.wakeup_tick = None
+        return True
+
+    def _remove(self, entry: WheelEntry) -> bool:
+        if entry.level is None:
+            return False
+        if entry.level < 0:
+            del self.overflow[entry]
+        else:
+            del self.wheels[entry.level][entry.slot][entry]
+        entry.level = None
+        entry.slot = None
+        self.count -= 1
+        return True
+
+    def _place(self, entry: WheelEntry) -> None:
+        tick: int = self.current_tick
+        expiry: int = max(entry.expiry_tick, tick)
+        for level in range(self.levels):
+            # The entry belongs to the lowest level whose parent epoch it shares
+            # with the current tick
+            shift: int = self.bits * (level + 1)
+            if (expiry >> shift) == (tick >> shift):
+                slot: int = (expiry >> (self.bits * level)) & self.mask
+                self.wheels[level][slot][entry] = None
+                entry.level = level
+                entry.slot = slot
+                return
+        self.overflow[entry] = None
+        entry.level = -1
+        entry.slot = None
+
+    # Returns the next tick that either holds level 0 entries or requires
+    # cascading entries down from the upper levels
+    def _next_event_tick(self) -> int:
+        tick: int = self.current_tick
+        index: int = tick & self.mask
+        if index == 0:
+            return tick
+        base: int = tick - index
+        slots: list[dict[WheelEntry, None]] = self.wheels[0]
+        for i in range(index, self.wheel_size):
+            if slots[i]:
+                return base + i
+        return base + self.wheel_size
+
+    def _arm(self) -> None:
+        if self.count == 0 or self.dispatching:
+            return
+        next_tick: int = self._next_event_tick()
+        if self.wakeup_handle is not None:
+            if self.wakeup_tick <= next_tick:
+                return
+            self.wakeup_handle.cancel()
+        self.wakeup_tick = next_tick
+        now: int = self.clock.monotonic_ns()
+        self.wakeup_handle = asyncio.get_running_loop().call_later(
+            max(0.0, ns_to_seconds(next_tick * self.tick_ns - now)),
+            self._on_wakeup,
+        )
+
+    def _cascade(self) -> None:
+        tick: int = self.current_tick
+        level: int = 1
+        while level < self.levels and tick & ((1 << (self.bits * level)) - 1) == 0:
+            level += 1
+        if level == self.levels and tick & ((1 << (self.bits * level)) - 1) == 0:
+            entries: list[WheelEntry] = list(self.overflow)
+            self.overflow = {}
+            for entry in entries:
+                self._place(entry)
+        # Cascade the highest levels first so their entries can keep falling
+        for cascade_level in range(level - 1, 0, -1):
+            slot: int = (tick >> (self.bits * cascade_level)) & self.mask
+            entries = list(self.wheels[cascade_level][slot])
+            self.wheels[cascade_level][slot] = {}
+            for entry in entries:
+                self._place(entry)
+
+    def _on_wakeup(self) -> None:
+        self.wakeups += 1
+        self.wakeup_handle = None
+        self.wakeup_tick = None
+        now_tick: int = self.clock.monotonic_ns() // self.tick_ns
+        self.dispatching = True
+
+        while self.count > 0:
+            tick: int = self._next_event_tick()
+            if tick > now_tick:
+                break
+            self.current_tick = tick
+            if tick & self.mask == 0:
+                self._cascade()
+            slot: int = tick & self.mask
+            expired: dict[WheelEntry, None] = self.wheels[0][slot]
+            self.wheels[0][slot] = {}
+            self.current_tick = tick + 1
+            for entry in expired:
+                entry.level = None
+                entry.slot = None
+            self.count -= len(expired)
+            for entry in expired:
+                try:
+                    entry.callback(entry.deadline_ns)
+                except Exception as e:
+                    asyncio.get_running_loop().call_exception_handler(
+                        {
+                            "message": "Unhandled exception in TimerWheel callback",
+                            "exception": e,
+                        }
+                    )
+
+        self.dispatching = False
+        if self.count == 0:
+            self.current_tick = max(self.current_tick, now_tick)
+        self._arm()
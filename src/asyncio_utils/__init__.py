@@ -1,5 +1,52 @@
 # src/your_package/__init__.py
-from .RateLimiter import RateLimiter
+from .AdaptiveRateLimiter import AdaptiveRateLimiter
+from .Clock import Clock, SimulatedClock, SimulatedEventLoop, SystemClock
+from .DistributedRateLimiter import (
+    AdmissionStore,
+    DistributedRateLimiter,
+    RedisAdmissionStore,
+)
+from .KeyedRateLimiter import KeyedRateLimiter
+from .Metrics import Histogram, RateLimiterMetrics, TimerMetrics
+from .RateLimiter import (
+    BatchRateLimiter,
+    QueueFullError,
+    QueueTimeoutError,
+    RateLimiter,
+    TaskHandle,
+)
+from .Retry import RetryPolicy
+from .Scheduler import CronSchedule, IntervalSchedule, ScheduledJob, Scheduler
+from .SharedRateLimiter import SharedRateLimiter
+from .StateStore import StateStore
 from .Timer import Timer
+from .TimerWheel import TimerWheel
 
-__all__ = ["RateLimiter", "Timer"]
+__all__ = [
+    "AdaptiveRateLimiter",
+    "AdmissionStore",
+    "BatchRateLimiter",
+    "Clock",
+    "CronSchedule",
+    "DistributedRateLimiter",
+    "Histogram",
+    "IntervalSchedule",
+    "KeyedRateLimiter",
+    "QueueFullError",
+    "QueueTimeoutError",
+    "RateLimiter",
+    "RateLimiterMetrics",
+    "RedisAdmissionStore",
+    "RetryPolicy",
+    "ScheduledJob",
+    "Scheduler",
+    "SharedRateLimiter",
+    "SimulatedClock",
+    "SimulatedEventLoop",
+    "StateStore",
+    "SystemClock",
+    "TaskHandle",
+    "Timer",
+    "TimerMetrics",
+    "TimerWheel",
+]
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+import unittest
+from collections import deque
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from AdaptiveRateLimiter import AdaptiveRateLimiter
+from Clock import SimulatedEventLoop, loop_clock
+from RateLimiter import TaskHandle
+
+
+class Throttled(Exception):
+    pass
+
+
+def run_simulated(main) -> None:
+    with asyncio.Runner(loop_factory=SimulatedEventLoop) as runner:
+        runner.run(main())
+
+
+class AdaptiveRateLimiterTests(unittest.TestCase):
+    def test_rate_converges_on_downstream_capacity(self):
+        async def main():
+            clock = loop_clock()
+            per: int = 1_000_000_000
+            capacity: int = 20
+            calls: deque[int] = deque()
+            throttled: list[int] = []
+
+            # Accepts `capacity` calls in any second, like an API answering 429s
+            def call() -> None:
+                now: int = clock.monotonic_ns()
+                while calls and calls[0] <= now - per:
+                    calls.popleft()
+                if len(calls) >= capacity:
+                    throttled.append(now)
+                    raise Throttled()
+                calls.append(now)
+
+            for max_concurrency in (1, 4):
+                calls.clear()
+                throttled.clear()
+                rateLimiter: AdaptiveRateLimiter = AdaptiveRateLimiter(
+                    5,
+                    per,
+                    max_rate=100,
+                    is_congestion=lambda e: isinstance(e, Throttled),
+                    max_concurrency=max_concurrency,
+                )
+                rates: list[int] = []
+                handles: list[TaskHandle] = [
+                    await rateLimiter.submit(call) for _ in range(1_500)
+                ]
+                for _ in range(120):
+                    await asyncio.sleep(1)
+                    rates.append(rateLimiter.rate)
+
+                # Additive increase up to the capacity, then a saw tooth below it
+                self.assertEqual(rates[:5], [5, 6, 7, 8, 9])
+                self.assertLessEqual(max(rates), capacity + 2)
+                self.assertGreaterEqual(min(rates[30:]), capacity // 2 - 1)
+                self.assertLess(len(throttled), 10)
+                # Once the backlog is gone the limiter is no longer saturated
+                self.assertEqual(len(set(rates[-10:])), 1)
+                self.assertTrue(all(handle.done() for handle in handles))
+                failed: int = sum(1 for handle in handles if handle.exception())
+                self.assertEqual(failed, len(throttled))
+
+        run_simulated(main)
+
+    def test_feedback_and_latency_target(self):
+        async def main():
+            per: int = 1_000_000_000
+            rateLimiter: AdaptiveRateLimiter = AdaptiveRateLimiter(
+                16, per, min_rate=3, latency_target_ns=50_000_000
+            )
+
+            # Explicit congestion decreases at most once per interval
+            rateLimiter.feedback(congested=True)
+            rateLimiter.feedback(congested=True)
+            self.assertEqual(rateLimiter.rate, 8)
+
+            # An idle limiter is not increased
+            await asyncio.sleep(1.5)
+            rateLimiter.feedback(latency_ns=10_000_000)
+            self.assertEqual(rateLimiter.rate, 8)
+
+            # Slow work decreases the rate at the end of the interval
+            await asyncio.sleep(0.5)
+            rateLimiter.feedback(latency_ns=80_000_000)
+            self.assertEqual(rateLimiter.rate, 8)
+            await asyncio.sleep(0.6)
+            rateLimiter.feedback(latency_ns=80_000_000)
+            self.assertEqual(rateLimiter.rate, 4)
+            await asyncio.sleep(1.1)
+            rateLimiter.feedback(congested=True)
+            self.assertEqual(rateLimiter.rate, 3)
+
+            # Exceptions not accepted by is_congestion are plain outcomes
+            calm: AdaptiveRateLimiter = AdaptiveRateLimiter(
+                4, per, is_congestion=lambda e: isinstance(e, Throttled)
+            )
+
+            async def fail() -> None:
+                raise KeyError("not a throttle")
+
+            with self.assertRaises(KeyError):
+                await (await calm.submit(fail))
+            self.assertEqual(calm.rate, 4)
+
+            self.assertRaises(ValueError, AdaptiveRateLimiter, 2, per, min_rate=3)
+            self.assertRaises(ValueError, AdaptiveRateLimiter, 2, per, decrease=1)
+
+        run_simulated(main)
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from DistributedRateLimiter import (
+    LEASE_SCRIPT,
+    AdmissionStore,
+    DistributedRateLimiter,
+    RedisAdmissionStore,
+    encode_command,
+    read_reply,
+)
+
+
+# In-process stand-in for a Redis server, implementing the commands used by
+# RedisAdmissionStore. Replies are RESP encoded like a real server's.
+class StandInRedisServer:
+    def __init__(self):
+        self.counters: dict[str, int] = {}
+        self.commands: list[str] = []
+        self.server: asyncio.Server | None = None
+        self.port: int = 0
+        self.clients: set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    # Drops the open connections as a server going down would, wait_closed waits
+    # for every client connection since Python 3.12
+    async def stop(self) -> None:
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        await self.server.wait_closed()
+
+    async def serve(self, reader, writer) -> None:
+        self.clients.add(writer)
+        try:
+            while True:
+                command: list[bytes] = await read_reply(reader)
+                writer.write(self.execute([part.decode() for part in command]))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+        finally:
+            self.clients.discard(writer)
+
+    def execute(self, command: list[str]) -> bytes:
+        name: str = command[0].upper()
+        self.commands.append(name)
+        # Commands run one at a time, so the script is atomic as on a real server
+        if name == "EVAL" and command[1] == LEASE_SCRIPT:
+            counter: str = command[3]
+            used: int = self.counters.get(counter, 0)
+            granted: int = min(int(command[4]), max(0, int(command[5]) - used))
+            self.counters[counter] = used + granted
+            return b":%d\r\n" % granted
+        if name == "PING":
+            return b"+PONG\r\n"
+        return b"-ERR unknown command\r\n"
+
+
+class DistributedRateLimiterTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server: StandInRedisServer = StandInRedisServer()
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    def test_encode_command(self):
+        self.assertEqual(
+            encode_command("INCRBY", "rl:key", 5),
+            b"*3\r\n$6\r\nINCRBY\r\n$6\r\nrl:key\r\n$1\r\n5\r\n",
+        )
+
+    async def test_nodes_share_one_budget(self):
+        rate: int = 20
+        per: int = 500_000_000
+        leaseSize: int = 5
+        stores: list[RedisAdmissionStore] = [
+            RedisAdmissionStore(port=self.server.port) for _ in range(3)
+        ]
+        nodes: list[DistributedRateLimiter] = [
+            DistributedRateLimiter(store, "api", rate, per, lease_size=leaseSize)
+            for store in stores
+        ]
+        executionLog: list[int] = []
+
+        for _ in range(40):
+            for node in nodes:
+                await node.push(lambda: executionLog.append(time.time_ns()))
+        await asyncio.sleep(1.6)
+
+        admittedPerWindow: dict[int, int] = {}
+        for executedAt in executionLog:
+            admittedPerWindow[executedAt // per] = (
+                admittedPerWindow.get(executedAt // per, 0) + 1
+            )
+        # Every window is charged up to its budget and never beyond it
+        self.assertGreaterEqual(len(admittedPerWindow), 3)
+        self.assertLessEqual(max(admittedPerWindow.values()), rate)
+        self.assertIn(rate, admittedPerWindow.values())
+        # Permits are leased in blocks, not one round trip per task
+        self.assertLessEqual(
+            self.server.commands.count("EVAL"),
+            len(executionLog) // leaseSize + len(nodes) * (len(admittedPerWindow) + 1),
+        )
+        # Each lease is a single atomic command
+        self.assertEqual(set(self.server.commands), {"EVAL"})
+        for store in stores:
+            await store.close()
+
+    async def test_lease_grants_what_is_left(self):
+        store: RedisAdmissionStore = RedisAdmissionStore(port=self.server.port)
+        self.assertEqual(
+            [await store.lease("api", 7, 5, 12, 1_000) for _ in range(4)], [5, 5, 2, 0]
+        )
+        self.assertEqual(self.server.counters, {"rl:api:7": 12})
+        await store.close()
+
+        self.assertRaises(TypeError, AdmissionStore)
+        node: DistributedRateLimiter = DistributedRateLimiter(store, "api", 10, 1_000)
+        self.assertRaises(TypeError, node.set_rate, 20)
+
+    async def test_store_failure_stops_admission(self):
+        errors: list[dict] = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        store: RedisAdmissionStore = RedisAdmissionStore(port=self.server.port)
+        node: DistributedRateLimiter = DistributedRateLimiter(
+            store, "api", 1_000, 60_000_000_000, lease_size=4, retry_ns=50_000_000
+        )
+        executed: list[int] = []
+
+        await node.push(lambda: executed.append(1))
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(executed), 1)
+        self.assertEqual(node.window.permits, 3)
+
+        await self.server.stop()
+        await store.close()
+        for _ in range(10):
+            await node.push(lambda: executed.append(1))
+        await asyncio.sleep(0.3)
+
+        # Only the permits already leased are spent
+        self.assertEqual(len(executed), 4)
+        self.assertGreater(len(errors), 1)
+        await store.close()
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from KeyedRateLimiter import KeyedRateLimiter
+
+
+class KeyedRateLimiterTests(unittest.IsolatedAsyncioTestCase):
+    async def test_each_key_is_limited_independently(self):
+        rate: int = 5
+        per: int = 200_000_000
+        tasksPerKey: int = 20
+        keys: list[str] = ["tenant-a", "tenant-b", "tenant-c"]
+        rateLimiter: KeyedRateLimiter = KeyedRateLimiter(rate, per)
+        executionLog: dict[str, list[int]] = {key: [] for key in keys}
+
+        for _ in range(tasksPerKey):
+            for key in keys:
+                await rateLimiter.push(
+                    key, lambda key=key: executionLog[key].append(time.monotonic_ns())
+                )
+
+        # All queued keys share one wakeup
+        self.assertEqual(len(rateLimiter.ready_heap), len(keys))
+        await asyncio.sleep((tasksPerKey // rate) * per / 1_000_000_000 + 0.2)
+
+        for key in keys:
+            log: list[int] = executionLog[key]
+            self.assertEqual(len(log), tasksPerKey)
+            for i in range(len(log) - rate):
+                self.assertGreater(log[i + rate] - log[i], per)
+
+    async def test_keys_are_capped_and_evicted(self):
+        rateLimiter: KeyedRateLimiter = KeyedRateLimiter(
+            2, 50_000_000, max_keys=100, idle_ttl_ns=10_000_000_000
+        )
+        for i in range(1_000):
+            await rateLimiter.push(i, lambda: None)
+
+        self.assertEqual(len(rateLimiter), 100)
+        # Only the most recently used keys are kept
+        self.assertEqual(list(rateLimiter.keys), list(range(900, 1_000)))
+
+    async def test_idle_keys_are_evicted_after_ttl(self):
+        rateLimiter: KeyedRateLimiter = KeyedRateLimiter(1, 50_000_000)
+        executed: list[int] = []
+        for i in range(10):
+            await rateLimiter.push(i, lambda i=i: executed.append(i))
+        # A second task on key 0 has to wait for the window
+        await rateLimiter.push(0, lambda: executed.append(0))
+        self.assertEqual(len(rateLimiter), 10)
+
+        await asyncio.sleep(0.2)
+        await rateLimiter.push("fresh", lambda: executed.append(-1))
+
+        self.assertEqual(executed, list(range(10)) + [0, -1])
+        self.assertEqual(list(rateLimiter.keys), ["fresh"])
+
+    async def test_busy_keys_are_never_evicted(self):
+        rateLimiter: KeyedRateLimiter = KeyedRateLimiter(1, 1_000_000_000, max_keys=2)
+        for key in ("a", "b"):
+            await rateLimiter.push(key, lambda: None)
+            await rateLimiter.push(key, lambda: None)
+
+        with self.assertRaises(RuntimeError):
+            await rateLimiter.push("c", lambda: None)
+        rateLimiter.wakeup_handle.cancel()
+
+    async def test_busy_keys_do_not_hold_back_eviction(self):
+        rateLimiter: KeyedRateLimiter = KeyedRateLimiter(
+            1, 1_000_000_000, idle_ttl_ns=50_000_000
+        )
+        # The least recently used key waits for its window
+        await rateLimiter.push("busy", lambda: None)
+        await rateLimiter.push("busy", lambda: None)
+        for key in ("a", "b"):
+            await rateLimiter.push(key, lambda: None)
+
+        await asyncio.sleep(0.1)
+        await rateLimiter.push("fresh", lambda: None)
+
+        self.assertEqual(sorted(rateLimiter.keys), ["busy", "fresh"])
+        rateLimiter.wakeup_handle.cancel()
+
+    async def test_evicted_keys_keep_their_window(self):
+        rateLimiter: KeyedRateLimiter = KeyedRateLimiter(1, 1_000_000_000, max_keys=1)
+        executed: list[str] = []
+        for key in ("a", "b", "a"):
+            await rateLimiter.push(key, lambda key=key: executed.append(key))
+
+        # "a" was evicted by "b" within its window, its second task has to wait
+        self.assertEqual(executed, ["a", "b"])
+        self.assertEqual(list(rateLimiter.evicted), ["b"])
+        rateLimiter.wakeup_handle.cancel()
+
+    async def test_failing_task_does_not_stop_the_drain(self):
+        errors: list[dict] = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        rateLimiter: KeyedRateLimiter = KeyedRateLimiter(1, 50_000_000, max_keys=1)
+        executed: list[int] = []
+
+        def failing() -> None:
+            raise KeyError()
+
+        await rateLimiter.push("a", lambda: executed.append(1))
+        await rateLimiter.push("a", failing)
+        await rateLimiter.push("a", lambda: executed.append(3))
+        await asyncio.sleep(0.3)
+
+        self.assertEqual(executed, [1, 3])
+        self.assertIsInstance(errors[0]["exception"], KeyError)
+        # The drained key can be evicted again
+        self.assertEqual(list(rateLimiter.idle), ["a"])
+        await rateLimiter.push("b", lambda: executed.append(4))
+        self.assertEqual(executed, [1, 3, 4])
+
+    async def test_tombstones_are_capped(self):
+        rateLimiter: KeyedRateLimiter = KeyedRateLimiter(1, 60_000_000_000, max_keys=10)
+        for key in range(1_000):
+            await rateLimiter.push(key, lambda: None)
+        tracemalloc.start()
+        before: int = tracemalloc.get_traced_memory()[0]
+        for key in range(1_000, 100_000):
+            await rateLimiter.push(key, lambda: None)
+        after: int = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        self.assertEqual(len(rateLimiter), 10)
+        self.assertEqual(list(rateLimiter.evicted), list(range(99_980, 99_990)))
+        # Every key pushed within the window leaves nothing behind past the cap
+        self.assertLess(after - before, 10_000)
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from Clock import SimulatedEventLoop, loop_clock
+from Metrics import Histogram, RateLimiterMetrics, bucket_index, bucket_upper_bound
+from RateLimiter import RateLimiter
+from Timer import Timer
+
+
+def run_simulated(main) -> None:
+    with asyncio.Runner(loop_factory=SimulatedEventLoop) as runner:
+        runner.run(main())
+
+
+class MetricsTests(unittest.TestCase):
+    def test_histogram_buckets(self):
+        previous: int = -1
+        for value in list(range(0, 5_000)) + [10**6, 10**9 + 7, 3 * 10**12]:
+            index: int = bucket_index(value)
+            upper: int = bucket_upper_bound(index)
+            self.assertLessEqual(value, upper)
+            self.assertGreaterEqual(index, previous)
+            # A bucket is at most 1/16th of its lower bound wide
+            self.assertLessEqual(upper - value, max(1, value // 16))
+            previous = index
+
+        histogram: Histogram = Histogram()
+        for value in range(1, 10_001):
+            histogram.record(value * 1_000)
+        self.assertEqual(histogram.count, 10_000)
+        self.assertEqual(histogram.max, 10_000_000)
+        for q in (0.5, 0.9, 0.99):
+            expected: int = int(q * 10_000_000)
+            self.assertLessEqual(abs(histogram.quantile(q) - expected), expected // 16)
+        merged: Histogram = Histogram()
+        merged.merge(histogram)
+        merged.merge(histogram)
+        self.assertEqual(merged.count, 20_000)
+        self.assertEqual(merged.quantile(0.5), histogram.quantile(0.5))
+        histogram.reset()
+        self.assertEqual(histogram.quantile(0.5), 0)
+
+    def test_timer_overrun_and_lateness(self):
+        async def main():
+            clock = loop_clock()
+
+            def overrun():
+                # Every third tick blocks for 2.5 intervals of virtual time
+                if timer.metrics.ticks % 3 == 0:
+                    clock.advance(250_000_000)
+
+            for tick_mode in ("TASK", "CALL_AT"):
+                timer: Timer = Timer(
+                    100_000_000, overrun, tick_mode=tick_mode, metrics=True
+                )
+                timer.start()
+                await asyncio.sleep(2.95)
+                timer.stop()
+
+                snapshot: dict[str, float] = timer.metrics.snapshot()
+                self.assertEqual(snapshot["ticks"], 18)
+                self.assertEqual(snapshot["skipped_ticks"], 12)
+                self.assertEqual(snapshot["errors"], 0)
+                self.assertEqual(snapshot["callback_duration_max_ns"], 250_000_000)
+                self.assertEqual(snapshot["tick_lateness_count"], 18)
+                self.assertLess(snapshot["tick_lateness_max_ns"], 1_000_000)
+
+            self.assertIsNone(Timer(100_000_000, overrun).metrics)
+
+        run_simulated(main)
+
+    def test_rate_limiter_queue_wait(self):
+        async def main():
+            totalTasks: int = 50
+            rate: int = 10
+            per: int = 1_000_000_000
+            for max_concurrency in (1, 4):
+                rateLimiter: RateLimiter = RateLimiter(
+                    rate, per, max_concurrency=max_concurrency, metrics=True
+                )
+                executed: list[int] = []
+                await rateLimiter.push_many(
+                    lambda: executed.append(1) for _ in range(totalTasks)
+                )
+                metrics: RateLimiterMetrics = rateLimiter.metrics
+                # The concurrent mode queues every task before dispatching them
+                queued: int = totalTasks - rate if max_concurrency == 1 else totalTasks
+                self.assertEqual(metrics.max_queue_depth, queued)
+                while len(executed) < totalTasks:
+                    await asyncio.sleep(0.1)
+
+                self.assertEqual(metrics.admitted, totalTasks)
+                self.assertEqual(metrics.queued, queued)
+                self.assertEqual(metrics.queue_depth, 0)
+                self.assertEqual(metrics.queue_wait.count, queued)
+                # The last batch waited four windows
+                self.assertGreater(metrics.queue_wait.max, 4 * per)
+                self.assertLess(metrics.queue_wait.max, 5 * per)
+
+        run_simulated(main)
+
+    def test_prometheus_and_otel_export(self):
+        metrics: RateLimiterMetrics = RateLimiterMetrics()
+        metrics.admitted = 3
+        metrics.queue_wait.record(1_500)
+        text: str = metrics.to_prometheus("rl", {"name": 'api"1'})
+        self.assertIn("# TYPE rl_admitted counter\n", text)
+        self.assertIn('rl_admitted{name="api\\"1"} 3\n', text)
+        self.assertIn("# TYPE rl_queue_depth gauge\n", text)
+        self.assertIn('rl_queue_wait_ns{name="api\\"1",quantile="0.99"} 1500\n', text)
+        self.assertIn('rl_queue_wait_ns_count{name="api\\"1"} 1\n', text)
+        self.assertIn("rl_queue_wait_ns_count{} 1\n", metrics.to_prometheus("rl"))
+
+        callback = metrics.otel_callback(
+            "admitted",
+            {"name": "api"},
+            observation=lambda value, labels: (value, labels),
+        )
+        self.assertEqual(list(callback(None)), [(3, {"name": "api"})])
+        self.assertRaises(KeyError, metrics.otel_callback, "missing", None, tuple)
+
+        metrics.reset()
+        self.assertEqual(metrics.snapshot()["queue_wait_count"], 0)
+        self.assertEqual(metrics.admitted, 0)
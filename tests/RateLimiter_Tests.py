@@ -1,13 +1,28 @@
 import asyncio
+import concurrent.futures
+import functools
 import os
 import sys
+import threading
 import time
 import unittest
+from collections.abc import Callable
 
 sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
 )
-from RateLimiter import RateLimiter
+from Clock import SimulatedEventLoop, loop_clock
+from RateLimiter import (
+    BatchRateLimiter,
+    FlowQueue,
+    GcraWindow,
+    QueueFullError,
+    QueueTimeoutError,
+    RateLimiter,
+    RingBuffer,
+    TaskHandle,
+)
+from Retry import RetryPolicy
 
 
 class RateLimiterTests(unittest.IsolatedAsyncioTestCase):
@@ -46,6 +61,490 @@ class RateLimiterTests(unittest.IsolatedAsyncioTestCase):
     async def test_2(self):
         await self.do_test(10000, 1000, 1)
 
+    async def test_gcra(self):
+        totalTasks: int = 200
+        rate: int = 100
+        per: int = 1_000_000_000
+        rateLimiter: RateLimiter = RateLimiter(rate, per, engine="GCRA")
+        executionLog: list[int] = []
+
+        for _ in range(totalTasks):
+            await rateLimiter.push(lambda: executionLog.append(time.monotonic_ns()))
+        await asyncio.sleep((totalTasks // rate) * per // 1_000_000_000 + 1)
+        self.assertEqual(len(executionLog), totalTasks)
+
+        # Tasks are spaced per / rate apart instead of running in batches of 'rate'
+        for i in range(totalTasks - 1):
+            self.assertGreater(executionLog[i + 1] - executionLog[i], per // rate)
+        for i in range(totalTasks - rate):
+            self.assertGreater(executionLog[i + rate] - executionLog[i], per)
+
+    async def test_gcra_try_acquire_and_burst(self):
+        per: int = 100_000_000
+        rateLimiter: RateLimiter = RateLimiter(10, per, engine="GCRA", burst=3)
+        self.assertIsNone(rateLimiter.ringBuffer)
+
+        admitted: list[bool] = [rateLimiter.try_acquire() for _ in range(4)]
+        self.assertEqual(admitted, [True, True, True, False])
+
+        # The next permit is one emission interval (per / rate) away
+        start: int = time.monotonic_ns()
+        await rateLimiter.acquire()
+        waited: int = time.monotonic_ns() - start
+        self.assertGreater(waited, per // 10 // 2)
+        self.assertLess(waited, per // 10 * 3)
+        self.assertFalse(rateLimiter.try_acquire())
+
+        self.assertRaises(ValueError, RateLimiter, 10, per, engine="LEAKY_BUCKET")
+
+    async def test_bounded_concurrency(self):
+        for record_on in ("START", "COMPLETION"):
+            totalTasks: int = 40
+            rate: int = 10
+            per: int = 500_000_000
+            maxConcurrency: int = 5
+            rateLimiter: RateLimiter = RateLimiter(
+                rate, per, max_concurrency=maxConcurrency, record_on=record_on
+            )
+            starts: list[tuple[int, int]] = []
+            completions: list[int] = []
+            charged: list[int] = []
+            inFlight: int = 0
+            maxInFlight: int = 0
+
+            async def call_downstream():
+                nonlocal inFlight, maxInFlight
+                inFlight += 1
+                maxInFlight = max(maxInFlight, inFlight)
+                await asyncio.sleep(0.2)
+                inFlight -= 1
+                completions.append(time.monotonic_ns())
+
+            # Sync wrapper, so the start is logged as soon as the limiter starts the task
+            def start_call(idx: int):
+                starts.append((idx, time.monotonic_ns()))
+                if record_on == "START":
+                    # The limiter charged the task just before calling it
+                    charged.append(rateLimiter.ringBuffer[-1])
+                return call_downstream()
+
+            begin: int = time.monotonic_ns()
+            for i in range(totalTasks):
+                await rateLimiter.push(lambda i=i: start_call(i))
+            while len(completions) < totalTasks:
+                await asyncio.sleep(0.05)
+            elapsed: int = time.monotonic_ns() - begin
+
+            # Serialized execution would need totalTasks * 0.2s
+            self.assertLess(elapsed, totalTasks * 200_000_000 // 2)
+            self.assertLessEqual(maxInFlight, maxConcurrency)
+            self.assertEqual([idx for idx, _ in starts], list(range(totalTasks)))
+            # A task is charged when it starts or completes, the limiter records
+            # completions a little after they are logged here, never before
+            if record_on == "COMPLETION":
+                charged = completions
+            for i in range(totalTasks - rate):
+                self.assertGreater(starts[i + rate][1] - charged[i], per, record_on)
+
+    async def test_push_many(self):
+        totalTasks: int = 50
+        rate: int = 10
+        per: int = 200_000_000
+        rateLimiter: RateLimiter = RateLimiter(rate, per)
+        executionLog: list[int] = []
+
+        await rateLimiter.push_many(
+            lambda: executionLog.append(time.monotonic_ns()) for _ in range(totalTasks)
+        )
+        self.assertEqual(len(executionLog), rate)
+        self.assertEqual(len(rateLimiter.pendingTasks), totalTasks - rate)
+        await asyncio.sleep((totalTasks // rate) * per / 1_000_000_000 + 0.2)
+
+        self.assertEqual(len(executionLog), totalTasks)
+        for i in range(totalTasks - rate):
+            self.assertGreater(executionLog[i + rate] - executionLog[i], per)
+
+    async def test_batch_callback(self):
+        totalItems: int = 95
+        rate: int = 20
+        per: int = 200_000_000
+        batches: list[tuple[int, list[int]]] = []
+
+        async def bulk_insert(rows: list[int]):
+            batches.append((time.monotonic_ns(), rows))
+
+        rateLimiter: BatchRateLimiter = BatchRateLimiter(
+            rate, per, bulk_insert, max_batch=15
+        )
+        await rateLimiter.push_many(range(totalItems - 5))
+        for item in range(totalItems - 5, totalItems):
+            await rateLimiter.push(item)
+        await asyncio.sleep((totalItems // rate) * per / 1_000_000_000 + 0.2)
+
+        self.assertEqual(
+            [row for _, rows in batches for row in rows], list(range(totalItems))
+        )
+        self.assertLessEqual(max(len(rows) for _, rows in batches), 15)
+        self.assertEqual([len(rows) for _, rows in batches[:3]], [15, 5, 15])
+        # No more than 'rate' items in any 'per' interval
+        itemLog: list[int] = [at for at, rows in batches for _ in rows]
+        for i in range(totalItems - rate):
+            self.assertGreater(itemLog[i + rate] - itemLog[i], per)
+
+    async def test_batch_entry_points(self):
+        per: int = 100_000_000
+        batches: list[list[int]] = []
+        rateLimiter: BatchRateLimiter = BatchRateLimiter(
+            4, per, batches.append, metrics=True
+        )
+        # Items are not tasks, none of RateLimiter's task entry points apply
+        self.assertNotIsInstance(rateLimiter, RateLimiter)
+        for name in (
+            "acquire",
+            "try_acquire",
+            "submit",
+            "throttle",
+            "map",
+            "submit_threadsafe",
+        ):
+            self.assertFalse(hasattr(rateLimiter, name), name)
+        self.assertRaises(ValueError, BatchRateLimiter, 4, per, print, max_batch=0)
+
+        await rateLimiter.push_many(range(6))
+        self.assertEqual(batches, [[0, 1, 2, 3]])
+        # Items pushed from another thread join the queue behind the first ones
+        thread = threading.Thread(
+            target=lambda: [rateLimiter.push_threadsafe(item) for item in (6, 7)]
+        )
+        thread.start()
+        thread.join()
+        # A higher rate takes effect before the pending wakeup
+        rateLimiter.set_rate(8, 2 * per)
+        await asyncio.sleep(0.05)
+        self.assertEqual(batches, [[0, 1, 2, 3], [4, 5, 6, 7]])
+        self.assertEqual(rateLimiter.metrics.admitted, 8)
+        self.assertEqual(rateLimiter.metrics.queue_depth, 0)
+        self.assertEqual(rateLimiter.metrics.max_queue_depth, 6)
+        self.assertRaises(ValueError, rateLimiter.set_rate, 0)
+
+    async def test_weighted_flows(self):
+        rate: int = 10
+        per: int = 200_000_000
+        for max_concurrency in (1, 4):
+            rateLimiter: RateLimiter = RateLimiter(
+                rate,
+                per,
+                max_concurrency=max_concurrency,
+                flows={"interactive": 3, "bulk": 1},
+            )
+            started: list[str] = []
+
+            # A backlog of bulk work is queued before the interactive requests
+            await rateLimiter.push_many(
+                (lambda: started.append("bulk") for _ in range(60)), "bulk"
+            )
+            for _ in range(12):
+                await rateLimiter.push(lambda: started.append("interactive"))
+            self.assertRaises(ValueError, rateLimiter.checkFlow, "missing")
+            while len(started) < 72:
+                await asyncio.sleep(0.05)
+
+            # Past the first window, interactive tasks take 3 of every 4 starts
+            # instead of waiting behind the whole bulk backlog
+            self.assertEqual(
+                started[rate : rate + 16], (["bulk"] + ["interactive"] * 3) * 4
+            )
+            self.assertEqual(started[rate + 16 :], ["bulk"] * (72 - rate - 16))
+
+        with self.assertRaises(ValueError):
+            await RateLimiter(rate, per).push(lambda: None, "bulk")
+        self.assertRaises(ValueError, RateLimiter, rate, per, flows={"bulk": 0})
+
+    async def test_overflow_policies(self):
+        rate: int = 2
+        per: int = 100_000_000
+        for overflow in ("DROP_OLDEST", "DROP_NEWEST", "REJECT", "BLOCK"):
+            dropped: list[tuple[int, Exception]] = []
+            rateLimiter: RateLimiter = RateLimiter(
+                rate,
+                per,
+                max_queue=3,
+                overflow=overflow,
+                on_drop=lambda task, error: dropped.append((task.idx, error)),
+            )
+            executed: list[int] = []
+
+            class Task:
+                def __init__(self, idx: int):
+                    self.idx: int = idx
+
+                def __call__(self):
+                    executed.append(self.idx)
+
+            # Two tasks run right away, three are queued and the rest overflow
+            rejected: int = 0
+            for idx in range(2 + 3 + 2):
+                try:
+                    await rateLimiter.push(Task(idx))
+                except QueueFullError:
+                    rejected += 1
+                self.assertLessEqual(len(rateLimiter.pendingTasks), 3)
+            await asyncio.sleep(4 * per / 1_000_000_000)
+
+            if overflow == "DROP_OLDEST":
+                self.assertEqual(executed, [0, 1, 4, 5, 6])
+                self.assertEqual([idx for idx, _ in dropped], [2, 3])
+            elif overflow == "DROP_NEWEST":
+                self.assertEqual(executed, [0, 1, 2, 3, 4])
+                self.assertEqual([idx for idx, _ in dropped], [5, 6])
+            elif overflow == "REJECT":
+                self.assertEqual(executed, [0, 1, 2, 3, 4])
+                self.assertEqual((rejected, dropped), (2, []))
+            else:
+                # The producer waited for room, so every task ran
+                self.assertEqual(executed, list(range(7)))
+                self.assertEqual(dropped, [])
+            for _, error in dropped:
+                self.assertIsInstance(error, QueueFullError)
+
+        self.assertRaises(ValueError, RateLimiter, rate, per, overflow="SPILL")
+        self.assertRaises(ValueError, RateLimiter, rate, per, max_queue=0)
+
+    async def test_queued_deadlines(self):
+        per: int = 200_000_000
+        for max_concurrency in (1, 2):
+            dropped: list[Exception] = []
+            rateLimiter: RateLimiter = RateLimiter(
+                1,
+                per,
+                max_concurrency=max_concurrency,
+                max_wait_ns=per * 3 // 2,
+                on_drop=lambda task, error: dropped.append(error),
+                metrics=True,
+            )
+            executed: list[int] = []
+            for idx in range(4):
+                await rateLimiter.push(lambda idx=idx: executed.append(idx))
+            # Waits in the queue behind the others, but its own deadline is short
+            await rateLimiter.push(
+                lambda: executed.append(4),
+                deadline_ns=time.monotonic_ns() + per // 2,
+            )
+            with self.assertRaises(QueueTimeoutError):
+                await rateLimiter.acquire()
+            await asyncio.sleep(5 * per / 1_000_000_000)
+
+            # Tasks 2 and 3 waited for more than max_wait_ns
+            self.assertEqual(executed, [0, 1])
+            self.assertEqual(len(dropped), 4)
+            self.assertEqual(rateLimiter.metrics.expired, 4)
+            self.assertEqual(len(rateLimiter.pendingTasks), 0)
+
+    async def test_submit_handles(self):
+        per: int = 100_000_000
+        for max_concurrency in (1, 3):
+            rateLimiter: RateLimiter = RateLimiter(
+                1, per, max_concurrency=max_concurrency, metrics=True
+            )
+            started: list[int] = []
+
+            async def double(value: int) -> int:
+                started.append(value)
+                return value * 2
+
+            def fail():
+                raise KeyError("boom")
+
+            first: TaskHandle = await rateLimiter.submit(lambda: double(1))
+            abandoned: TaskHandle = await rateLimiter.submit(lambda: double(2))
+            failing: TaskHandle = await rateLimiter.submit(fail)
+            last: TaskHandle = await rateLimiter.submit(lambda: double(3))
+            self.assertTrue(abandoned.cancel())
+
+            # A caller that gives up cancels the handle it was awaiting
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(rateLimiter.acquire(), per / 2 / 1_000_000_000)
+
+            self.assertEqual(await first, 2)
+            with self.assertRaises(KeyError):
+                await failing
+            begin: int = time.monotonic_ns()
+            self.assertEqual(await last, 6)
+            # Skipped handles are not charged, the last task was the third admitted
+            self.assertLess(time.monotonic_ns() - begin, per * 3 // 2)
+            self.assertEqual(started, [1, 3])
+            self.assertTrue(abandoned.cancelled())
+            self.assertEqual(rateLimiter.metrics.admitted, 3)
+            self.assertEqual(rateLimiter.metrics.cancelled, 2)
+
+    async def test_set_rate(self):
+        per: int = 100_000_000
+        for engine in ("SLIDING_WINDOW", "GCRA"):
+            for max_concurrency in (1, 2):
+                rateLimiter: RateLimiter = RateLimiter(
+                    2, per, engine=engine, max_concurrency=max_concurrency
+                )
+                executionLog: list[int] = []
+                await rateLimiter.push_many(
+                    lambda: executionLog.append(time.monotonic_ns()) for _ in range(12)
+                )
+                # At 2 per window the queue would take 5 more windows
+                begin: int = time.monotonic_ns()
+                rateLimiter.set_rate(10)
+                while len(executionLog) < 12:
+                    await asyncio.sleep(0.01)
+                self.assertLess(
+                    time.monotonic_ns() - begin, 3 * per, f"{engine} {max_concurrency}"
+                )
+                for i in range(len(executionLog) - 10):
+                    self.assertGreater(executionLog[i + 10] - executionLog[i], per)
+
+                # A lower rate keeps the most recent timestamps
+                rateLimiter.set_rate(1, per * 2)
+                if engine == "SLIDING_WINDOW":
+                    self.assertEqual(len(rateLimiter.ringBuffer), 1)
+                    self.assertFalse(rateLimiter.try_acquire())
+                self.assertRaises(ValueError, rateLimiter.set_rate, 0)
+
+        window: GcraWindow = GcraWindow(4, per, 1)
+        window.record(1_000)
+        ready_at: int = window.ready_at()
+        window.resize(8, per)
+        self.assertEqual(window.ready_at(), ready_at)
+
+    async def test_executor_offload(self):
+        per: int = 1_000_000_000
+        for max_concurrency in (1, 4):
+            rateLimiter: RateLimiter = RateLimiter(
+                100, per, max_concurrency=max_concurrency, executor="THREAD"
+            )
+            finished: list[int] = []
+
+            def blocking() -> None:
+                time.sleep(0.1)
+                finished.append(time.monotonic_ns())
+
+            begin: int = time.monotonic_ns()
+            # The serialized mode awaits the first task in push, off the loop
+            submitting: asyncio.Future = asyncio.gather(
+                *(rateLimiter.submit(blocking) for _ in range(max_concurrency))
+            )
+            await asyncio.sleep(0.01)
+            self.assertEqual(finished, [])
+            await asyncio.gather(*(await submitting))
+            self.assertLess(time.monotonic_ns() - begin, 180_000_000)
+            # Offloaded tasks are charged on completion
+            for charged, done in zip(sorted(rateLimiter.ringBuffer), finished):
+                self.assertGreaterEqual(charged, done)
+            self.assertEqual(rateLimiter.inFlight, 0)
+
+        # Anything a process pool can pickle runs there
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+            rateLimiter = RateLimiter(10, per, executor=pool, max_concurrency=2)
+            handle: TaskHandle = await rateLimiter.submit(
+                functools.partial(pow, 2, 100)
+            )
+            self.assertEqual(await handle, 2**100)
+            handle = await rateLimiter.submit(functools.partial(int, "x"))
+            with self.assertRaises(ValueError):
+                await handle
+        self.assertRaises(ValueError, RateLimiter, 1, per, executor="FIBER")
+
+    def test_flow_queue_round_robin(self):
+        queue: FlowQueue = FlowQueue({"a": 2, "b": 1, "c": 1})
+        queue.extend(("a",) * 5, "a")
+        queue.extend(("b",) * 2, "b")
+        queue.append("a")
+        queue.append("c", "c")
+        self.assertEqual(len(queue), 9)
+        drained: list[str] = [queue.popleft() for _ in range(len(queue))]
+        self.assertEqual(drained, ["a", "a", "b", "c", "a", "a", "b", "a", "a"])
+        self.assertRaises(IndexError, queue.popleft)
+        self.assertRaises(ValueError, queue.append, "d", "d")
+
+    def test_gcra_available_permits(self):
+        rate: int = 7
+        per: int = 1_000
+        for burst in (1, 3, 10):
+            for tat in (0, 5_000, 12_345, 20_000):
+                for now in range(0, 25_000, 137):
+                    window: GcraWindow = GcraWindow(rate, per, burst)
+                    window.tat = tat * rate
+                    # Brute force, record one permit at a time
+                    expected: int = 0
+                    while expected < 20 and window.ready_at() <= now:
+                        window.record(now)
+                        expected += 1
+                    window.tat = tat * rate
+                    self.assertEqual(window.available_permits(now, 20), expected)
+
+    def test_ring_buffer_queries(self):
+        per: int = 100
+        for size in (1, 4, 9):
+            ring: RingBuffer = RingBuffer(size)
+            pushed: list[int] = []
+            for timestamp in range(0, 600, 37):
+                # Units pushed together, sometimes more than the ring holds
+                units: int = timestamp % 5 + 1
+                ring.push(timestamp, units)
+                pushed = (pushed + [timestamp] * units)[-size:]
+                self.assertEqual(list(ring), pushed)
+                self.assertEqual(ring.get_front(), pushed[0])
+                self.assertEqual(ring[-1], timestamp)
+                for now in range(timestamp, timestamp + 2 * per, 11):
+                    # Brute force, the empty slots and the expired timestamps
+                    free: int = size - len(pushed)
+                    free += sum(1 for pushed_at in pushed if pushed_at + per < now)
+                    self.assertEqual(ring.free_at(now, per), free)
+                    for count in range(1, size + 1):
+                        ready: int = ring.ready_at(count, per)
+                        self.assertGreaterEqual(ring.free_at(max(ready, 0), per), count)
+                        if ready > 0:
+                            self.assertLess(ring.free_at(ready - 1, per), count)
+            self.assertEqual(ring.slots.itemsize, 8)
+            self.assertLessEqual(len(ring.slots), size)
+            self.assertLessEqual(len(ring.ends), size)
+
+        # Unit pushes fill a single array of size slots, then overwrite it in place
+        size = 100_000
+        ring = RingBuffer(size)
+        for timestamp in range(3 * size):
+            ring.push(timestamp)
+        self.assertIsNone(ring.ends)
+        self.assertLessEqual(len(ring.slots), size)
+        self.assertEqual(list(ring), list(range(2 * size, 3 * size)))
+        self.assertEqual(ring.free_at(3 * size, size // 2), size // 2)
+        # Costed pushes keep as many timestamps at most
+        for timestamp in range(3 * size, 4 * size):
+            ring.push(timestamp, timestamp % 3 + 1)
+        self.assertLessEqual(len(ring.slots), size)
+        self.assertLessEqual(len(ring.ends), size)
+        self.assertEqual(len(ring), size)
+        self.assertEqual(ring[-1], 4 * size - 1)
+
+        ring = RingBuffer(10)
+        for timestamp in range(10_000):
+            ring.push(timestamp)
+        self.assertEqual(list(ring), list(range(9_990, 10_000)))
+        ring.push(10_000, 3)
+        ring.push(10_000, 2)
+        self.assertEqual(list(ring.entries())[-2:], [(9_999, 1), (10_000, 5)])
+        self.assertEqual(ring[4], 9_999)
+        self.assertEqual(ring[5], 10_000)
+
+        # Resizing a wrapped ring keeps the newest timestamps in order
+        ring = RingBuffer(4)
+        for timestamp in range(6):
+            ring.push(timestamp)
+        ring.resize(6)
+        ring.push(6)
+        self.assertEqual(list(ring), [2, 3, 4, 5, 6])
+        ring.resize(2)
+        self.assertEqual(list(ring), [5, 6])
+        self.assertRaises(IndexError, ring.__getitem__, 2)
+        ring.clear()
+        self.assertRaises(IndexError, ring.get_front)
+
     # provide 'per' in seconds
     async def do_test(self, totalTasks: int, rate: int, per: int):
         per *= 1_000_000_000  # convert to nanoseconds
@@ -94,3 +593,470 @@ class RateLimiterTests(unittest.IsolatedAsyncioTestCase):
         print(
             f"Total Spare time = {totalSpareTime}, Average spare time per window: {totalSpareTime / (totalTasks // rate)} ns"
         )
+
+
+def run_simulated(main) -> None:
+    with asyncio.Runner(loop_factory=SimulatedEventLoop) as runner:
+        runner.run(main())
+
+
+class RateLimiterSimulatedTests(unittest.TestCase):
+    # No more than `rate` of the sorted timestamps may fall in any `per` interval
+    def assertRateLimited(self, log: list[int], rate: int, per: int) -> None:
+        log = sorted(log)
+        for i in range(len(log) - rate):
+            self.assertGreater(log[i + rate] - log[i], per)
+
+    def test_deadlines_expire_on_time(self):
+        async def main():
+            clock = loop_clock()
+            per: int = 10_000_000_000
+            second: int = 1_000_000_000
+            for options in ({}, {"max_concurrency": 2}, {"flows": {"a": 1, "b": 1}}):
+                expired: list[tuple[str, int]] = []
+                rateLimiter: RateLimiter = RateLimiter(
+                    1,
+                    per,
+                    max_wait_ns=5 * second,
+                    on_drop=lambda task, error: expired.append(
+                        (getattr(task, "name", None), clock.monotonic_ns())
+                    ),
+                    metrics=True,
+                    **options,
+                )
+                origin: int = clock.monotonic_ns()
+                ran: list[str] = []
+
+                def task(name: str) -> Callable:
+                    run: Callable = functools.partial(ran.append, name)
+                    run.name = name
+                    return run
+
+                await rateLimiter.push(task("first"))
+                # The window refills at 10s, every deadline below passes before
+                await rateLimiter.push(task("max_wait"))
+                await rateLimiter.push(task("behind"), deadline_ns=origin + 2 * second)
+                waiter: asyncio.Task = asyncio.create_task(
+                    rateLimiter.acquire(deadline_ns=origin + second)
+                )
+                await asyncio.sleep(0)
+                with self.assertRaises(QueueTimeoutError):
+                    await waiter
+                self.assertAlmostEqual(
+                    clock.monotonic_ns() - origin, second, delta=1_000
+                )
+
+                await asyncio.sleep(12)
+                # Each task is rejected right after its own deadline, the one
+                # queued behind the head included
+                self.assertEqual(
+                    [name for name, _ in expired if name], ["behind", "max_wait"]
+                )
+                for (_, at), deadline in zip(expired[1:], (2 * second, 5 * second)):
+                    self.assertAlmostEqual(at - origin, deadline, delta=1_000)
+                self.assertEqual(ran, ["first"])
+                self.assertEqual(rateLimiter.metrics.expired, 3)
+                self.assertEqual(rateLimiter.metrics.queue_depth, 0)
+                self.assertEqual(rateLimiter.expiryHeap, [])
+                self.assertIsNone(rateLimiter.expiryHandle)
+
+        run_simulated(main)
+
+    def test_composite_limits(self):
+        async def main():
+            clock = loop_clock()
+            per: int = 100_000_000
+            for engine in ("SLIDING_WINDOW", "GCRA"):
+                rateLimiter: RateLimiter = RateLimiter(
+                    5, per, engine=engine, limits=[(8, 4 * per)]
+                )
+                executionLog: list[int] = []
+                await rateLimiter.push_many(
+                    lambda: executionLog.append(clock.monotonic_ns()) for _ in range(20)
+                )
+                while len(executionLog) < 20:
+                    await asyncio.sleep(0.05)
+
+                self.assertRateLimited(executionLog, 5, per)
+                self.assertRateLimited(executionLog, 8, 4 * per)
+                # The slower limit sets the pace, 20 tasks span two of its windows
+                self.assertGreater(executionLog[-1] - executionLog[0], 8 * per)
+                self.assertLess(executionLog[-1] - executionLog[0], 12 * per)
+
+            rateLimiter = RateLimiter(2, per, limits=[(3, 10 * per)])
+            self.assertTrue(rateLimiter.try_acquire())
+            self.assertTrue(rateLimiter.try_acquire())
+            self.assertFalse(rateLimiter.try_acquire())
+            await asyncio.sleep(0.15)
+            self.assertTrue(rateLimiter.try_acquire())
+            await asyncio.sleep(0.15)
+            # Only the second limit is exhausted, the first one is not charged
+            self.assertFalse(rateLimiter.try_acquire())
+            self.assertEqual(len(rateLimiter.ringBuffer), 2)
+            self.assertRaises(ValueError, RateLimiter, 2, per, limits=[(0, per)])
+
+        run_simulated(main)
+
+    def test_hierarchical_budgets(self):
+        async def main():
+            clock = loop_clock()
+            per: int = 1_000_000_000
+            globalLimiter: RateLimiter = RateLimiter(10, per)
+            tenantA: RateLimiter = RateLimiter(
+                6, per, max_concurrency=3, parent=globalLimiter
+            )
+            tenantB: RateLimiter = RateLimiter(
+                6, per, max_concurrency=3, parent=globalLimiter
+            )
+            endpoint: RateLimiter = RateLimiter(
+                4, per, max_concurrency=2, parent=tenantA
+            )
+            completions: dict[str, list[int]] = {"a": [], "b": [], "endpoint": []}
+
+            async def call(name: str) -> None:
+                await asyncio.sleep(0.3)
+                completions[name].append(clock.monotonic_ns())
+
+            for name, limiter in (
+                ("a", tenantA),
+                ("b", tenantB),
+                ("endpoint", endpoint),
+            ):
+                await limiter.push_many(lambda name=name: call(name) for _ in range(20))
+            while sum(len(log) for log in completions.values()) < 60:
+                await asyncio.sleep(0.1)
+
+            # Tasks are charged on completion to their limiter and every ancestor
+            self.assertRateLimited(completions["endpoint"], 4, per)
+            self.assertRateLimited(completions["a"] + completions["endpoint"], 6, per)
+            self.assertRateLimited(completions["b"], 6, per)
+            self.assertRateLimited(
+                completions["a"] + completions["b"] + completions["endpoint"], 10, per
+            )
+            self.assertEqual(globalLimiter.childReservations, 0)
+            self.assertEqual(tenantA.childReservations, 0)
+
+        run_simulated(main)
+
+    def test_stream_adapters(self):
+        async def main():
+            clock = loop_clock()
+            per: int = 1_000_000_000
+            pulls: list[int] = []
+
+            async def pages(count: int):
+                for page in range(count):
+                    pulls.append(clock.monotonic_ns())
+                    yield page
+
+            # Every pull of the source is rate limited, nothing is read ahead
+            rateLimiter: RateLimiter = RateLimiter(5, per)
+            consumed: list[int] = []
+            async for page in rateLimiter.throttle(pages(23)):
+                self.assertEqual(len(pulls), len(consumed) + 1)
+                consumed.append(page)
+            self.assertEqual(consumed, list(range(23)))
+            self.assertRateLimited(pulls, 5, per)
+
+            # Calls run ahead of the consumer, up to prefetch of them
+            for ordered in (True, False):
+                rateLimiter = RateLimiter(10, per)
+                started: list[int] = []
+                running: list[int] = [0, 0]
+
+                async def fetch(item: int) -> int:
+                    started.append(clock.monotonic_ns())
+                    running[0] += 1
+                    running[1] = max(running[1], running[0])
+                    # Every third item is slow
+                    await asyncio.sleep(2 if item % 3 == 0 else 0.1)
+                    running[0] -= 1
+                    return item * item
+
+                results: list[int] = [
+                    result
+                    async for result in rateLimiter.map(
+                        fetch, range(40), prefetch=6, ordered=ordered
+                    )
+                ]
+                self.assertRateLimited(started, 10, per)
+                self.assertLessEqual(running[1], 6)
+                if ordered:
+                    self.assertEqual(results, [item * item for item in range(40)])
+                else:
+                    self.assertEqual(sorted(results), [i * i for i in range(40)])
+                    # Fast results overtake the slow ones
+                    self.assertNotEqual(results, [i * i for i in range(40)])
+
+            # An endless source is only pulled as far as the consumer gets
+            pulls.clear()
+            mapped = rateLimiter.map(abs, pages(10**9), prefetch=4)
+            async for result in mapped:
+                if result == 20:
+                    break
+            await mapped.aclose()
+            self.assertLessEqual(len(pulls), 21 + 4 + 1)
+
+            # Errors of func or of the source end the stream
+            mapped = rateLimiter.map(lambda item: 1 // (item - 3), range(10))
+            with self.assertRaises(ZeroDivisionError):
+                async for result in mapped:
+                    pass
+            self.assertRaises(ValueError, rateLimiter.map, abs, [], prefetch=0)
+
+        run_simulated(main)
+
+    def test_retry_with_backoff(self):
+        async def main():
+            clock = loop_clock()
+            per: int = 1_000_000_000
+            attempts: dict[int, list[int]] = {}
+
+            running: list[int] = [0, 0]
+
+            # Fails the first two attempts of every item
+            async def flaky(item: int) -> int:
+                attempts.setdefault(item, []).append(clock.monotonic_ns())
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+                await asyncio.sleep(0.01)
+                running[0] -= 1
+                if len(attempts[item]) < 3:
+                    raise ConnectionError(f"attempt {len(attempts[item])}")
+                return item
+
+            for max_concurrency in (1, 4):
+                attempts.clear()
+                running[1] = 0
+                rateLimiter: RateLimiter = RateLimiter(
+                    5,
+                    per,
+                    max_concurrency=max_concurrency,
+                    metrics=True,
+                    retry=RetryPolicy(
+                        max_attempts=3, base_delay_ns=200_000_000, seed=7
+                    ),
+                )
+                handles: list[TaskHandle] = [
+                    await rateLimiter.submit(lambda item=item: flaky(item))
+                    for item in range(20)
+                ]
+                # Backoffs are timed by one heap and one loop timer, not a task each
+                most: int = 0
+                while not all(handle.done() for handle in handles):
+                    most = max(most, len(asyncio.all_tasks()))
+                    await asyncio.sleep(0.05)
+                self.assertLessEqual(most, max_concurrency + 3)
+                self.assertEqual([h.result() for h in handles], list(range(20)))
+                self.assertLessEqual(running[1], max_concurrency)
+
+                # Retries are charged like new tasks, so they never exceed the rate
+                everything: list[int] = [t for log in attempts.values() for t in log]
+                self.assertEqual(len(everything), 60)
+                self.assertRateLimited(everything, 5, per)
+                self.assertEqual(rateLimiter.metrics.retried, 40)
+                for log in attempts.values():
+                    self.assertGreaterEqual(log[1] - log[0], 0)
+                    self.assertLessEqual(log[1] - log[0], 10 * per)
+
+            # The last attempt, or an exception not retried, reaches the caller
+            calls: list[str] = []
+
+            def failing(kind: type) -> None:
+                calls.append(kind.__name__)
+                raise kind("boom")
+
+            rateLimiter = RateLimiter(
+                100,
+                per,
+                retry=RetryPolicy(
+                    max_attempts=4,
+                    base_delay_ns=10_000_000,
+                    jitter="NONE",
+                    retry_on=lambda e: isinstance(e, ConnectionError),
+                ),
+            )
+            handle: TaskHandle = await rateLimiter.submit(
+                lambda: failing(ConnectionError)
+            )
+            with self.assertRaises(ConnectionError):
+                await handle
+            handle = await rateLimiter.submit(lambda: failing(KeyError))
+            with self.assertRaises(KeyError):
+                await handle
+            self.assertEqual(calls, ["ConnectionError"] * 4 + ["KeyError"])
+
+            # A FRONT retry overtakes the tasks queued during its backoff
+            order: list[str] = []
+            failures: list[int] = [1]
+
+            def first() -> None:
+                order.append("first")
+                if failures[0] > 0:
+                    failures[0] -= 1
+                    raise ConnectionError()
+
+            for placement, expected in (
+                ("FRONT", ["first", "first", "b0", "b1", "b2"]),
+                ("BACK", ["first", "b0", "b1", "b2", "first"]),
+            ):
+                order.clear()
+                failures[0] = 1
+                rateLimiter = RateLimiter(
+                    1,
+                    100_000_000,
+                    retry=RetryPolicy(
+                        base_delay_ns=50_000_000, jitter="NONE", placement=placement
+                    ),
+                )
+                await rateLimiter.push(first)
+                for name in ("b0", "b1", "b2"):
+                    await rateLimiter.push(lambda name=name: order.append(name))
+                await asyncio.sleep(1)
+                self.assertEqual(order, expected, placement)
+
+            # Retries are queued under the deadline of the first attempt
+            attempts: list[int] = [0]
+
+            def unreachable() -> None:
+                attempts[0] += 1
+                raise ConnectionError()
+
+            rateLimiter = RateLimiter(
+                100,
+                100_000_000,
+                max_wait_ns=1_000_000_000,
+                retry=RetryPolicy(
+                    max_attempts=100,
+                    base_delay_ns=300_000_000,
+                    multiplier=1.0,
+                    jitter="NONE",
+                ),
+            )
+            handle = await rateLimiter.submit(unreachable)
+            with self.assertRaises(QueueTimeoutError):
+                await handle
+            self.assertEqual(attempts[0], 4)
+
+            # The backoff of a late attempt is capped without overflowing
+            policy = RetryPolicy(max_attempts=10**9, jitter="NONE")
+            for attempt in (2000, 10**9):
+                self.assertEqual(policy.delay_ns(attempt), policy.max_delay_ns)
+
+            self.assertRaises(ValueError, RetryPolicy, max_attempts=0)
+            self.assertRaises(ValueError, RetryPolicy, placement="MIDDLE")
+
+        run_simulated(main)
+
+    def test_weighted_costs(self):
+        async def main():
+            clock = loop_clock()
+            per: int = 1_000_000_000
+            # A budget of 1000 bytes per second
+            rateLimiter: RateLimiter = RateLimiter(1000, per)
+            log: list[tuple[int, int]] = []
+            for size in (400, 400, 400, 100, 700, 50):
+                await rateLimiter.push(
+                    lambda size=size: log.append((clock.monotonic_ns(), size)),
+                    cost=size,
+                )
+            await asyncio.sleep(5)
+            self.assertEqual([size for _, size in log], [400, 400, 400, 100, 700, 50])
+            for started, _ in log:
+                self.assertLessEqual(
+                    sum(size for at, size in log if started - per <= at <= started),
+                    1000,
+                )
+            # The third 400 waits for the first two to leave the window
+            self.assertAlmostEqual(log[2][0], per, delta=1_000)
+            self.assertAlmostEqual(log[4][0], 2 * per, delta=1_000)
+            self.assertEqual(len(rateLimiter.ringBuffer), 1000)
+            # One timestamp per moment units were charged at: 1s and 2s
+            self.assertEqual(rateLimiter.ringBuffer.count, 2)
+
+            # Cheaper tasks pass a head that does not fit yet under BYPASS only
+            for head_of_line, expected in (
+                ("STRICT", ["big0", "big1", "small0", "small1", "small2"]),
+                ("BYPASS", ["big0", "small0", "small1", "small2", "big1"]),
+            ):
+                for options in (
+                    {},
+                    {
+                        "max_concurrency": 4,
+                        "record_on": "START",
+                        "metrics": True,
+                        "flows": {"default": 1, "other": 1},
+                    },
+                ):
+                    order: list[str] = []
+                    rateLimiter = RateLimiter(
+                        10, per, head_of_line=head_of_line, **options
+                    )
+                    for name, cost in (
+                        ("big0", 6),
+                        ("big1", 6),
+                        ("small0", 1),
+                        ("small1", 1),
+                        ("small2", 1),
+                    ):
+                        await rateLimiter.push(
+                            lambda name=name: order.append(name), cost=cost
+                        )
+                    await asyncio.sleep(2)
+                    self.assertEqual(order, expected, (head_of_line, options))
+                    if rateLimiter.metrics is not None:
+                        self.assertEqual(rateLimiter.metrics.queue_wait.count, 4)
+                        self.assertEqual(rateLimiter.metrics.queue_depth, 0)
+
+            # A steady stream of cheap tasks does not starve a large one
+            rateLimiter = RateLimiter(10, per, head_of_line="BYPASS")
+            started: dict[str, int] = {}
+            origin: int = clock.monotonic_ns()
+            await rateLimiter.push(lambda: None, cost=5)
+            await rateLimiter.push(
+                lambda: started.setdefault("big", clock.monotonic_ns()), cost=8
+            )
+            for _ in range(30):
+                await rateLimiter.push(
+                    lambda: started.setdefault("small", clock.monotonic_ns())
+                )
+                await asyncio.sleep(0.1)
+            await asyncio.sleep(2)
+            self.assertLess(started["small"], started["big"])
+            self.assertLess(started["big"] - origin, 2 * per)
+
+            # Retries are charged the cost of the task again
+            attempts: list[int] = []
+
+            def flaky() -> None:
+                attempts.append(clock.monotonic_ns())
+                if len(attempts) == 1:
+                    raise ConnectionError()
+
+            rateLimiter = RateLimiter(
+                10, per, retry=RetryPolicy(base_delay_ns=per // 10, jitter="NONE")
+            )
+            await rateLimiter.push(flaky, cost=6)
+            await asyncio.sleep(2)
+            self.assertEqual(len(attempts), 2)
+            self.assertAlmostEqual(attempts[1] - attempts[0], per, delta=1_000)
+            self.assertEqual(len(rateLimiter.ringBuffer), 10)
+
+            # GCRA accounts the cost in its arrival time, up to the burst
+            gcra: RateLimiter = RateLimiter(10, per, engine="GCRA", burst=10)
+            self.assertTrue(gcra.try_acquire(cost=6))
+            self.assertFalse(gcra.try_acquire(cost=6))
+            self.assertTrue(gcra.try_acquire(cost=3))
+            self.assertFalse(gcra.try_acquire())
+            self.assertEqual(gcra.max_cost(), 10)
+
+            composite: RateLimiter = RateLimiter(100, per, limits=[(10, 60 * per)])
+            self.assertEqual(composite.max_cost(), 10)
+            with self.assertRaises(ValueError):
+                await composite.push(lambda: None, cost=11)
+            with self.assertRaises(ValueError):
+                await composite.acquire(cost=0)
+            self.assertRaises(ValueError, gcra.try_acquire, 11)
+            self.assertRaises(ValueError, RateLimiter, 1, per, head_of_line="LIFO")
+
+        run_simulated(main)
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import sys
+import unittest
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from Clock import SimulatedEventLoop, loop_clock
+from Scheduler import (
+    CronSchedule,
+    IntervalSchedule,
+    Schedule,
+    ScheduledJob,
+    Scheduler,
+)
+
+SECOND: int = 1_000_000_000
+MINUTE: int = 60 * SECOND
+
+
+def epoch_ns(*args) -> int:
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp()) * SECOND
+
+
+# Runs main on virtual time starting at 2024-01-01 00:00:30 UTC, a Monday
+def run_simulated(main) -> None:
+    with asyncio.Runner(
+        loop_factory=lambda: SimulatedEventLoop(epoch_ns(2024, 1, 1, 0, 0, 30))
+    ) as runner:
+        runner.run(main())
+
+
+class SchedulerTests(unittest.TestCase):
+    def test_cron_expressions(self):
+        business: CronSchedule = CronSchedule("*/15 9-17 * * mon-fri")
+        # Friday evening to Monday morning
+        self.assertEqual(
+            business.next_after(datetime(2024, 5, 3, 17, 50)),
+            datetime(2024, 5, 6, 9, 0),
+        )
+        self.assertEqual(
+            business.next_after(datetime(2024, 5, 6, 9, 0)),
+            datetime(2024, 5, 6, 9, 15),
+        )
+        self.assertEqual(
+            CronSchedule("0 0 29 feb *").next_after(datetime(2024, 3, 1)),
+            datetime(2028, 2, 29),
+        )
+        # Both day fields restricted: the 1st of the month or any Monday
+        either: CronSchedule = CronSchedule("0 0 1 * 1")
+        self.assertEqual(either.next_after(datetime(2024, 1, 1)), datetime(2024, 1, 8))
+        self.assertEqual(either.next_after(datetime(2024, 1, 29)), datetime(2024, 2, 1))
+        self.assertEqual(
+            CronSchedule("30 */20 * * * *").next_after(datetime(2024, 1, 1, 0, 0, 30)),
+            datetime(2024, 1, 1, 0, 20, 30),
+        )
+        self.assertEqual(
+            CronSchedule("@hourly").next_after(datetime(2024, 1, 1, 23, 0)),
+            datetime(2024, 1, 2, 0, 0),
+        )
+        for invalid in (
+            "* * * *",
+            "61 * * * *",
+            "*/0 * * * *",
+            "0 0 30 2 *",
+            "x * * * *",
+        ):
+            self.assertRaises(ValueError, CronSchedule, invalid)
+
+        # 02:30 does not exist on 2024-03-10 in New York, 01:30 happens twice on 11-03
+        new_york: ZoneInfo = ZoneInfo("America/New_York")
+        nightly: CronSchedule = CronSchedule("30 2 * * *", new_york)
+        fire: int = nightly.next_fire_ns(epoch_ns(2024, 3, 9, 12))
+        self.assertEqual(fire, epoch_ns(2024, 3, 10, 7, 30))
+        repeated: CronSchedule = CronSchedule("30 1 * * *", new_york)
+        fire = repeated.next_fire_ns(epoch_ns(2024, 11, 3, 4))
+        self.assertEqual(fire, epoch_ns(2024, 11, 3, 5, 30))
+        self.assertEqual(repeated.next_fire_ns(fire), epoch_ns(2024, 11, 4, 6, 30))
+
+        aligned: IntervalSchedule = IntervalSchedule(MINUTE, 15 * SECOND)
+        self.assertEqual(
+            aligned.next_fire_ns(epoch_ns(2024, 1, 1, 0, 0, 15)),
+            epoch_ns(2024, 1, 1, 0, 1, 15),
+        )
+        self.assertEqual(
+            aligned.next_fire_ns(epoch_ns(2024, 1, 1, 0, 0, 14)),
+            epoch_ns(2024, 1, 1, 0, 0, 15),
+        )
+        # A schedule must say when it fires next
+        self.assertRaises(TypeError, Schedule)
+
+    def test_jobs_share_one_wakeup(self):
+        async def main():
+            clock = loop_clock()
+            scheduler: Scheduler = Scheduler()
+            fires: dict[int, list[int]] = {}
+            jobs: list[ScheduledJob] = []
+            for index in range(1_000):
+                fires[index] = []
+                jobs.append(
+                    scheduler.schedule(
+                        IntervalSchedule(MINUTE * (1 + index % 3)),
+                        lambda index=index: fires[index].append(clock.time_ns()),
+                    )
+                )
+            every_minute = []
+            scheduler.schedule(
+                "* * * * *", lambda: every_minute.append(clock.time_ns()), metrics=True
+            )
+            self.assertEqual(len(scheduler.heap), 1_001)
+
+            await asyncio.sleep(6 * 60)
+            # Fires at :00 of the aligned minutes, never early or late
+            self.assertEqual(
+                every_minute, [epoch_ns(2024, 1, 1, 0, m) for m in range(1, 7)]
+            )
+            self.assertEqual(len(fires[0]), 6)
+            self.assertEqual(len(fires[1]), 3)
+            self.assertEqual(len(fires[2]), 2)
+            self.assertTrue(all(fire % (3 * MINUTE) == 0 for fire in fires[2]))
+
+            # Stopped jobs are dropped lazily, the heap is compacted as it goes
+            for job in jobs[:900]:
+                self.assertTrue(job.stop())
+            self.assertFalse(jobs[0].stop())
+            self.assertLessEqual(len(scheduler.heap), 600)
+            await asyncio.sleep(3 * 60)
+            self.assertEqual(len(fires[0]), 6)
+            self.assertEqual(len(fires[900]), 9)
+
+            scheduler.stop()
+            self.assertIsNone(scheduler.wakeup_handle)
+            self.assertTrue(scheduler.unschedule(jobs[0]))
+            self.assertEqual(len(scheduler), 1_000)
+
+        run_simulated(main)
+
+    def test_overrun_and_stop_semantics(self):
+        async def main():
+            clock = loop_clock()
+            scheduler: Scheduler = Scheduler()
+            starts: list[int] = []
+
+            async def slow() -> None:
+                starts.append(clock.time_ns())
+                await asyncio.sleep(150)
+
+            job: ScheduledJob = scheduler.schedule(
+                IntervalSchedule(MINUTE), slow, metrics=True
+            )
+            await asyncio.sleep(5 * 60)
+            # Fires at 1:00, runs until 3:30, skipping 2:00 and 3:00, then fires at 4:00
+            self.assertEqual(
+                starts,
+                [epoch_ns(2024, 1, 1, 0, 1), epoch_ns(2024, 1, 1, 0, 4)],
+            )
+            self.assertEqual(job.metrics.skipped_ticks, 2)
+            self.assertEqual(job.metrics.ticks, 2)
+
+            # A job stopped by another job due at the same time does not fire
+            fired: list[str] = []
+            scheduler.stop()
+            first: ScheduledJob = scheduler.schedule(
+                "* * * * *", lambda: (fired.append("first"), second.stop())
+            )
+            second: ScheduledJob = scheduler.schedule(
+                "* * * * *", lambda: fired.append("second")
+            )
+            await asyncio.sleep(2 * 60)
+            self.assertEqual(fired, ["first", "first"])
+
+            # A restart during a callback does not start a second chain of fires
+            errors: list[Exception] = []
+
+            async def failing() -> None:
+                await asyncio.sleep(1)
+                raise KeyError("boom")
+
+            first.stop()
+            restarted: ScheduledJob = scheduler.schedule(
+                IntervalSchedule(10 * SECOND), failing, err_callback=errors.append
+            )
+            await asyncio.sleep(10.5)
+            restarted.stop()
+            restarted.start()
+            await asyncio.sleep(29)
+            # Fires at 7:40, then at 7:50 and 8:00 after the restart. The callback
+            # in flight at the restart still reports its error but queues nothing
+            self.assertEqual(len(errors), 3)
+            scheduler.stop()
+
+        run_simulated(main)
@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from SharedRateLimiter import SharedGcraWindow, SharedRateLimiter
+
+
+def count_admissions(name: str, rate: int, per: int, deadline: float, results) -> None:
+    rateLimiter: SharedRateLimiter = SharedRateLimiter(name, rate, per)
+    admitted: int = 0
+    while time.monotonic() < deadline:
+        if rateLimiter.try_acquire():
+            admitted += 1
+    rateLimiter.close()
+    results.put(admitted)
+
+
+@unittest.skipUnless(
+    "fork" in multiprocessing.get_all_start_methods(), "requires the fork start method"
+)
+class SharedRateLimiterTests(unittest.TestCase):
+    def setUp(self):
+        self.name: str = f"asyncio_utils_test_{os.getpid()}"
+        self.owner: SharedRateLimiter = SharedRateLimiter(self.name, 100, 1_000_000_000)
+
+    def tearDown(self):
+        self.owner.close()
+        self.owner.unlink()
+
+    def test_processes_share_one_budget(self):
+        rate: int = 100
+        per: int = 1_000_000_000
+        duration: float = 1.0
+        processCount: int = 4
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        # All processes stop at the same time, whenever they managed to start
+        deadline: float = time.monotonic() + duration
+        processes = [
+            context.Process(
+                target=count_admissions, args=(self.name, rate, per, deadline, results)
+            )
+            for _ in range(processCount)
+        ]
+        for process in processes:
+            process.start()
+        admitted: list[int] = [results.get(timeout=10) for _ in processes]
+        for process in processes:
+            process.join()
+
+        # One budget of 'rate' per 'per' for all processes together
+        self.assertLessEqual(sum(admitted), rate * duration + 2)
+        self.assertGreaterEqual(sum(admitted), rate * duration * 0.8)
+
+    def test_mismatched_configuration_is_rejected(self):
+        with self.assertRaises(ValueError):
+            SharedRateLimiter(self.name, 10, 1_000_000_000)
+        self.assertRaises(TypeError, self.owner.set_rate, 200)
+
+    def test_long_uptime_does_not_overflow(self):
+        per: int = 60_000_000_000
+        window: SharedGcraWindow = SharedGcraWindow(f"{self.name}_uptime", 100_000, per)
+        try:
+            # 30 days of host uptime, the scaled arrival time exceeds 64 bits
+            now: int = 30 * 24 * 3600 * 1_000_000_000
+            self.assertTrue(window.try_record(now))
+            self.assertFalse(window.try_record(now))
+            self.assertEqual(window.ready_at(), now + per // 100_000 + 1)
+            self.assertTrue(window.try_record(now + per // 100_000 + 1))
+        finally:
+            window.close()
+            window.unlink()
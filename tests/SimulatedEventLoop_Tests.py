@@ -0,0 +1,93 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from Clock import SYSTEM_CLOCK, Clock, SimulatedEventLoop, loop_clock
+from RateLimiter import RateLimiter
+from Timer import Timer
+from TimerWheel import TimerWheel
+
+
+def run_simulated(main) -> None:
+    with asyncio.Runner(loop_factory=SimulatedEventLoop) as runner:
+        runner.run(main())
+
+
+class SimulatedEventLoopTests(unittest.TestCase):
+    def test_sleep_advances_virtual_time(self):
+        async def main():
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            clock = loop_clock()
+            self.assertIs(clock, loop.clock)
+            await asyncio.sleep(3_600)
+            self.assertEqual(clock.monotonic_ns(), 3_600_000_000_000)
+            self.assertEqual(loop.time(), 3_600)
+
+        begin: float = time.monotonic()
+        run_simulated(main)
+        self.assertLess(time.monotonic() - begin, 1)
+        self.assertIs(loop_clock(), SYSTEM_CLOCK)
+
+    def test_clock_is_abstract(self):
+        self.assertRaises(TypeError, Clock)
+
+        class MonotonicOnly(Clock):
+            def monotonic_ns(self) -> int:
+                return 0
+
+        # A clock must provide both times
+        self.assertRaises(TypeError, MonotonicOnly)
+
+    def test_timers_tick_for_a_simulated_hour(self):
+        async def main():
+            counters: list[int] = [0, 0, 0]
+
+            def increment(i: int):
+                counters[i] += 1
+
+            timers: list[Timer] = [
+                Timer(1_000_000_000, lambda: increment(0)),
+                Timer(1_000_000_000, lambda: increment(1), tick_mode="CALL_AT"),
+                Timer(1_000_000_000, lambda: increment(2), wheel=TimerWheel()),
+            ]
+            for timer in timers:
+                timer.start()
+            await asyncio.sleep(3_600.5)
+            for timer in timers:
+                timer.stop()
+
+            self.assertEqual(counters, [3_600, 3_600, 3_600])
+
+        run_simulated(main)
+
+    def test_rate_limiter_in_virtual_time(self):
+        async def main():
+            clock = loop_clock()
+            totalTasks: int = 10_000
+            rate: int = 1_000
+            per: int = 1_000_000_000
+            for engine in ("SLIDING_WINDOW", "GCRA"):
+                rateLimiter: RateLimiter = RateLimiter(rate, per, engine=engine)
+                executionLog: list[int] = []
+                begin: int = clock.monotonic_ns()
+
+                for _ in range(totalTasks):
+                    await rateLimiter.push(
+                        lambda: executionLog.append(clock.monotonic_ns())
+                    )
+                while len(executionLog) < totalTasks:
+                    await asyncio.sleep(1)
+
+                for i in range(totalTasks - rate):
+                    self.assertGreater(executionLog[i + rate] - executionLog[i], per)
+                # Virtual time is exact, the limiter runs at its full rate
+                self.assertLess(
+                    executionLog[-1] - begin, (totalTasks // rate) * per + per
+                )
+
+        run_simulated(main)
@@ -0,0 +1,327 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from Clock import Clock, SimulatedClock, SimulatedEventLoop, loop_clock
+from DistributedRateLimiter import DistributedRateLimiter, RedisAdmissionStore
+from KeyedRateLimiter import KeyedRateLimiter
+from RateLimiter import RateLimiter
+from SharedRateLimiter import SharedRateLimiter
+from StateStore import StateStore
+from Timer import Timer
+
+SECOND: int = 1_000_000_000
+
+
+# Clock of a process restarted at `restarted_at`, its monotonic time starts over
+class RestartedClock(Clock):
+    def __init__(self, clock: Clock, restarted_at: int) -> None:
+        self.clock: Clock = clock
+        self.restarted_at: int = restarted_at
+
+    def monotonic_ns(self) -> int:
+        return self.clock.monotonic_ns() - self.restarted_at
+
+    def time_ns(self) -> int:
+        return self.clock.time_ns()
+
+
+def run_simulated(main) -> None:
+    with asyncio.Runner(loop_factory=SimulatedEventLoop) as runner:
+        runner.run(main())
+
+
+class StateStoreTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path: str = os.path.join(directory.name, "state.bin")
+
+    def assertTimesEqual(self, actual: list[int], expected: list[int]) -> None:
+        self.assertEqual(len(actual), len(expected), actual)
+        for value, want in zip(actual, expected):
+            self.assertAlmostEqual(value, want, delta=1_000)
+
+    def test_limiter_resumes_after_restart(self):
+        async def main():
+            clock = loop_clock()
+            await asyncio.sleep(1)
+            store: StateStore = StateStore(self.path)
+            limiter: RateLimiter = RateLimiter(3, SECOND)
+            gcra: RateLimiter = RateLimiter(
+                10, SECOND, engine="GCRA", burst=5, limits=[(20, 60 * SECOND)]
+            )
+            for _ in range(3):
+                await limiter.push(lambda: None)
+            for _ in range(4):
+                self.assertTrue(gcra.try_acquire())
+            await asyncio.sleep(0.4)
+            store.save_limiter("api", limiter)
+            store.save_limiter("gcra", gcra)
+            store.close()
+
+            # Down for 100ms, the new process's monotonic clock starts over
+            await asyncio.sleep(0.1)
+            restarted: RestartedClock = RestartedClock(clock, clock.monotonic_ns())
+            store = StateStore(self.path)
+            self.assertEqual(sorted(store.names()), ["api", "gcra"])
+            limiter = RateLimiter(3, SECOND, clock=restarted)
+            self.assertTrue(store.restore_limiter("api", limiter))
+            self.assertFalse(store.restore_limiter("missing", limiter))
+            started: list[int] = []
+            for _ in range(4):
+                await limiter.push(lambda: started.append(clock.monotonic_ns()))
+            await asyncio.sleep(2)
+            # The restored window still holds the three tasks run at 1s
+            self.assertTimesEqual(started[:3], [2 * SECOND + 1] * 3)
+
+            # GCRA state resumes too, with the debt rescaled to a new rate
+            gcra = RateLimiter(
+                20,
+                SECOND,
+                engine="GCRA",
+                burst=5,
+                limits=[(20, 60 * SECOND)],
+                clock=restarted,
+            )
+            store.restore_limiter("gcra", gcra)
+            # A fresh limiter would admit 4, the minute window has room for one
+            self.assertEqual([gcra.try_acquire() for _ in range(4)].count(True), 1)
+
+            self.assertRaises(
+                ValueError, store.restore_limiter, "gcra", RateLimiter(3, SECOND)
+            )
+            self.assertRaises(
+                ValueError, store.restore_timer, "api", Timer(SECOND, lambda: None)
+            )
+            self.assertTrue(store.delete("api"))
+            self.assertFalse(store.delete("api"))
+            store.close()
+            with StateStore(self.path) as store:
+                self.assertNotIn("api", store)
+
+        run_simulated(main)
+
+    def test_timer_resumes_schedule(self):
+        async def main():
+            clock = loop_clock()
+            store: StateStore = StateStore(self.path)
+            ticks: list[int] = []
+            timer: Timer = Timer(
+                10 * SECOND, lambda: ticks.append(clock.monotonic_ns())
+            )
+            timer.start()
+            await asyncio.sleep(13)
+            store.save_timer("job", timer)
+            timer.stop()
+
+            await asyncio.sleep(2)
+            restarted: Timer = Timer(
+                10 * SECOND,
+                lambda: ticks.append(clock.monotonic_ns()),
+                clock=RestartedClock(clock, clock.monotonic_ns()),
+                tick_mode="CALL_AT",
+            )
+            self.assertTrue(store.restore_timer("job", restarted))
+            await asyncio.sleep(6)
+            self.assertTimesEqual(ticks, [10 * SECOND, 20 * SECOND])
+
+            # A tick missed while down fires at once, then the schedule resumes
+            store.save_timer("job", restarted)
+            restarted.stop()
+            await asyncio.sleep(15)
+            resumed: Timer = Timer(
+                10 * SECOND,
+                lambda: ticks.append(clock.monotonic_ns()),
+                clock=RestartedClock(clock, clock.monotonic_ns()),
+            )
+            self.assertTrue(store.restore_timer("job", resumed))
+            await asyncio.sleep(5)
+            self.assertTimesEqual(
+                ticks, [10 * SECOND, 20 * SECOND, 36 * SECOND, 40 * SECOND]
+            )
+            store.save_timer("job", resumed)
+            resumed.stop()
+            store.save_timer("stopped", resumed)
+            self.assertFalse(store.restore_timer("stopped", Timer(SECOND, print)))
+            store.close()
+
+        run_simulated(main)
+
+    def test_keyed_restore_is_lazy(self):
+        async def main():
+            clock = loop_clock()
+            keys: int = 100_000
+            keyed: KeyedRateLimiter = KeyedRateLimiter(2, SECOND, max_keys=keys)
+            for key in range(keys):
+                await keyed.push(f"tenant-{key}", lambda: None)
+            await keyed.push("tenant-0", lambda: None)
+            store: StateStore = StateStore(self.path)
+            store.save_keyed("tenants", keyed)
+            store.close()
+
+            await asyncio.sleep(0.5)
+            restored: KeyedRateLimiter = KeyedRateLimiter(
+                2, SECOND, clock=RestartedClock(clock, clock.monotonic_ns())
+            )
+            started: float = time.perf_counter()
+            store = StateStore(self.path)
+            self.assertTrue(store.restore_keyed("tenants", restored))
+            elapsed: float = time.perf_counter() - started
+            self.assertEqual(len(restored.restored), keys)
+            self.assertLess(elapsed, 1.0)
+
+            ran: list[str] = []
+            await restored.push("tenant-0", lambda: ran.append("tenant-0"))
+            await restored.push("tenant-1", lambda: ran.append("tenant-1"))
+            await restored.push("tenant-new", lambda: ran.append("tenant-new"))
+            # tenant-0 used its two slots before the restart, tenant-1 one of them
+            self.assertEqual(ran, ["tenant-1", "tenant-new"])
+            self.assertEqual(len(restored), 3)
+
+            # Keys not used since the restore are saved again until they expire
+            store.save_keyed("tenants", restored)
+            store.close()
+            store = StateStore(self.path)
+            again: KeyedRateLimiter = KeyedRateLimiter(2, SECOND)
+            store.restore_keyed("tenants", again)
+            self.assertEqual(len(again.restored), keys + 1)
+            await asyncio.sleep(1)
+            await again.push("tenant-2", lambda: ran.append("tenant-2"))
+            self.assertIsNone(again.restored)
+            self.assertEqual(ran[-1], "tenant-2")
+            store.close()
+
+        run_simulated(main)
+
+    def test_evicted_keys_are_saved(self):
+        async def main():
+            keyed: KeyedRateLimiter = KeyedRateLimiter(1, SECOND, max_keys=1)
+            for key in ("evicted", "tracked"):
+                await keyed.push(key, lambda: None)
+            with StateStore(self.path) as store:
+                store.save_keyed("keys", keyed)
+            restored: KeyedRateLimiter = KeyedRateLimiter(1, SECOND)
+            with StateStore(self.path) as store:
+                self.assertTrue(store.restore_keyed("keys", restored))
+            self.assertEqual(sorted(restored.restored.index), ["evicted", "tracked"])
+
+        run_simulated(main)
+
+    def test_idle_gcra_after_long_uptime(self):
+        # A month of uptime, the arrival time of an unused limiter is still 0
+        clock: SimulatedClock = SimulatedClock(30 * 24 * 3600 * SECOND)
+        limiter: RateLimiter = RateLimiter(
+            1_000_000, SECOND, engine="GCRA", burst=2, clock=clock
+        )
+        with StateStore(self.path) as store:
+            store.save_limiter("idle", limiter)
+        clock.advance(SECOND)
+        restored: RateLimiter = RateLimiter(
+            1_000_000, SECOND, engine="GCRA", burst=2, clock=clock
+        )
+        with StateStore(self.path) as store:
+            self.assertTrue(store.restore_limiter("idle", restored))
+        fresh: RateLimiter = RateLimiter(
+            1_000_000, SECOND, engine="GCRA", burst=2, clock=clock
+        )
+        # The whole burst is available, as for a fresh limiter
+        self.assertEqual(
+            [restored.try_acquire() for _ in range(3)],
+            [fresh.try_acquire() for _ in range(3)],
+        )
+
+    def test_keys_of_every_type(self):
+        async def main():
+            keys: list = [
+                "tenant",
+                "\udc80",
+                b"\x00raw",
+                -(2**70),
+                255,
+                2.5,
+                ("region", 7, (b"", -1.0)),
+                (),
+            ]
+            keyed: KeyedRateLimiter = KeyedRateLimiter(1, SECOND)
+            for key in keys:
+                await keyed.push(key, lambda: None)
+            with StateStore(self.path) as store:
+                store.save_keyed("keys", keyed)
+                await keyed.push(object(), lambda: None)
+                self.assertRaises(ValueError, store.save_keyed, "bad", keyed)
+            restored: KeyedRateLimiter = KeyedRateLimiter(1, SECOND)
+            with StateStore(self.path) as store:
+                self.assertTrue(store.restore_keyed("keys", restored))
+            self.assertEqual(list(restored.restored.index), keys)
+
+        run_simulated(main)
+
+    def test_windows_outside_the_process(self):
+        shared: SharedRateLimiter = SharedRateLimiter(
+            f"state_store_test_{os.getpid()}", 10, SECOND
+        )
+        distributed: DistributedRateLimiter = DistributedRateLimiter(
+            RedisAdmissionStore(), "key", 10, SECOND
+        )
+        try:
+            with StateStore(self.path) as store:
+                for limiter in (shared, distributed):
+                    with self.assertRaises(TypeError) as caught:
+                        store.save_limiter("outside", limiter)
+                    self.assertIn(type(limiter.window).__name__, str(caught.exception))
+                    self.assertRaises(
+                        TypeError, store.restore_limiter, "outside", limiter
+                    )
+        finally:
+            shared.close()
+            shared.unlink()
+
+    def test_torn_records_and_compaction(self):
+        async def main():
+            store: StateStore = StateStore(self.path, fsync=False)
+            limiter: RateLimiter = RateLimiter(2, SECOND)
+            await limiter.push(lambda: None)
+            store.save_limiter("a", limiter)
+            store.save_limiter("b", limiter)
+            store.close()
+
+            # A crash in the middle of the last record
+            size: int = os.path.getsize(self.path)
+            with open(self.path, "r+b") as file:
+                file.truncate(size - 5)
+            store = StateStore(self.path)
+            self.assertEqual(store.names(), ["a"])
+            self.assertEqual(os.path.getsize(self.path), store.file_bytes)
+            store.save_limiter("b", limiter)
+            store.close()
+            with StateStore(self.path) as store:
+                self.assertEqual(store.names(), ["a", "b"])
+
+            # Repeated saves are compacted away
+            store = StateStore(self.path, fsync=False, compact_min_bytes=0)
+            for _ in range(100):
+                store.save_limiter("a", limiter)
+            self.assertLessEqual(store.file_bytes, 2 * (store.live_bytes + 6))
+            self.assertEqual(os.path.getsize(self.path), store.file_bytes)
+            store.close()
+            restored: RateLimiter = RateLimiter(2, SECOND)
+            with StateStore(self.path) as store:
+                self.assertTrue(store.restore_limiter("a", restored))
+            self.assertEqual(len(restored.ringBuffer), 1)
+
+            with open(self.path, "wb") as file:
+                file.write(b"not a state file")
+            self.assertRaises(ValueError, StateStore, self.path)
+
+        run_simulated(main)
+
+
+if __name__ == "__main__":
+    unittest.main()
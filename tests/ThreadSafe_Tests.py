@@ -0,0 +1,145 @@
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from LoopInbox import LoopInbox
+from RateLimiter import RateLimiter
+from Retry import RetryPolicy
+from Timer import Timer
+
+
+def run_in_threads(threadCount: int, target) -> None:
+    threads: list[threading.Thread] = [
+        threading.Thread(target=target, args=(i,)) for i in range(threadCount)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ThreadSafeTests(unittest.IsolatedAsyncioTestCase):
+    async def test_inbox_batches_wakeups(self):
+        batches: list[list[int]] = []
+        inbox: LoopInbox = LoopInbox(asyncio.get_running_loop(), batches.append)
+
+        # The loop is blocked while the threads submit, so everything lands in one batch
+        run_in_threads(4, lambda t: [inbox.put(t * 1_000 + i) for i in range(1_000)])
+        await asyncio.sleep(0)
+
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(sorted(batches[0]), list(range(4_000)))
+        for t in range(4):
+            submitted: list[int] = [item for item in batches[0] if item // 1_000 == t]
+            self.assertEqual(submitted, sorted(submitted))
+
+    async def test_submit_threadsafe(self):
+        rate: int = 20
+        per: int = 200_000_000
+        totalTasks: int = 100
+        rateLimiter: RateLimiter = RateLimiter(rate, per)
+        executionLog: list[int] = []
+        futures: list[concurrent.futures.Future] = [None] * totalTasks
+
+        async def call_downstream(idx: int) -> int:
+            executionLog.append(time.monotonic_ns())
+            return idx * idx
+
+        def producer(t: int) -> None:
+            for i in range(t, totalTasks, 4):
+                futures[i] = rateLimiter.submit_threadsafe(
+                    lambda i=i: call_downstream(i)
+                )
+
+        def failing_task() -> None:
+            raise KeyError("downstream failure")
+
+        await asyncio.get_running_loop().run_in_executor(
+            None, run_in_threads, 4, producer
+        )
+        failed: concurrent.futures.Future = rateLimiter.submit_threadsafe(failing_task)
+        results: list[int] = await asyncio.gather(
+            *(asyncio.wrap_future(future) for future in futures)
+        )
+
+        self.assertEqual(results, [i * i for i in range(totalTasks)])
+        with self.assertRaises(KeyError):
+            await asyncio.wrap_future(failed)
+        for i in range(totalTasks - rate):
+            self.assertGreater(executionLog[i + rate] - executionLog[i], per)
+
+    async def test_threadsafe_push_waits_for_running_task(self):
+        rateLimiter: RateLimiter = RateLimiter(100, 1_000_000_000)
+        events: list[str] = []
+
+        async def slow_task() -> None:
+            events.append("slow started")
+            await asyncio.sleep(0.2)
+            events.append("slow done")
+
+        rateLimiter.push_threadsafe(slow_task)
+        await asyncio.sleep(0.05)
+        # The queue is empty while the slow task runs, the drain is still going
+        run_in_threads(
+            2, lambda t: rateLimiter.push_threadsafe(lambda: events.append("fast"))
+        )
+        await asyncio.sleep(0.05)
+        await rateLimiter.push(lambda: events.append("pushed"))
+        await asyncio.sleep(0.3)
+
+        # Tasks run one at a time in the serialized mode, in queue order
+        self.assertEqual(
+            events, ["slow started", "slow done", "fast", "fast", "pushed"]
+        )
+        self.assertFalse(rateLimiter.draining)
+
+        # A retry falling due while the slow task runs waits for it too
+        rateLimiter = RateLimiter(
+            100,
+            1_000_000_000,
+            retry=RetryPolicy(max_attempts=2, base_delay_ns=50_000_000, jitter="NONE"),
+        )
+        events.clear()
+
+        def fail_once() -> None:
+            events.append("attempt")
+            if events.count("attempt") == 1:
+                raise ConnectionError("boom")
+
+        handle = await rateLimiter.submit(fail_once)
+        rateLimiter.push_threadsafe(slow_task)
+        await handle
+        self.assertEqual(events, ["attempt", "slow started", "slow done", "attempt"])
+
+    async def test_timer_start_and_stop_threadsafe(self):
+        counter: int = 0
+
+        def increment_counter():
+            nonlocal counter
+            counter += 1
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        timer: Timer = Timer(100_000_000, increment_counter, tick_mode="CALL_AT")
+        started: concurrent.futures.Future = await loop.run_in_executor(
+            None, timer.start_threadsafe
+        )
+        self.assertTrue(await asyncio.wrap_future(started))
+        await asyncio.sleep(0.55)
+        stopped: concurrent.futures.Future = await loop.run_in_executor(
+            None, timer.stop_threadsafe
+        )
+        self.assertTrue(await asyncio.wrap_future(stopped))
+        await asyncio.sleep(0.2)
+
+        self.assertEqual(counter, 5)
+
+    def test_unbound_limiter_rejects_threadsafe_push(self):
+        rateLimiter: RateLimiter = RateLimiter(1, 1_000_000_000)
+        self.assertRaises(RuntimeError, rateLimiter.push_threadsafe, lambda: None)
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
+)
+from Timer import Timer
+from TimerWheel import TimerWheel
+
+
+class TimerWheelTests(unittest.IsolatedAsyncioTestCase):
+    async def test_entries_fire_in_order_and_never_early(self):
+        # A tiny wheel forces entries through the upper levels and the overflow bucket
+        wheel: TimerWheel = TimerWheel(tick_ns=1_000_000, wheel_size=4, levels=2)
+        fired: list[tuple[int, int]] = []
+
+        def on_expiry(deadline_ns: int) -> None:
+            fired.append((deadline_ns, time.monotonic_ns()))
+
+        start: int = time.monotonic_ns()
+        delays_ms: list[int] = [1, 3, 5, 9, 17, 40, 70]
+        for delay in reversed(delays_ms):
+            wheel.schedule(start + delay * 1_000_000, on_expiry)
+
+        await asyncio.sleep(0.2)
+
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(
+            [deadline for deadline, _ in fired],
+            [start + delay * 1_000_000 for delay in delays_ms],
+        )
+        for deadline, fired_at in fired:
+            self.assertGreaterEqual(fired_at, deadline)
+
+    async def test_cancelled_entries_do_not_fire(self):
+        wheel: TimerWheel = TimerWheel()
+        fired: list[int] = []
+        now: int = time.monotonic_ns()
+        entries = [
+            wheel.schedule(now + i * 10_000_000, fired.append) for i in range(1, 6)
+        ]
+
+        self.assertTrue(wheel.cancel(entries[1]))
+        self.assertFalse(wheel.cancel(entries[1]))
+        wheel.reschedule(entries[3], now + 200_000_000)
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(fired, [now + 10_000_000, now + 30_000_000, now + 50_000_000])
+        self.assertEqual(len(wheel), 1)
+        wheel.cancel(entries[3])
+        self.assertIsNone(wheel.wakeup_handle)
+
+    async def test_many_timers_share_the_wheel(self):
+        wheel: TimerWheel = TimerWheel(tick_ns=5_000_000)
+        timeoutInSecs: float = 0.1
+        totalTestDurationInSecs: float = 1.05
+        expectedTics: int = int(totalTestDurationInSecs // timeoutInSecs)
+        counter: list[int] = [0] * 1000
+
+        def increment_counter(idx: int) -> None:
+            counter[idx] += 1
+
+        timers: list[Timer] = [
+            Timer(
+                int(timeoutInSecs * 1_000_000_000),
+                lambda idx=i: increment_counter(idx),
+                wheel=wheel,
+            )
+            for i in range(len(counter))
+        ]
+        for timer in timers:
+            timer.start()
+        await asyncio.sleep(totalTestDurationInSecs)
+        for timer in timers:
+            timer.stop()
+
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(counter, [expectedTics] * len(counter))
+
+    async def test_wheel_timer_overrun_and_stop(self):
+        wheel: TimerWheel = TimerWheel()
+        timeoutInSecs: float = 0.2
+        totalTestDurationInSecs: float = 1.6
+        expectedTics: int = int(totalTestDurationInSecs // timeoutInSecs) // 2
+        counter: int = 0
+
+        async def increment_counter():
+            # Overruns the next tick, which must be skipped
+            nonlocal counter
+            counter += 1
+            await asyncio.sleep(0.3)
+
+        timer: Timer = Timer(
+            int(timeoutInSecs * 1_000_000_000), increment_counter, wheel=wheel
+        )
+        timer.start()
+        await asyncio.sleep(totalTestDurationInSecs)
+        timer.stop()
+        await asyncio.sleep(0.5)
+
+        self.assertEqual(counter, expectedTics)
+
+    async def test_wheel_timer_fixed_delay(self):
+        wheel: TimerWheel = TimerWheel()
+        counter: int = 0
+
+        async def increment_counter():
+            nonlocal counter
+            counter += 1
+            await asyncio.sleep(0.1)
+
+        timer: Timer = Timer(
+            200_000_000, increment_counter, schedule_policy="FIXED_DELAY", wheel=wheel
+        )
+        timer.start()
+        await asyncio.sleep(1.3)
+        timer.stop()
+
+        self.assertEqual(counter, 4)
@@ -1,13 +1,16 @@
 import asyncio
 import os
 import sys
+import time
 import unittest
 from datetime import datetime
 
 sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/asyncio_utils"))
 )
+from Clock import SimulatedEventLoop, loop_clock
 from Timer import Timer
+from TimerWheel import TimerWheel
 
 
 async def startAndStopTimer(timer: Timer, sleepInterval: int) -> int:
@@ -17,6 +20,11 @@ async def startAndStopTimer(timer: Timer, sleepInterval: int) -> int:
     timer.stop()
 
 
+def run_simulated(main) -> None:
+    with asyncio.Runner(loop_factory=SimulatedEventLoop) as runner:
+        runner.run(main())
+
+
 class TimerTests(unittest.IsolatedAsyncioTestCase):
     async def test_timer_starts_and_stops(self):
         timeoutInSecs: float = 1.5
@@ -128,3 +136,146 @@ class TimerTests(unittest.IsolatedAsyncioTestCase):
         )
         await startAndStopTimer(timer, totalTestDurationInSecs)
         self.assertEqual(counter, expectedTics)
+
+    # Test for the CALL_AT tick mode with sync and async callbacks
+    async def test_call_at_tick_mode(self):
+        timeoutInSecs: float = 0.2
+        totalTestDurationInSecs: float = 1.1
+        expectedTics: int = int(totalTestDurationInSecs // timeoutInSecs)
+        counter: list[int] = [0, 0]
+
+        def sync_increment_counter():
+            counter[0] += 1
+
+        async def async_increment_counter():
+            counter[1] += 1
+            await asyncio.sleep(0.05)
+
+        timers: list[Timer] = [
+            Timer(int(timeoutInSecs * 1_000_000_000), callback, tick_mode="CALL_AT")
+            for callback in (sync_increment_counter, async_increment_counter)
+        ]
+        await asyncio.gather(
+            *(startAndStopTimer(timer, totalTestDurationInSecs) for timer in timers)
+        )
+        await asyncio.sleep(2 * timeoutInSecs)
+
+        self.assertEqual(counter, [expectedTics, expectedTics])
+        self.assertRaises(
+            ValueError, Timer, 1_000_000, sync_increment_counter, tick_mode="SLEEP"
+        )
+
+    # A blocking callback run in a thread neither stalls other timers nor overlaps
+    async def test_executor_offload(self):
+        running: list[int] = [0, 0]
+        heartbeats: list[int] = [0]
+
+        def blocking():
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+            time.sleep(0.15)
+            running[0] -= 1
+
+        def heartbeat():
+            heartbeats[0] += 1
+
+        for tick_mode in ("TASK", "CALL_AT"):
+            running[1] = heartbeats[0] = 0
+            slow: Timer = Timer(
+                50_000_000, blocking, tick_mode=tick_mode, executor="THREAD"
+            )
+            fast: Timer = Timer(20_000_000, heartbeat, tick_mode=tick_mode)
+            await asyncio.gather(startAndStopTimer(slow, 1), startAndStopTimer(fast, 1))
+            self.assertEqual(running[1], 1)
+            self.assertGreaterEqual(heartbeats[0], 40)
+        await asyncio.sleep(0.2)
+        self.assertRaises(ValueError, Timer, 1_000_000, blocking, executor="FIBER")
+
+
+class TimerSimulatedTests(unittest.TestCase):
+    def test_slack_coalesces_wakeups(self):
+        async def main():
+            clock = loop_clock()
+            period: int = 1_000_000_000
+            slack: int = 100_000_000
+            for mode in ("TASK", "CALL_AT", "WHEEL"):
+                wheel: TimerWheel | None = (
+                    TimerWheel(1_000_000) if mode == "WHEEL" else None
+                )
+                fires: list[int] = []
+                timers: list[Timer] = []
+                # 100 timers started over 100ms, each with its own phase
+                for _ in range(100):
+                    timers.append(
+                        Timer(
+                            period,
+                            lambda: fires.append(clock.monotonic_ns()),
+                            tick_mode="CALL_AT" if mode == "CALL_AT" else "TASK",
+                            wheel=wheel,
+                            metrics=True,
+                            slack_ns=slack,
+                        )
+                    )
+                    timers[-1].start()
+                    await asyncio.sleep(0.001)
+                await asyncio.sleep(5.05)
+                for timer in timers:
+                    timer.stop()
+
+                # Five ticks each, from at most two wakeups per period
+                self.assertEqual(len(fires), 500)
+                self.assertLessEqual(len(set(fires)), 10)
+                coalesced: int = sum(timer.metrics.coalesced_ticks for timer in timers)
+                self.assertEqual(coalesced, len(fires) - len(set(fires)))
+                lateness: int = max(timer.metrics.tick_lateness.max for timer in timers)
+                self.assertLessEqual(lateness, slack + 2_000_000)
+                self.assertEqual(
+                    sum(timer.metrics.skipped_ticks for timer in timers), 0
+                )
+
+            self.assertRaises(ValueError, Timer, period, print, slack_ns=-1)
+
+        run_simulated(main)
+
+    def test_jitter_spreads_timers(self):
+        async def main():
+            clock = loop_clock()
+            period: int = 1_000_000_000
+            fires: dict[int, list[int]] = {index: [] for index in range(50)}
+            timers: list[Timer] = [
+                Timer(
+                    period,
+                    lambda index=index: fires[index].append(clock.monotonic_ns()),
+                    jitter_ns=period,
+                    jitter_key=f"peer-{index}",
+                )
+                for index in range(50)
+            ]
+            started: int = clock.monotonic_ns()
+            for timer in timers:
+                timer.start()
+            await asyncio.sleep(3.5)
+            for timer in timers:
+                timer.stop()
+
+            # Started together, the timers no longer tick together
+            offsets: list[int] = [fires[index][0] - started - period for index in fires]
+            self.assertTrue(all(0 <= offset < period for offset in offsets))
+            self.assertGreater(len(set(offset // 100_000_000 for offset in offsets)), 5)
+            # The offset is a phase, the period is kept
+            for index in fires:
+                self.assertTrue(
+                    all(
+                        abs(b - a - period) < 1_000
+                        for a, b in zip(fires[index], fires[index][1:])
+                    )
+                )
+            # The same key always gets the same offset
+            self.assertEqual(
+                Timer(
+                    period, print, jitter_ns=period, jitter_key="peer-7"
+                ).jitter_offset_ns,
+                timers[7].jitter_offset_ns,
+            )
+
+        run_simulated(main)